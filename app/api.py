@@ -13,10 +13,12 @@ from rest_framework.response import Response
 from rest_framework import status
 from app import gst
 from app.einvoice import change_einv_dates, create_einv_json, einv_json_to_str
+from app.einvoice_store import get_einvoices
 from custom import Session
 from custom.classes import Gst, Einvoice, IkeaDownloader, WrongCredentials  # type: ignore
 from django.http import FileResponse, HttpResponse, JsonResponse
 import app.models as models
+from app.locks import CompanyLocked, lock_companies
 from django.db import connection
 from io import BytesIO
 from django.db.models import Sum, F
@@ -25,7 +27,6 @@ from django.db.models.functions import Abs, Round
 import pandas as pd
 from custom.pdf.split import (LastPageFindMethods,
                                         split_using_last_page)
-from multiprocessing.pool import ThreadPool
 from zipfile import ZipFile, ZIP_DEFLATED
 from io import BytesIO
 
@@ -50,6 +51,22 @@ def check_login(
 
     return decorator
 
+def period_lock(func: Callable[P, R]) -> Callable[P, R | Response]:
+    """Lock the request's period of the user's companies while the view updates their sales
+    (409 if an import / another request holds it)"""
+    @wraps(func)
+    def wrapper(*args: P.args, **kwargs: P.kwargs):
+        request = args[0]
+        companies = request.user.companies.values_list("name", flat=True)  # type: ignore
+        period = request.data.get("period")
+        try:
+            with lock_companies(companies, [period] if period else None, wait=False):
+                return func(*args, **kwargs)
+        except CompanyLocked as e:
+            return Response({"error": "locked", "message": str(e)}, status=status.HTTP_409_CONFLICT)
+
+    return wrapper
+
 CLIENTS: dict[str, type] = {
     "gst": Gst,
     "einvoice": Einvoice,
@@ -134,6 +151,7 @@ def load_irns(request,gst = True,einvoice = True):
 @api_view(["POST"])
 @check_login(Einvoice)
 @check_login(Gst)
+@period_lock
 def einvoice_reload(request):
     load_irns(request)
     return Response({"ok": True})
@@ -173,6 +191,7 @@ def einvoice_stats(request):
 
 @api_view(["POST"])
 @check_login(Einvoice)
+@period_lock
 def file_einvoice(request):
     period = request.data.get("period")
     type = request.data.get("type")
@@ -286,6 +305,7 @@ def einvoice_excel(request):
 
 @api_view(["POST"])
 @check_login(Gst)
+@period_lock
 def einvoice_pdf(request):
     period = request.data.get("period")
     type = request.data.get("type")
@@ -306,25 +326,21 @@ def einvoice_pdf(request):
     if os.path.exists(f"static/{username}/bills.zip") : 
         os.remove(f"static/{username}/bills.zip")
     
-    def fetch_inv(row) :     
-        doctype = "INV" if row.type in ("sales","claimservice") else "CRN"
-        data = gst.get_einv_data( gstin , row.date.strftime("%m%Y") ,  doctype , row.inum )
-        if data is None : 
-           print(f"Einv data not found for {row.inum}")
-           return
-        c = template.Context(data | {"path" : path })
-        forms.append(tform.render(c))
-
     invs = list(qs)
+    docs = { inv.inum : ( inv.date.strftime("%m%Y") , "INV" if inv.type in ("sales","claimservice") else "CRN" , inv.inum ) for inv in invs }
+    #Stored einvoices (of the same irn) or fetched concurrently from the portal
+    einvs = get_einvoices(gst, gstin, list(docs.values()), irns = { docs[inv.inum] : inv.irn for inv in invs })
     BATCH_SIZE = 20
     files = {}
     inums_to_party = { inv.inum : (inv.party.name if inv.party else "unknown")  for inv in invs }
     for i in range(0,len(invs),BATCH_SIZE) : 
         forms = []
-        fetch_inv_pool = ThreadPool() # Fetch the invoice or retrive if availabe in DB . 
-        fetch_inv_pool.map(fetch_inv,invs[ i : min(i+BATCH_SIZE,len(invs)) ]) 
-        fetch_inv_pool.close()
-        fetch_inv_pool.join()
+        for inv in invs[ i : i+BATCH_SIZE ] : 
+            data = einvs[docs[inv.inum]]
+            if data is None : 
+               print(f"Einv data not found for {inv.inum}")
+               continue
+            forms.append(tform.render(template.Context(data | {"path" : path })))
         thtml = template.Template(open("app/templates/einvoice_print.html").read())
         c = template.Context({"forms" : forms , "path" : path })
         with open(f"bill.html","w+") as f : f.write( thtml.render(c) )
@@ -350,6 +366,7 @@ def einvoice_pdf(request):
 @api_view(["POST"])
 @check_login(Gst)
 @check_login(Einvoice)
+@period_lock
 def generate_gst_return(request):
     period = request.data.get("period")
     load_irns(request)
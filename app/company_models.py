@@ -14,6 +14,10 @@ class Company(models.Model):
     name = models.CharField(max_length=100, primary_key=True)
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name="companies")
     gst_types = models.JSONField(default=list,null=False,blank=False)
+    #Bumped on every write to the party / stock master (see app.master_cache)
+    party_version = models.IntegerField(default=0)
+    stock_version = models.IntegerField(default=0)
+    hsn_version = models.IntegerField(default=0) #Bumped when the hsn of a stock changes (see app.tax_summary)
 
 class UserSession(models.Model):
     user = models.CharField(max_length=50)
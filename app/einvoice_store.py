@@ -0,0 +1,53 @@
+from concurrent.futures import ThreadPoolExecutor
+import app.models as models
+from custom.classes import Gst
+
+# Decoded signed e-invoices of the portal (Gst.get_einv_data) , stored per (seller gstin , fy , doctype , inum)
+# with their irn and signed qrcode , so an e-invoice is fetched from the portal only once (a signed invoice never
+# changes for its irn). Missing ones are fetched concurrently over the logged in session (the threads only do the
+# requests , the db is read & written by the caller's thread).
+
+#Portal requests at a time
+FETCH_WORKERS = 8
+
+Doc = tuple[str, str, str]  # (period MMYYYY , doctype INV / CRN , inum)
+
+def get_einvoices(gst: Gst, seller_gstin: str, docs: list[Doc], irns: dict[Doc, str] | None = None,
+                  workers: int = FETCH_WORKERS) -> dict[Doc, dict | None]:
+    """Decoded e-invoice (with the qrcode) of every doc , None if the portal does not have it.
+    A stored invoice with an irn other than the one given in irns (the bill was cancelled & reissued) is fetched again"""
+    irns = irns or {}
+    keys = {doc: (Gst.einv_fy(doc[0]), doc[1], str(doc[2])) for doc in docs}
+    expected_irns = {keys[doc]: irn for doc, irn in irns.items() if doc in keys and irn}
+    stored = {
+        (document.fy, document.doctype, document.inum): document
+        for document in models.EinvoiceDocument.objects.filter(
+            seller_gstin=seller_gstin, inum__in={key[2] for key in keys.values()}
+        )
+    }
+    stored = {
+        key: document.data | {"qrcode": document.qrcode}
+        for key, document in stored.items()
+        if expected_irns.get(key, document.irn) == document.irn
+    }
+    missing = list({key: doc for doc, key in keys.items() if key not in stored}.items())
+    fetched = {}
+    if missing:
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = executor.map(lambda doc: gst.get_einv_data(seller_gstin, *doc), [doc for _, doc in missing])
+            fetched = {key: data for (key, _), data in zip(missing, results)}
+        #Not found e-invoices are not stored (they can be filed later)
+        models.EinvoiceDocument.objects.bulk_create(
+            [
+                models.EinvoiceDocument(
+                    seller_gstin=seller_gstin, fy=fy, doctype=doctype, inum=inum, irn=data.get("Irn"),
+                    data={k: v for k, v in data.items() if k != "qrcode"}, qrcode=data.get("qrcode", ""),
+                )
+                for (fy, doctype, inum), data in fetched.items()
+                if data is not None
+            ],
+            update_conflicts=True,
+            unique_fields=["seller_gstin", "fy", "doctype", "inum"],
+            update_fields=["irn", "data", "qrcode", "fetched_at"],
+        )
+    return {doc: stored[key] if key in stored else fetched.get(key) for doc, key in keys.items()}
@@ -1,28 +1,33 @@
 from abc import abstractmethod
 import abc
 from collections import defaultdict
-from concurrent.futures import ThreadPoolExecutor, as_completed
-import decimal
 import itertools
 import time
+from functools import partial
 import traceback
-import tracemalloc
 from typing import Generic, Type
 from django.db import connection, transaction
+import numpy as np
 import pandas as pd
 from app.company_models import Company
 import app.models as models
 from custom.classes import IkeaDownloader
-from app.sql import engine
+from app.sql import copy_dataframe, engine
+from app.scheduler import Task, critical_path, run_dag
+from app.instrumentation import ImportRecorder, stage
+from app.master_cache import bump_master_version_on_commit, bump_version_on_commit, master_cache
+from app.locks import lock_company, periods_between
+from app.tax_summary import refresh_bills_tax_summary, refresh_tax_summary
 from app.report_models import (
     CompanyReportModel,
+    DateReportModel,
     ArgsT,
     ReportArgs,
     DateRangeArgs,
     EmptyArgs,
     SalesRegisterReport,
 )
-from django.db.models import OuterRef, Subquery, Value, DecimalField, QuerySet
+from django.db.models import DecimalField, ExpressionWrapper, F, Max, Min, Q, QuerySet, Sum, Value
 from django.db.models.functions import Coalesce
 
 
@@ -33,21 +38,102 @@ def batch_delete(queryset: QuerySet, batch_size: int):
         queryset.model.objects.filter(pk__in=batch_pks).delete()
 
 
+def delete_sales(company: Company, args: DateRangeArgs, types: list[str]) -> dict[str, int]:
+    """Delete the sales of the types in the date range with their inventory & discount rows ,
+    one set based DELETE per table (no model objects are loaded , unlike the django collector).
+    SalesChanges are kept (they are replayed after the import). Returns the deleted row counts"""
+    quote = connection.ops.quote_name
+    deleted = {}
+    with connection.cursor() as cur:
+        cur.execute(
+            f"""DELETE FROM {quote(models.Sales._meta.db_table)}
+                WHERE company_id = %s AND date >= %s AND date <= %s AND type = ANY(%s) RETURNING inum""",
+            [company.pk, args.fromd, args.tod, list(types)],
+        )
+        bills = [row[0] for row in cur.fetchall()]
+        deleted[models.Sales.__name__] = len(bills)
+        # The bills are passed as an array (not joined with the sales table) , so the plan does not depend on
+        # table statistics , which are stale right after an import
+        for model in [models.Inventory, models.Discount]:
+            cur.execute(
+                f"DELETE FROM {quote(model._meta.db_table)} WHERE company_id = %s AND bill_id = ANY(%s)",
+                [company.pk, bills],
+            )
+            deleted[model.__name__] = cur.rowcount
+    return deleted
+
+def match_sales_returns(returns: pd.DataFrame, credit_notes: pd.DataFrame) -> tuple[pd.Series, pd.DataFrame]:
+    """Pair the sales register returns (id , date , inum , amt) with the ikea gstr1 credit notes
+    (date , original_invoice_no , credit_note_no , inv_amt : one row per line).
+    The n-th return (by amt , id) of a (date , original bill) gets its n-th credit note (by invoice amt , number).
+    Returns the credit note of every matched return (indexed by return id) and a table of exceptions :
+    unmatched returns , ambiguous matches (tied amounts , the pairing is arbitrary) and unused credit notes"""
+    #(date , bill) as one integer key shared by both sides , so grouping & merging never compare objects
+    credit_notes = credit_notes.rename(columns={"original_invoice_no": "inum"})
+    key = np.zeros(len(returns) + len(credit_notes), dtype="int64")
+    for col in ["date", "inum"]:
+        codes, uniques = pd.factorize(np.concatenate([returns[col].to_numpy(), credit_notes[col].to_numpy()]))
+        key = key * (len(uniques) + 1) + codes
+    #Amounts are Decimal objects , sorting them as floats keeps the order and avoids python comparisons
+    returns = returns[["id", "date", "inum", "amt"]].assign(key=key[: len(returns)], sort_amt=returns["amt"].astype(float))
+    returns = returns.sort_values(["sort_amt", "id"], kind="stable")
+    returns["n"] = returns.groupby("key", sort=False).cumcount()
+    returns["tied"] = returns.duplicated(["key", "sort_amt"], keep=False)
+
+    #A credit note is ordered by its lowest line amount (first line after sorting)
+    credit_notes = (
+        credit_notes.assign(key=key[len(returns):], sort_amt=credit_notes["inv_amt"].astype(float))
+        .sort_values(["sort_amt", "credit_note_no"], kind="stable")
+        .drop_duplicates(["key", "credit_note_no"])
+    )
+    credit_notes["n"] = credit_notes.groupby("key", sort=False).cumcount()
+    credit_notes["tied"] = credit_notes.duplicated(["key", "sort_amt"], keep=False)
+
+    pairs = returns.merge(
+        credit_notes[["key", "n", "date", "inum", "credit_note_no", "tied"]], on=["key", "n"], how="outer",
+        suffixes=("", "_cn"), indicator=True,
+    )
+    #Unused credit notes only have the credit note side
+    pairs["date"] = pairs["date"].where(pairs["_merge"] != "right_only", pairs["date_cn"])
+    pairs["inum"] = pairs["inum"].where(pairs["_merge"] != "right_only", pairs["inum_cn"])
+    both = (pairs["_merge"] == "both").to_numpy()
+    tied = (pairs["tied"].eq(True) | pairs["tied_cn"].eq(True)).to_numpy()
+    pairs["reason"] = np.select(
+        [pairs["_merge"] == "left_only", pairs["_merge"] == "right_only", both & tied],
+        ["unmatched", "unused_credit_note", "ambiguous"],
+        default="",
+    )
+
+    matched = pairs[both]
+    matches = pd.Series(matched["credit_note_no"].to_numpy(), index=matched["id"].astype("int64").to_numpy(),
+                        name="credit_note_no", dtype=object)
+    exceptions = (
+        pairs[pairs["reason"] != ""][["reason", "date", "inum", "id", "amt", "credit_note_no"]]
+        .astype({"id": "Int64"})
+        .sort_values(["date", "inum", "reason"], kind="stable")
+        .reset_index(drop=True)
+    )
+    return matches, exceptions
+
+
 # TODO: Strict checks
 class BaseImport(Generic[ArgsT]):
 
     arg_type: Type[ArgsT]
     model: Type[models.models.Model]
     reports: list[Type[CompanyReportModel[ArgsT]]] = []
+    #Imports whose tables this import reads or also writes (GstFilingImport runs them first)
+    depends_on: list[Type["BaseImport"]] = []
 
     @classmethod
-    def update_reports(cls, company: Company, args: ArgsT):
+    def update_reports(cls, company: Company, args: ArgsT, incremental: bool = False):
         # Update the Reports
         inserted_row_counts = {}
         for report in cls.reports:
             # TODO: Better ways to log and handle errors
+            kwargs = {"incremental": True} if incremental and issubclass(report, DateReportModel) else {}
             inserted_row_counts[report.__name__] = report.update_db(
-                IkeaDownloader(company.pk), company, args
+                IkeaDownloader(company.pk), company, args, **kwargs
             )
 
     @classmethod
@@ -63,10 +149,16 @@ class BaseImport(Generic[ArgsT]):
     @classmethod
     def run(cls, company: Company, args: ArgsT):
         cls.update_reports(company, args)
-        cls.run_atomic(company, args)
+        return cls.run_atomic(company, args)
 
 class DateImport(abc.ABC, BaseImport[DateRangeArgs]):
     arg_type = DateRangeArgs
+    #"sql" copies the reports of the period into staging tables (see basic_run) and fills the tables with
+    #INSERT .. SELECT statements , "orm" builds model objects in python (same rows)
+    engine = "sql"
+    #Re-imports delete the old sales with delete_sales (set based , also removes their discounts)
+    #instead of the django collector
+    fast_delete = False
 
     @classmethod
     @abstractmethod
@@ -74,24 +166,34 @@ class DateImport(abc.ABC, BaseImport[DateRangeArgs]):
         raise NotImplementedError("Delete before insert method not implemented")
 
     @classmethod
-    def basic_run(cls, company: Company, args: DateRangeArgs):
+    def basic_run(cls, company: Company, args: DateRangeArgs) -> dict[Type[CompanyReportModel], str]:
+        """Delete the existing rows of the period and stage the reports (see stage_reports)"""
         cls.delete_before_insert(company, args)
-        # Delete the existing rows in the date range (cascading delete)
-        cur = connection.cursor()
-        fromd_str = args.fromd.strftime("%Y-%m-%d")
-        tod_str = args.tod.strftime("%Y-%m-%d")
+        return cls.stage_reports(company, args)
 
-        # Create a temp tables for the report tables (with the filtered date)
-        # Temp table name : eg: salesregister_report => salesregister_temp
-        # The table exists only for the duration of the transaction
+    @classmethod
+    def stage_reports(cls, company: Company, args: DateRangeArgs) -> dict[Type[CompanyReportModel], str]:
+        """Copy the report rows of the company & period into temp tables , indexed on (inum , date) and analyzed.
+        Temp table name : eg: salesregister_report => salesregister_temp (temp tables are not WAL logged and
+        exist only for the duration of the transaction). Returns report -> temp table"""
+        quote = connection.ops.quote_name
+        cur = connection.cursor()
+        tables = {}
         for report in cls.reports:
             db_table = report._meta.db_table
-            cur.execute(
-                f"""CREATE TEMP TABLE {db_table.replace("_report","_temp")} ON COMMIT DROP AS 
-                                SELECT * FROM {db_table} WHERE company_id = '{company.pk}' AND 
-                                                                date >= '{fromd_str}' AND date <= '{tod_str}'"""
-            )
-        return cur
+            table = db_table.replace("_report", "_temp")
+            with stage(report.__name__, "staging") as record:
+                cur.execute(f"DROP TABLE IF EXISTS {table}")  # Run again in the same transaction
+                cur.execute(
+                    f"""CREATE TEMP TABLE {table} ON COMMIT DROP AS
+                        SELECT * FROM {quote(db_table)} WHERE company_id = %s AND date >= %s AND date <= %s""",
+                    [company.pk, args.fromd, args.tod],
+                )
+                record.rows = cur.rowcount
+                cur.execute(f"CREATE INDEX ON {table} (inum, date)")
+                cur.execute(f"ANALYZE {table}")
+            tables[report] = table
+        return tables
 
 class SimpleImport(abc.ABC, BaseImport[EmptyArgs]):
     arg_type = EmptyArgs
@@ -109,19 +211,59 @@ class SalesImport(DateImport):
     reports = [models.SalesRegisterReport, models.IkeaGSTR1Report]
     model = models.Sales
     TDS_PERCENT = 2
+    #"replace" deletes & re-inserts every bill of the period , "diff" only writes the new , changed & vanished bills
+    #(by fingerprint , see run_diff)
+    mode = "replace"
+    types = ["sales", "salesreturn", "claimservice"]
 
     @classmethod
     def delete_before_insert(cls, company: Company, args: DateRangeArgs):
-        types = ["sales", "salesreturn", "claimservice"]
+        types = cls.types
+        if cls.fast_delete:
+            delete_sales(company, args, types)
+            return
         inums_qs = cls.model.objects.filter(company=company).filter(
             date__gte=args.fromd, date__lte=args.tod, type__in=types
         )
+        #Discounts are not related to the sales (the collector does not cascade to them)
+        models.Discount.objects.filter(company=company, bill_id__in=inums_qs.values("inum")).delete()
         batch_delete(inums_qs, 100)
 
     @classmethod
     @transaction.atomic
-    def run_atomic(cls, company: Company, args: DateRangeArgs):
-        cls.delete_before_insert(company, args)
+    def run_atomic(cls, company: Company, args: DateRangeArgs) -> pd.DataFrame:
+        """Returns the sales return exceptions (see match_sales_returns). Unmatched returns are not imported"""
+        matches, exceptions = cls.match_returns(company, args)
+        if cls.mode == "diff":
+            written = cls.run_diff(company, args, matches)
+            #Only the written bills (unchanged bills keep their summary)
+            with stage("SalesTaxSummary", "summary") as record:
+                record.rows = refresh_bills_tax_summary(company, list(written["inum"]))
+            return exceptions
+        if cls.engine == "sql":
+            cls.run_sql(company, args, matches, cls.basic_run(company, args))
+        else:
+            cls.delete_before_insert(company, args)
+            cls.run_orm(company, args, matches)
+        with stage("SalesTaxSummary", "summary") as record:
+            record.rows = refresh_tax_summary(company, args.fromd, args.tod, cls.types)
+        return exceptions
+
+    @classmethod
+    def match_returns(cls, company: Company, args: DateRangeArgs) -> tuple[pd.Series, pd.DataFrame]:
+        returns = models.SalesRegisterReport.objects.filter(
+            company=company, date__gte=args.fromd, date__lte=args.tod, type="salesreturn"
+        ).values_list("id", "date", "inum", "amt")
+        credit_notes = models.IkeaGSTR1Report.objects.filter(
+            company=company, date__gte=args.fromd, date__lte=args.tod, type="salesreturn"
+        ).values_list("date", "original_invoice_no", "credit_note_no", "inv_amt")
+        return match_sales_returns(
+            pd.DataFrame(list(returns), columns=["id", "date", "inum", "amt"]),
+            pd.DataFrame(list(credit_notes), columns=["date", "original_invoice_no", "credit_note_no", "inv_amt"]),
+        )
+
+    @classmethod
+    def run_orm(cls, company: Company, args: DateRangeArgs, matches: pd.Series):
         sales_qs = models.SalesRegisterReport.objects.filter(
             company=company, date__gte=args.fromd, date__lte=args.tod
         )
@@ -133,62 +275,42 @@ class SalesImport(DateImport):
         sales_objs = sales_qs.filter(type="sales")
         sales_inventory_objs = inventory_qs.filter(type="sales")
 
-        # Sales Return
-        date_original_inum_to_cn: defaultdict[tuple, list[str]] = defaultdict(list)
-        salesreturn_objs = list(sales_qs.filter(type="salesreturn").order_by("amt"))
-        salesreturn_inventory_objs = list(
-            inventory_qs.filter(type="salesreturn").order_by("inv_amt")
-        )
+        # Sales Return (stored against the matched credit note)
+        salesreturn_objs = [obj for obj in sales_qs.filter(type="salesreturn") if obj.id in matches.index]
+        salesreturn_inventory_objs = list(inventory_qs.filter(type="salesreturn"))
 
         for obj in salesreturn_inventory_objs:
             obj.inum = obj.credit_note_no
             obj.txval = -obj.txval
-            inums = date_original_inum_to_cn[(obj.date, obj.original_invoice_no)]
-            if obj.inum not in inums:
-                inums.append(obj.credit_note_no)
 
         for obj in salesreturn_objs:
             obj.roundoff = -obj.roundoff
-            inums = date_original_inum_to_cn[(obj.date, obj.inum)]
-            if len(inums) == 0:
-                print(
-                    "No matching credit note found for sales register entry ",
-                    obj.inum,
-                    obj.date,
-                    "in ikea gstr1",
-                )
-            inum = inums.pop(0)
-            obj.inum = inum
+            obj.inum = matches[obj.id]
 
-        # ClaimService
+        # ClaimService : one bill per inum , aggregated by the database (amt = txval + tax - tds)
         claimservice_inventory_objs = inventory_qs.filter(type="claimservice")
-        claimservice_txval: defaultdict[str, decimal.Decimal] = defaultdict(
-            lambda: decimal.Decimal("0.000")
+        amount = lambda expression: ExpressionWrapper(expression, output_field=DecimalField())
+        claimservice_bills = (
+            claimservice_inventory_objs.order_by()
+            .values("inum")
+            .annotate(bill_date=Min("date"), bill_ctin=Max("ctin"), bill_txval=Sum("txval"),
+                      bill_tax=Sum(amount(2 * F("txval") * F("rt") / 100)))
+            .annotate(bill_tds=amount(F("bill_txval") * cls.TDS_PERCENT / 100))
+            .annotate(bill_amt=amount(F("bill_txval") + F("bill_tax") - F("bill_tds")))
         )
-        claimservice_tax: defaultdict[str, decimal.Decimal] = defaultdict(
-            lambda: decimal.Decimal("0.000")
-        )
-        for inv_obj in claimservice_inventory_objs:
-            claimservice_txval[inv_obj.inum] += inv_obj.txval
-            claimservice_tax[inv_obj.inum] += 2 * inv_obj.txval * inv_obj.rt / 100
-
-        claimservice_objs: list[SalesRegisterReport] = []
-        for inv_obj in claimservice_inventory_objs.distinct("inum"):
-            txval = claimservice_txval[inv_obj.inum]
-            tax = claimservice_tax[inv_obj.inum]
-            tds = (txval * cls.TDS_PERCENT) / 100
-
-            obj = SalesRegisterReport(
+        claimservice_objs = (
+            SalesRegisterReport(
                 company=company,
                 type="claimservice",
-                inum=inv_obj.inum,
-                date=inv_obj.date,
+                inum=bill["inum"],
+                date=bill["bill_date"],
                 party_id="HUL",
-                ctin=inv_obj.ctin,
-                amt=txval + tax - tds,
-                tds=tds,
+                ctin=bill["bill_ctin"],
+                amt=bill["bill_amt"],
+                tds=bill["bill_tds"],
             )
-            claimservice_objs.append(obj)
+            for bill in claimservice_bills.iterator()
+        )
 
         # Insert sales
         salesregister_objs = itertools.chain(
@@ -225,8 +347,7 @@ class SalesImport(DateImport):
                 other_discount=0,
             ).iterator(chunk_size=1000),
             salesreturn_objs,
-            claimservice_objs,
-        )
+        )  # Claim services have no discounts
         model_discount_objs = (
             models.Discount(
                 company_id=company.pk,
@@ -257,7 +378,7 @@ class SalesImport(DateImport):
             )
             for ikea_gstr_obj in inventory_qs.distinct("stock_id").iterator()
         )
-        models.Stock.objects.bulk_create(stock_objs,update_conflicts=True,update_fields=["hsn","rt","desc"],unique_fields=["company_id","name"])
+        master_cache.upsert(models.Stock, company, stock_objs, update_fields=["hsn","rt","desc"])
 
         # Insert inventory
         ikea_gstr_objs = itertools.chain(
@@ -278,99 +399,184 @@ class SalesImport(DateImport):
         )
         models.Inventory.objects.bulk_create(model_inventory_objs, batch_size=1000)
 
-class MarketReturnImport(DateImport):
-    reports = [models.DmgShtReport]
-    model = models.Sales
-
     @classmethod
-    def delete_before_insert(cls, company: Company, args: DateRangeArgs):
-        types = ["damage", "shortage"]
-        inums_qs = cls.model.objects.filter(company=company).filter(
-            date__gte=args.fromd, date__lte=args.tod, type__in=types
-        )
-        inums_qs.delete()
-
-    @classmethod
-    @transaction.atomic
-    def run_atomic(cls, company: Company, args: DateRangeArgs):
-        cls.delete_before_insert(company, args)
-
-        stock_rt_subquery = models.Stock.objects.filter(
-            company=company, name=OuterRef("stock_id")
-        ).values("rt")[:1]
-
-        party_ctin_subquery = (
-            models.Sales.objects.filter(company=company, party_id=OuterRef("party_id"))
-            .order_by("-date")
-            .values("ctin")[:1]
-        )
+    def run_sql(cls, company: Company, args: DateRangeArgs, matches: pd.Series, reports: dict[Type[CompanyReportModel], str],
+                targets: dict | None = None):
+        """Same inserts as run_orm , as INSERT .. SELECT statements on the staged reports (see stage_reports).
+        targets : other tables (eg: staging) to insert the sales , discount & inventory rows into (model -> table)"""
+        targets = targets or {}
+        sales = targets.get(models.Sales, models.Sales._meta.db_table)
+        discount = targets.get(models.Discount, models.Discount._meta.db_table)
+        stock = models.Stock._meta.db_table
+        inventory = targets.get(models.Inventory, models.Inventory._meta.db_table)
+        register = reports[models.SalesRegisterReport]
+        gstr1 = reports[models.IkeaGSTR1Report]
+        params = {"company": company.pk, "tds_percent": cls.TDS_PERCENT}
+        cur = connection.cursor()
 
-        market_returns = models.DmgShtReport.objects.filter(
-            return_from="market", company=company
-        ).annotate(
-            rt=Subquery(
-                stock_rt_subquery,
-                output_field=DecimalField(decimal_places=1, max_digits=3),
-            ),
-            ctin=Subquery(party_ctin_subquery, output_field=models.CharField()),
+        # Sales returns : credit note of every matched return
+        cur.execute("DROP TABLE IF EXISTS salesreturn_cn, salesregister_bills")  # Run again in the same transaction
+        cur.execute("CREATE TEMP TABLE salesreturn_cn (id bigint PRIMARY KEY, credit_note_no varchar(100)) ON COMMIT DROP")
+        copy_dataframe(
+            pd.DataFrame({"id": matches.index, "credit_note_no": matches.to_numpy()}), "salesreturn_cn", ["id", "credit_note_no"]
         )
-
-        sales_objects = {}
-        inventory_objects = []
-        for mr in market_returns:
-            ctin = mr.ctin or None  # type: ignore
-            rt = mr.rt  # type: ignore
-            if rt is None:
-                print(
-                    f"Stock HSN Rate not found for stock {mr.stock_id} , skipping entry"
-                )
-                continue
-            txval = round((float(mr.amt) * 100 / (100 + 2 * float(rt))), 3) if rt else 0
-
-            if mr.inum not in sales_objects:
-                sales_objects[mr.inum] = models.Sales(
-                    company=company,
-                    type=mr.type,
-                    inum=mr.inum,
-                    date=mr.date,
-                    party_id=mr.party_id,
-                    ctin=ctin,
-                    amt=0,
-                )
-
-            sales_objects[mr.inum].amt += mr.amt
-            inventory_objects.append(
-                models.Inventory(
-                    company=company,
-                    bill_id=mr.inum,
-                    stock_id=mr.stock_id,
-                    qty=mr.qty,
-                    rt=rt,
-                    txval=-txval,
-                )
+        cur.execute("ANALYZE salesreturn_cn")
+
+        # Sales & sales returns (returns are stored against the credit note number , with the roundoff sign flipped)
+        cur.execute(f"""
+            CREATE TEMP TABLE salesregister_bills ON COMMIT DROP AS
+            SELECT r.company_id, r.type, coalesce(cn.credit_note_no, r.inum) AS inum, r.date, r.party_id, r.amt, r.ctin,
+                   r.btpr, r.outpyt, r.ushop, r.pecom, r.other_discount,
+                   CASE WHEN r.type = 'salesreturn' THEN -r.roundoff ELSE r.roundoff END AS roundoff, r.tcs, r.tds
+            FROM {register} r LEFT JOIN salesreturn_cn cn ON cn.id = r.id
+            WHERE r.type = 'sales' OR (r.type = 'salesreturn' AND cn.id IS NOT NULL)
+        """)
+        cur.execute(f"""
+            INSERT INTO {sales} (company_id, type, inum, date, party_id, amt, ctin, discount, roundoff, tcs, tds)
+            SELECT company_id, type, inum, date, party_id, -amt, ctin,
+                   -(btpr + outpyt + ushop + pecom + other_discount), roundoff, tcs, -tds
+            FROM salesregister_bills
+        """)
+
+        # Claimservice : one bill per inum , amt = txval + tax - tds
+        cur.execute(f"""
+            INSERT INTO {sales} (company_id, type, inum, date, party_id, amt, ctin, discount, roundoff, tcs, tds)
+            SELECT company_id, 'claimservice', inum, date, 'HUL', -(txval + tax - tds), ctin,
+                   0, 0, 0, -tds
+            FROM (
+                SELECT company_id, inum, min(date) AS date, max(ctin) AS ctin, sum(txval) AS txval,
+                       sum(2 * txval * rt / 100) AS tax, sum(txval) * %(tds_percent)s / 100 AS tds
+                FROM {gstr1} WHERE type = 'claimservice'
+                GROUP BY company_id, inum
+            ) claimservice
+        """, params)
+
+        # Discount : one row per non zero discount of the sales & sales returns
+        cur.execute(f"""
+            INSERT INTO {discount} (company_id, bill_id, sub_type, amt)
+            SELECT bills.company_id, bills.inum, d.sub_type, -d.value
+            FROM salesregister_bills bills
+            CROSS JOIN LATERAL (VALUES ('btpr', bills.btpr), ('outpyt', bills.outpyt), ('ushop', bills.ushop),
+                                       ('pecom', bills.pecom), ('other_discount', bills.other_discount)) AS d(sub_type, value)
+            WHERE d.value <> 0
+        """)
+
+        # Stock : latest gstr1 row of every product (old : the hsn before the upsert , all CTEs see the same snapshot)
+        cur.execute(f"""
+            WITH old AS (
+                SELECT name, hsn FROM {stock} WHERE company_id = %s
+            ), upserted AS (
+                INSERT INTO {stock} (company_id, name, hsn, rt, "desc")
+                SELECT DISTINCT ON (stock_id) company_id, stock_id, hsn, rt, "desc"
+                FROM {gstr1}
+                ORDER BY stock_id, date DESC, id DESC
+                ON CONFLICT (company_id, name) DO UPDATE SET hsn = EXCLUDED.hsn, rt = EXCLUDED.rt, "desc" = EXCLUDED."desc"
+                WHERE ({stock}.hsn, {stock}.rt, {stock}."desc") IS DISTINCT FROM (EXCLUDED.hsn, EXCLUDED.rt, EXCLUDED."desc")
+                RETURNING name, hsn
             )
+            SELECT count(*), count(*) FILTER (WHERE upserted.hsn IS DISTINCT FROM old.hsn)
+            FROM upserted LEFT JOIN old ON old.name = upserted.name
+        """, [company.pk])
+        written, hsn_changed = cur.fetchone()
+        if written:
+            bump_master_version_on_commit(models.Stock, company.pk)
+        if hsn_changed:
+            bump_version_on_commit(company.pk, "hsn_version")
+
+        # Inventory (sales return lines go against the credit note , with negative txval)
+        cur.execute(f"""
+            INSERT INTO {inventory} (company_id, bill_id, stock_id, qty, rt, txval)
+            SELECT company_id, CASE WHEN type = 'salesreturn' THEN credit_note_no ELSE inum END, stock_id, qty, rt,
+                   CASE WHEN type = 'salesreturn' THEN -txval ELSE txval END
+            FROM {gstr1} WHERE type IN ('sales', 'salesreturn', 'claimservice')
+        """)
 
-        models.Sales.objects.bulk_create(sales_objects.values())
-        models.Inventory.objects.bulk_create(inventory_objects)
-        # Upsert stock description
-        stock_objs = (
-            models.Stock(
-                company_id=company.pk,
-                name=mr.stock_id,
-                desc=mr.desc,
+    @classmethod
+    def run_diff(cls, company: Company, args: DateRangeArgs, matches: pd.Series) -> pd.DataFrame:
+        """Build the bills in staging tables (with run_sql) , fingerprint them and compare with the stored fingerprints.
+        Only new bills are inserted , changed bills get their header updated & lines replaced and vanished bills are deleted.
+        Returns the bills that were written (inum , change)"""
+        quote = connection.ops.quote_name
+        staged = {models.Sales: "staged_sales", models.Inventory: "staged_inventory", models.Discount: "staged_discount"}
+        cur = connection.cursor()
+        cur.execute(f"DROP TABLE IF EXISTS {', '.join(staged.values())}")
+        for model, table in staged.items():
+            cur.execute(f"CREATE TEMP TABLE {table} (LIKE {quote(model._meta.db_table)} INCLUDING DEFAULTS INCLUDING IDENTITY) ON COMMIT DROP")
+        cls.run_sql(company, args, matches, cls.stage_reports(company, args), staged)
+        for table in staged.values():
+            cur.execute(f"ANALYZE {table}")
+
+        # Fingerprint : md5 of the header and the sorted inventory & discount lines (quote_nullable keeps NULL and '' apart)
+        text = lambda *cols: "concat_ws('|', " + ", ".join(f"quote_nullable({col})" for col in cols) + ")"
+        cur.execute(f"""
+            WITH lines AS (
+                SELECT bill_id, string_agg({text("stock_id", "qty", "rt", "txval")}, ';' ORDER BY stock_id, qty, rt, txval) AS text
+                FROM staged_inventory GROUP BY bill_id
+            ), discounts AS (
+                SELECT bill_id, string_agg({text("sub_type", "amt")}, ';' ORDER BY sub_type, amt) AS text
+                FROM staged_discount GROUP BY bill_id
+            ), fingerprints AS (
+                SELECT s.inum, md5({text("s.type", "s.date", "s.party_id", "s.amt", "s.ctin", "s.discount", "s.roundoff", "s.tcs", "s.tds")}
+                                   || '#' || coalesce(lines.text, '') || '#' || coalesce(discounts.text, '')) AS fingerprint
+                FROM staged_sales s LEFT JOIN lines ON lines.bill_id = s.inum LEFT JOIN discounts ON discounts.bill_id = s.inum
             )
-            for mr in market_returns.distinct("stock_id").iterator()
-        )
-        models.Stock.objects.bulk_create(
-            stock_objs,
-            update_conflicts=True,
-            update_fields=["desc"],
-            unique_fields=["company_id", "name"],
-        )
+            UPDATE staged_sales s SET fingerprint = f.fingerprint FROM fingerprints f WHERE f.inum = s.inum
+        """)
+
+        # Stored bills of the period (and bills of the staging stored outside it , which are updated instead of inserted)
+        sales = quote(models.Sales._meta.db_table)
+        cur.execute(f"""
+            SELECT coalesce(new.inum, old.inum),
+                   CASE WHEN old.inum IS NULL THEN 'new' WHEN new.inum IS NULL THEN 'deleted'
+                        WHEN old.fingerprint IS DISTINCT FROM new.fingerprint THEN 'changed' ELSE 'unchanged' END
+            FROM staged_sales new FULL JOIN (
+                SELECT inum, fingerprint FROM {sales}
+                WHERE company_id = %(company)s AND ((date >= %(fromd)s AND date <= %(tod)s AND type = ANY(%(types)s))
+                                                    OR inum IN (SELECT inum FROM staged_sales))
+            ) old ON old.inum = new.inum
+        """, {"company": company.pk, "fromd": args.fromd, "tod": args.tod, "types": cls.types})
+        diff = pd.DataFrame(cur.fetchall(), columns=["inum", "change"])
+        bills = {change: list(group["inum"]) for change, group in diff.groupby("change")}
+        new, changed, deleted = bills.get("new", []), bills.get("changed", []), bills.get("deleted", [])
+
+        # Lines of the changed & deleted bills , then the deleted bills
+        for model in [models.Inventory, models.Discount]:
+            cur.execute(f"DELETE FROM {quote(model._meta.db_table)} WHERE company_id = %s AND bill_id = ANY(%s)",
+                        [company.pk, changed + deleted])
+        cur.execute(f"DELETE FROM {sales} WHERE company_id = %s AND inum = ANY(%s)", [company.pk, deleted])
+
+        # Changed headers are updated in place (irn , gst_period etc. are kept) , new bills are inserted
+        header = ["type", "date", "party_id", "amt", "ctin", "discount", "roundoff", "tcs", "tds", "fingerprint"]
+        cur.execute(f"""
+            UPDATE {sales} t SET {", ".join(f"{quote(col)} = s.{quote(col)}" for col in header)}
+            FROM staged_sales s WHERE t.company_id = %s AND t.inum = s.inum AND s.inum = ANY(%s)
+        """, [company.pk, changed])
+        columns = ", ".join(quote(col) for col in ["company_id", "inum"] + header)
+        cur.execute(f"INSERT INTO {sales} ({columns}) SELECT {columns} FROM staged_sales WHERE inum = ANY(%s)", [new])
+
+        # Lines of the new & changed bills. Inventory lines without a bill (eg: an unused credit note) are replaced
+        cur.execute(f"""
+            SELECT DISTINCT bill_id FROM staged_inventory i
+            WHERE NOT EXISTS (SELECT 1 FROM staged_sales s WHERE s.inum = i.bill_id)
+                  AND NOT EXISTS (SELECT 1 FROM {sales} s WHERE s.company_id = %s AND s.inum = i.bill_id)
+        """, [company.pk])
+        unbilled = [row[0] for row in cur.fetchall()]
+        cur.execute(f"DELETE FROM {quote(models.Inventory._meta.db_table)} WHERE company_id = %s AND bill_id = ANY(%s)",
+                    [company.pk, unbilled])
+        for model, table in [(models.Inventory, "staged_inventory"), (models.Discount, "staged_discount")]:
+            columns = ", ".join(quote(field.column) for field in model._meta.concrete_fields if field.column and not field.primary_key)
+            cur.execute(f"""INSERT INTO {quote(model._meta.db_table)} ({columns})
+                            SELECT {columns} FROM {table} WHERE bill_id = ANY(%s) ORDER BY id""",
+                        [new + changed + (unbilled if model is models.Inventory else [])])
+
+        counts = diff["change"].value_counts()
+        print(f"{cls.__name__} diff :", " , ".join(f"{counts.get(change, 0)} {change}" for change in ["new", "changed", "deleted", "unchanged"]))
+        return diff[diff["change"] != "unchanged"].reset_index(drop=True)
 
 class StockImport(SimpleImport):
     reports = [models.StockHsnRateReport]
     model = models.Stock
+    depends_on = [SalesImport] #Both upsert stock hsn/rt , the stock master wins
     delete_all = False
 
     @classmethod
@@ -387,14 +593,173 @@ class StockImport(SimpleImport):
                 company=company
             ).iterator()
         )
-        models.Stock.objects.bulk_create(
-            objs,
-            batch_size=2000,
-            update_conflicts=True,
-            update_fields=["hsn", "rt"],
-            unique_fields=["company_id", "name"],
+        master_cache.upsert(models.Stock, company, objs, update_fields=["hsn", "rt"], batch_size=2000)
+
+class MarketReturnImport(DateImport):
+    reports = [models.DmgShtReport]
+    model = models.Sales
+    depends_on = [SalesImport, StockImport] #Party ctin from sales , tax rate from stock
+    types = ["damage", "shortage"]
+
+    @classmethod
+    def delete_before_insert(cls, company: Company, args: DateRangeArgs):
+        types = cls.types
+        if cls.fast_delete:
+            delete_sales(company, args, types)
+            return
+        inums_qs = cls.model.objects.filter(company=company).filter(
+            date__gte=args.fromd, date__lte=args.tod, type__in=types
+        )
+        models.Discount.objects.filter(company=company, bill_id__in=inums_qs.values("inum")).delete()
+        inums_qs.delete()
+
+    @classmethod
+    def latest_party_ctin(cls, company: Company, party_ids: list[str]) -> dict[str, str | None]:
+        """ctin of the latest sale of every party (one DISTINCT ON query , instead of a subquery per row)"""
+        qs = (
+            models.Sales.objects.filter(company=company, party_id__in=party_ids)
+            .order_by("party_id", "-date")
+            .distinct("party_id")
+            .values_list("party_id", "ctin")
+        )
+        return dict(qs)
+
+    @classmethod
+    @transaction.atomic
+    def run_atomic(cls, company: Company, args: DateRangeArgs):
+        if cls.engine == "sql":
+            cls.run_sql(company, args, cls.basic_run(company, args))
+        else:
+            cls.delete_before_insert(company, args)
+            cls.run_orm(company, args)
+        with stage("SalesTaxSummary", "summary") as record:
+            record.rows = refresh_tax_summary(company, args.fromd, args.tod, cls.types)
+
+    @classmethod
+    def run_orm(cls, company: Company, args: DateRangeArgs):
+        market_returns = pd.DataFrame(
+            models.DmgShtReport.objects.filter(
+                return_from="market", company=company, date__gte=args.fromd, date__lte=args.tod
+            )
+            .order_by("id")
+            .values("inum", "type", "date", "party_id", "stock_id", "desc", "qty", "amt")
+        )
+        if market_returns.empty:
+            return
+
+        # Lookup maps , built once per import
+        stock_rt = {name: stock["rt"] for name, stock in master_cache.rows(models.Stock, company.pk).items()}
+        party_ctin = cls.latest_party_ctin(company, list(market_returns["party_id"].unique()))
+
+        # Upsert stock description (for every returned product)
+        stocks = market_returns.drop_duplicates(subset="stock_id")
+        master_cache.upsert(
+            models.Stock,
+            company,
+            (models.Stock(company_id=company.pk, name=stock_id, desc=desc)
+             for stock_id, desc in zip(stocks["stock_id"], stocks["desc"])),
+            update_fields=["desc"],
         )
 
+        market_returns["rt"] = market_returns["stock_id"].map(stock_rt)
+        missing_rt = market_returns["rt"].isna()
+        for stock_id in market_returns.loc[missing_rt, "stock_id"]:
+            print(
+                f"Stock HSN Rate not found for stock {stock_id} , skipping entry"
+            )
+        market_returns = market_returns[~missing_rt]
+
+        rt = market_returns["rt"].astype(float)
+        amt = market_returns["amt"].astype(float)
+        market_returns["txval"] = np.where(rt != 0, np.round(amt * 100 / (100 + 2 * rt), 3), 0)
+        market_returns["ctin"] = market_returns["party_id"].map(party_ctin).replace({"": None})
+
+        #Bill header from the first row of the bill (like before) , amount summed over all its rows
+        bills = market_returns.drop_duplicates(subset="inum").set_index("inum")[["type", "date", "party_id", "ctin"]]
+        bills["amt"] = market_returns.groupby("inum", sort=False)["amt"].sum()
+        models.Sales.objects.bulk_create(
+            models.Sales(
+                company_id=company.pk,
+                type=bill.type,
+                inum=inum,
+                date=bill.date,
+                party_id=bill.party_id,
+                ctin=None if pd.isna(bill.ctin) else bill.ctin,
+                amt=bill.amt,
+            )
+            for inum, bill in zip(bills.index, bills.itertuples(index=False))
+        )
+        models.Inventory.objects.bulk_create(
+            models.Inventory(
+                company_id=company.pk,
+                bill_id=row.inum,
+                stock_id=row.stock_id,
+                qty=row.qty,
+                rt=row.rt,
+                txval=-row.txval,
+            )
+            for row in market_returns.itertuples(index=False)
+        )
+
+    @classmethod
+    def run_sql(cls, company: Company, args: DateRangeArgs, reports: dict[Type[CompanyReportModel], str]):
+        """Same inserts as run_orm , as INSERT .. SELECT statements on the staged report"""
+        quote = connection.ops.quote_name
+        sales = quote(models.Sales._meta.db_table)
+        inventory = quote(models.Inventory._meta.db_table)
+        stock = quote(models.Stock._meta.db_table)
+        dmgsht = reports[models.DmgShtReport]
+        params = {"company": company.pk}
+        cur = connection.cursor()
+
+        # Market returns with the tax rate of the product (rows without a rate are skipped).
+        # txval is rounded in double precision , half to even (like numpy in run_orm)
+        cur.execute("DROP TABLE IF EXISTS market_returns")
+        cur.execute(f"""
+            CREATE TEMP TABLE market_returns ON COMMIT DROP AS
+            SELECT r.id, r.inum, r.type, r.date, r.party_id, r.stock_id, r.qty, r.amt, s.rt,
+                   CASE WHEN s.rt <> 0 THEN round(r.amt::float8 * 100 / (100 + 2 * s.rt::float8) * 1000) / 1000
+                        ELSE 0 END AS txval
+            FROM {dmgsht} r LEFT JOIN {stock} s ON s.company_id = %(company)s AND s.name = r.stock_id
+            WHERE r.return_from = 'market'
+        """, params)
+        cur.execute("SELECT stock_id FROM market_returns WHERE rt IS NULL ORDER BY id")
+        for (stock_id,) in cur.fetchall():
+            print(
+                f"Stock HSN Rate not found for stock {stock_id} , skipping entry"
+            )
+        cur.execute("DELETE FROM market_returns WHERE rt IS NULL")
+        cur.execute("ANALYZE market_returns")
+
+        # Bill header from the first row of the bill , amount summed over all its rows ,
+        # ctin of the latest sale of the party
+        cur.execute(f"""
+            INSERT INTO {sales} (company_id, type, inum, date, party_id, ctin, amt, discount, roundoff, tcs, tds)
+            SELECT %(company)s, first.type, first.inum, first.date, first.party_id, nullif(party.ctin, ''), bills.amt, 0, 0, 0, 0
+            FROM (SELECT DISTINCT ON (inum) inum, type, date, party_id FROM market_returns ORDER BY inum, id) first
+            JOIN (SELECT inum, sum(amt) AS amt FROM market_returns GROUP BY inum) bills ON bills.inum = first.inum
+            LEFT JOIN (
+                SELECT DISTINCT ON (party_id) party_id, ctin FROM {sales}
+                WHERE company_id = %(company)s AND party_id IN (SELECT party_id FROM market_returns)
+                ORDER BY party_id, date DESC
+            ) party ON party.party_id = first.party_id
+        """, params)
+        cur.execute(f"""
+            INSERT INTO {inventory} (company_id, bill_id, stock_id, qty, rt, txval)
+            SELECT %(company)s, inum, stock_id, qty, rt, -txval FROM market_returns ORDER BY id
+        """, params)
+
+        # Upsert stock description (for every returned product)
+        cur.execute(f"""
+            INSERT INTO {stock} (company_id, name, "desc")
+            SELECT DISTINCT ON (stock_id) %(company)s, stock_id, "desc" FROM {dmgsht}
+            WHERE return_from = 'market' ORDER BY stock_id, id
+            ON CONFLICT (company_id, name) DO UPDATE SET "desc" = EXCLUDED."desc"
+            WHERE {stock}."desc" IS DISTINCT FROM EXCLUDED."desc"
+        """, params)
+        if cur.rowcount:
+            bump_master_version_on_commit(models.Stock, company.pk)
+
 class PartyImport(SimpleImport):
     reports = [models.PartyReport]
     model = models.Party
@@ -415,16 +780,20 @@ class PartyImport(SimpleImport):
             )
             for obj in models.PartyReport.objects.filter(company=company).iterator()
         )
-        models.Party.objects.bulk_create(
+        master_cache.upsert(
+            models.Party,
+            company,
             objs,
-            batch_size=1000,
-            update_conflicts=True,
             update_fields=["addr", "master_code", "name", "phone", "ctin"],
-            unique_fields=["company_id", "code"],
         )
 
 
 class GstFilingImport:
+    #Peak memory of the stages (tracemalloc slows down allocation heavy code a little)
+    trace_memory = True
+    #The company & periods of the import are locked (see app/locks.py) , waiting lock_timeout seconds
+    #for a running import / irn load of the same periods (None waits until it is done)
+    lock_timeout: float | None = None
     imports: list[Type[BaseImport]] = [
         SalesImport,
         PartyImport,
@@ -434,48 +803,137 @@ class GstFilingImport:
 
     @classmethod
     def report_update_thread(
-        cls, report: CompanyReportModel, company: Company, args: ReportArgs
+        cls, report: CompanyReportModel, company: Company, args: ReportArgs, incremental: bool = False
     ):
-        inserted_count = report.update_db(IkeaDownloader(company.pk), company, args)
-        print(f"Report {report.__name__} updated")
-        return inserted_count
+        kwargs = {"incremental": True} if incremental and issubclass(report, DateReportModel) else {}
+        try:
+            inserted_count = report.update_db(IkeaDownloader(company.pk), company, args, **kwargs)  # type: ignore
+            print(f"Report {report.__name__} updated")
+            return inserted_count
+        except Exception as e:
+            # A failed report does not block the imports (they use the previously loaded rows)
+            traceback.print_exc()
+            print("Error : ",e)
+        finally:
+            connection.close() # Thread's own connection
 
     @classmethod
-    def run(cls, company: Company, args_dict: dict[Type[ReportArgs], ReportArgs]):
-        reports_to_update = []
-        start_time = time.time()
+    def import_thread(cls, import_class: Type[BaseImport], company: Company, args: ReportArgs):
+        try:
+            with stage(import_class.__name__, "import"):
+                return import_class.run_atomic(company, args)
+        finally:
+            connection.close()
+
+    @classmethod
+    def tasks(cls, company: Company, args_dict: dict[Type[ReportArgs], ReportArgs], incremental: bool = False) -> list[Task]:
+        """Report downloads & imports as a DAG : an import starts once its reports and the imports it depends on are done"""
+        tasks = []
+        reports = dict.fromkeys(report for import_class in cls.imports for report in import_class.reports)
+        for report_model in reports:
+            arg = args_dict[report_model.arg_type]  # type: ignore
+            tasks.append(Task(report_model.__name__, partial(cls.report_update_thread, report_model, company, arg, incremental)))  # type: ignore
         for import_class in cls.imports:
-            reports_to_update.extend(import_class.reports)  # type: ignore
-        with ThreadPoolExecutor(max_workers=10) as executor:
-            futures = []
-            for report_model in reports_to_update:
-                arg = args_dict[report_model.arg_type]  # type: ignore
-                futures.append(executor.submit(cls.report_update_thread, report_model, company, arg))  # type: ignore
-
-            for future in as_completed(futures):
-                try:
-                    result = future.result()  # This re-raises any exception
-                except Exception as e:
-                    traceback.print_exc()
-                    print("Error : ",e)
+            arg = args_dict[import_class.arg_type]  # type: ignore
+            depends_on = [report.__name__ for report in import_class.reports]
+            depends_on += [dep.__name__ for dep in import_class.depends_on if dep in cls.imports]
+            tasks.append(Task(import_class.__name__, partial(cls.import_thread, import_class, company, arg), depends_on))
+        return tasks
+
+    @classmethod
+    def run(cls, company: Company, args_dict: dict[Type[ReportArgs], ReportArgs], incremental: bool = False):
+        """incremental : date reports only re-fetch the days after their last loaded date (see DateReportModel.incremental_args).
+        The stages are saved as an ImportRun of the company (see app/instrumentation.py , manage.py import_runs)"""
+        recorder = ImportRecorder(trace_memory=cls.trace_memory)
+        date_args: DateRangeArgs = args_dict[DateRangeArgs]  # type: ignore
+        error = None
+        try:
+            with lock_company(company.pk, periods_between(date_args.fromd, date_args.tod), timeout=cls.lock_timeout), recorder:
+                cls.run_stages(company, args_dict, incremental)
+        except BaseException as e:
+            error = e
+            raise
+        finally:
+            try:
+                recorder.save(company, error)
+            except Exception as e:
+                print("Import run could not be saved :", e)
+
+    @classmethod
+    def run_stages(cls, company: Company, args_dict: dict[Type[ReportArgs], ReportArgs], incremental: bool = False):
+        start_time = time.time()
+        date_args:DateRangeArgs = args_dict[DateRangeArgs] # type: ignore
+        #Bills of the period before the imports , the changes of the ones the imports delete are reported as missing
+        period_bills = list(models.Sales.objects.filter(company=company, date__gte=date_args.fromd, date__lte=date_args.tod)
+                                                .values_list("inum", flat=True))
+        tasks = cls.tasks(company, args_dict, incremental)
+        results = run_dag(tasks, max_workers=10)
+        for task in tasks:
+            result = results[task.name]
+            print(task.name, "skipped" if result.skipped else round(result.duration,2))
+        path = critical_path(tasks, results)
+        print("Critical path :", " -> ".join(f"{result.name} ({result.duration:.2f}s)" for result in path))
         time_taken = round(time.time() - start_time,2)
-        print("Reports Completed in :", time_taken)
-        print("Reports Imported. Starting Data Import..")
+        print("Reports & Imports Completed in :", time_taken)
+
         for import_class in cls.imports:
-            arg = args_dict[import_class.arg_type]  # type: ignore
-            start_time = time.time()
-            import_class.run_atomic(company, arg)
-            time_taken = round(time.time() - start_time,2)
-            print(import_class.__name__, time_taken)
-        
+            error = results[import_class.__name__].error
+            if error is not None:
+                raise error
+
+        exceptions = results[SalesImport.__name__].result
+        if exceptions is not None and len(exceptions):
+            print("Sales return exceptions :")
+            print(exceptions.to_string(index=False))
+
         #Implement the changes from SalesChanges to Sales table
-        date_args:DateRangeArgs = args_dict[DateRangeArgs] # type: ignore
-        sales_changes_qs = models.SalesChanges.objects.filter(company=company,sales__date__lte = date_args.tod,
-                                                              sales__date__gte = date_args.fromd).order_by("id")
-        for change in sales_changes_qs : 
-            try :
-                sales_obj = models.Sales.objects.get(company=company,inum=change.bill_id)
-                sales_obj.__setattr__(change.field,change.new_value)
-                sales_obj.save(update_fields=[change.field])
-            except models.Sales.DoesNotExist :
-                print(f"Sales Object with inum {change.bill_id} not found for applying changes.")
+        missing_bills = cls.replay_sales_changes(company, date_args, period_bills)
+        for bill_id in missing_bills :
+            print(f"Sales Object with inum {bill_id} not found for applying changes.")
+
+    @classmethod
+    @transaction.atomic
+    def replay_sales_changes(cls, company: Company, args: DateRangeArgs, period_bills: list[str] | None = None,
+                             batch_size: int = 5000) -> list[str]:
+        """Re-apply the logged SalesChanges of the period on the imported sales.
+        Only the latest value of every (bill, field) is applied , with one UPDATE .. FROM (VALUES ..) per field & batch.
+        period_bills are the bills of the period before the import , the ones no longer in sales are returned as not found"""
+        with stage("SalesChanges", "replay") as record:
+            #Changes of the bills of the period and of the period's bills deleted by the import (sales.date is null only
+            #when there is no bill , sales__isnull checks the local columns of the composite join)
+            changes = models.SalesChanges.objects.filter(
+                Q(sales__date__range=(args.fromd, args.tod)) | Q(sales__date__isnull=True, bill_id__in=period_bills or []),
+                company=company,
+            ).order_by("id")
+            latest: dict[str, dict[str, str | None]] = defaultdict(dict) # field -> bill -> new value
+            for bill_id, field, new_value in changes.values_list("bill_id", "field", "new_value").iterator():
+                latest[field][bill_id] = new_value
+
+            sales_table = connection.ops.quote_name(models.Sales._meta.db_table)
+            missing_bills: set[str] = set()
+            redated_bills: set[str] = set()
+            cur = connection.cursor()
+            for field_name, values in latest.items():
+                field = models.Sales._meta.get_field(field_name)
+                if not field.concrete or field.primary_key:
+                    raise ValueError(f"SalesChanges field {field_name} can not be applied on Sales")
+                column = connection.ops.quote_name(field.column)
+                cast = field.cast_db_type(connection)
+                items = list(values.items())
+                for i in range(0, len(items), batch_size):
+                    batch = items[i : i + batch_size]
+                    cur.execute(
+                        f"""UPDATE {sales_table} AS sales SET {column} = changes.value::{cast}
+                            FROM (VALUES {", ".join(["(%s, %s)"] * len(batch))}) AS changes(inum, value)
+                            WHERE sales.company_id = %s AND sales.inum = changes.inum
+                            RETURNING sales.inum""",
+                        [param for item in batch for param in item] + [company.pk],
+                    )
+                    updated = {row[0] for row in cur.fetchall()}
+                    missing_bills.update(bill_id for bill_id, _ in batch if bill_id not in updated)
+                    if field_name == "date":
+                        redated_bills.update(updated)
+            record.rows = sum(len(values) for values in latest.values())
+        #The tax summary keeps the date of the bill
+        refresh_bills_tax_summary(company, sorted(redated_bills))
+        return sorted(missing_bills)
@@ -107,6 +107,8 @@ class Sales(CompanyModel, PartyVoucher, GstVoucher) :
       type = CharField(max_length=15)
       tds = decimal_field()
       tcs = decimal_field()
+      #md5 of the imported header , inventory & discount rows (diff mode imports skip unchanged bills)
+      fingerprint = CharField(max_length=32,null=True,blank=True)
       pk = CompositePrimaryKey("company", "inum")
       party = models.ForeignObject(
             "Party",
@@ -184,4 +186,52 @@ class SalesChanges(CompanyModel) :
             null=True,
             from_fields=("company", "bill_id"),
             to_fields=("company", "inum"),
-      )
\ No newline at end of file
+      )
+## Precomputed gst tax of the sales (refreshed by the imports , see app/tax_summary.py)
+
+class SalesTaxSummary(CompanyModel) : 
+      inum = CharField(max_length=20)
+      date = DateField()
+      txval = decimal_field(required=True,decimal_places=3)
+      zero_rate_txval = decimal_field(required=True,decimal_places=3)
+      cgst = decimal_field(required=True,decimal_places=3)
+      #Company.hsn_version the hsn of the tax lines were taken at
+      hsn_version = IntegerField()
+      pk = CompositePrimaryKey("company", "inum")
+      sales = models.ForeignObject(
+            "Sales",
+            on_delete=models.DO_NOTHING,
+            null=True,
+            related_name="tax_summary",
+            from_fields=("company", "inum"),
+            to_fields=("company", "inum"),
+      )
+
+class SalesTaxLine(CompanyModel) : #Non zero inventory lines of the invoice summed by hsn & rate
+      bill_id = models.CharField(max_length=20,db_index=True)
+      hsn = CharField(max_length=20,null=True)
+      rt = decimal_field(required=True,decimal_places=1)
+      qty = IntegerField() #Signed like txval
+      txval = decimal_field(required=True,decimal_places=3)
+      cgst = decimal_field(required=True,decimal_places=3)
+      sales = models.ForeignObject(
+            "Sales",
+            on_delete=models.DO_NOTHING,
+            null=True,
+            related_name="tax_lines",
+            from_fields=("company", "bill_id"),
+            to_fields=("company", "inum"),
+      )
+
+## Einvoices of the portal (see app/einvoice_store.py)
+
+class EinvoiceDocument(models.Model) : 
+      seller_gstin = CharField(max_length=15)
+      fy = CharField(max_length=7) #eg: 2025-26
+      doctype = CharField(max_length=3) #INV / CRN
+      inum = CharField(max_length=30)
+      irn = CharField(max_length=64, null=True, db_index=True) #Not unique , the portal can return the same irn for another doc number / doctype
+      data = models.JSONField() #Decoded signed invoice
+      qrcode = models.TextField(default="") #Signed qrcode
+      fetched_at = models.DateTimeField(auto_now_add=True)
+      pk = CompositePrimaryKey("seller_gstin", "fy", "doctype", "inum")
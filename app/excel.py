@@ -0,0 +1,74 @@
+import datetime
+import pandas as pd
+from pandas.api.types import is_bool, is_float, is_integer, is_scalar
+import xlsxwriter
+
+# Xlsx workbooks written in xlsxwriter's constant memory mode : every row is flushed to a temp file once the next
+# row is started , so the rows of a sheet are written strictly top to bottom (title , header , then the dataframe
+# in chunks of rows). The cells are converted like pandas' to_excel , so the workbooks look the same as before.
+
+#Rows of a dataframe converted at a time
+CHUNK_ROWS = 10000
+
+class StreamingExcelWriter:
+
+    def __init__(self, path: str):
+        self.book = xlsxwriter.Workbook(path, {"constant_memory": True})
+        self.sheets: dict[str, xlsxwriter.worksheet.Worksheet] = {}
+        self.title_format = self.book.add_format(
+            {"bold": 1, "border": 1, "align": "center", "valign": "vcenter", "fg_color": "yellow"}
+        )
+        self.header_format = self.book.add_format({"bold": 1, "border": 1, "align": "center", "valign": "top"})
+        self.date_format = self.book.add_format({"num_format": "YYYY-MM-DD"})
+        self.datetime_format = self.book.add_format({"num_format": "YYYY-MM-DD HH:MM:SS"})
+
+    def sheet(self, name: str):
+        if name not in self.sheets:
+            self.sheets[name] = self.book.add_worksheet(name)
+        return self.sheets[name]
+
+    def _cell(self, val):
+        if is_scalar(val) and pd.isna(val):
+            return None, None
+        if is_integer(val):
+            return int(val), None
+        if is_float(val):
+            return float(val), None
+        if is_bool(val):
+            return bool(val), None
+        if isinstance(val, datetime.datetime):
+            return val, self.datetime_format
+        if isinstance(val, datetime.date):
+            return val, self.date_format
+        if isinstance(val, datetime.timedelta):
+            return val.total_seconds() / 86400, None
+        return str(val), None
+
+    def write_table(self, sheet: str, row: int, col: int, title: str, df: pd.DataFrame) -> int:
+        """Write the title (merged over the columns) at row - 1 , the header at row and the rows of df below it.
+        Returns the row after the table"""
+        worksheet = self.sheet(sheet)
+        if len(df.columns) > 1:
+            worksheet.merge_range(row - 1, col, row - 1, col + len(df.columns) - 1, title, self.title_format)
+        else:
+            worksheet.write(row - 1, col, title, self.title_format)
+        for j, column in enumerate(df.columns):
+            worksheet.write(row, col + j, str(column), self.header_format)
+        row += 1
+        for start in range(0, len(df.index), CHUNK_ROWS):
+            for values in df.iloc[start : start + CHUNK_ROWS].itertuples(index=False, name=None):
+                for j, val in enumerate(values):
+                    val, fmt = self._cell(val)
+                    if val is not None:
+                        worksheet.write(row, col + j, val, fmt)
+                row += 1
+        return row
+
+    def close(self):
+        self.book.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
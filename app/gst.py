@@ -1,4 +1,6 @@
+from collections import defaultdict
 import decimal
+import itertools
 import json
 import os
 import re
@@ -24,27 +26,14 @@ from django.db.models import (
 )
 from app.fields import decimal_field
 from app.einvoice import DecimalEncoder
+from app.tax_summary import refresh_stale_tax_summary
+from app.einvoice_store import get_einvoices
+from app.excel import StreamingExcelWriter
 from django.db.models.functions import Coalesce, Round
 
 from custom.classes import Gst
 
-def addtable(writer, sheet, name, data, style="default"):
-    def style(name, df):
-        workbook = writer.book
-        worksheet = writer.sheets[sheet]
-        merge_format = workbook.add_format(
-            {
-                "bold": 1,
-                "border": 1,
-                "align": "center",
-                "valign": "vcenter",
-                "fg_color": "yellow",
-            }
-        )
-        worksheet.merge_range(
-            row - 1, col, row - 1, col + len(df.columns) - 1, name, merge_format
-        )
-
+def addtable(writer: StreamingExcelWriter, sheet, name, data, style="default"):
     if type(data) != list:
         data = [data]
         name = [name]
@@ -52,15 +41,7 @@ def addtable(writer, sheet, name, data, style="default"):
     col = 1
     for i in range(0, len(data)):
         # data[i] = data[i].dropna(axis='columns')
-        data[i].to_excel(
-            writer,
-            sheet_name=sheet,
-            startrow=row,
-            startcol=col,
-            index=(True if type(data[i]) == pd.pivot_table else False),
-        )
-        style(name[i], data[i])
-        row += 3 + len(data[i].index)
+        row = writer.write_table(sheet, row, col, name[i], data[i]) + 2
 
 def diff_dataframes(
     df1: pd.DataFrame,
@@ -95,13 +76,132 @@ def download_gst(user:models.User,period:str,gst:Gst) -> str:
     b2b = pd.DataFrame(gst.getinvs(period,"b2b"))
     b2cs = pd.DataFrame(gst.getinvs(period,"b2cs"))
     cdnr = pd.DataFrame(gst.getinvs(period,"cdnr"))    
-    writer = pd.ExcelWriter(f"static/{username}/gst_report_{period}.xlsx", engine='xlsxwriter')
+    writer = StreamingExcelWriter(f"static/{username}/gst_report_{period}.xlsx")
     addtable(writer = writer , sheet = "B2B" , name = ["B2B"]  ,  data = [ b2b ] )  
     addtable(writer = writer , sheet = "B2CS" , name = ["B2CS"] ,  data = [b2cs] )
     addtable(writer = writer , sheet = "CDNR" , name = ["CDNR"] ,  data = [cdnr] )
     writer.close()
     return b2b,b2cs,cdnr 
 
+# GSTR-1 json sections built from grouped columns (one pass over the rows of each section , no per row lookups)
+
+def invoice_items(items: pd.DataFrame) -> dict[str, list[dict]]:
+    """Rate wise items (itms) of every invoice"""
+    grouped = items.groupby(by=["inum", "rt"], as_index=False).agg(
+        {"txval": "sum", "cgst": "sum", "sgst": "sum"}
+    )
+    nums = (grouped.groupby("inum").cumcount() + 1).tolist()
+    items_by_inum = defaultdict(list)
+    for inum, num, txval, rt, cgst, sgst in zip(grouped["inum"], nums, grouped["txval"], grouped["rt"], grouped["cgst"], grouped["sgst"]):
+        items_by_inum[inum].append(
+            {
+                "num": num,
+                "itm_det": {
+                    "txval": round(abs(txval), 2),
+                    "csamt": 0,
+                    "iamt": 0,
+                    "rt": round(rt, 1),
+                    "camt": round(abs(cgst), 2),
+                    "samt": round(abs(sgst), 2),
+                },
+            }
+        )
+    return items_by_inum
+
+def registered_json(invs: pd.DataFrame, items_by_inum: dict[str, list[dict]], gst_type: str) -> list[dict]:
+    """b2b (invoices) or cdnr (credit notes) section : invoices grouped by ctin"""
+    invs = invs[(invs.gst_type == gst_type) & invs.ctin.notna()].sort_values("ctin", kind="stable")
+    dates = [date.strftime("%d-%m-%Y") for date in invs["date"]]
+    records = []
+    for inum, amt, date in zip(invs["inum"], invs["amt"], dates):
+        if gst_type == "b2b":
+            record = {"inum": inum, "val": round(abs(amt), 2), "idt": date, "pos": "33", "rchrg": "N", "inv_typ": "R"}
+        else:
+            record = {"nt_num": inum, "val": round(abs(amt), 2), "nt_dt": date, "pos": "33", "rchrg": "N", "inv_typ": "R", "ntty": "C"}
+        record["itms"] = items_by_inum.get(inum, [])
+        records.append(record)
+    key = "inv" if gst_type == "b2b" else "nt"
+    return [
+        {"ctin": ctin, key: [record for _, record in group]}
+        for ctin, group in itertools.groupby(zip(invs["ctin"], records), key=lambda pair: pair[0])
+    ]
+
+def b2cs_json(b2c_items: pd.DataFrame) -> list[dict]:
+    """b2cs section : rate wise totals of the unregistered invoices"""
+    grouped = b2c_items.groupby("rt").agg({"txval": "sum", "cgst": "sum", "sgst": "sum"})
+    return [
+        {
+            "txval": round(txval, 2),
+            "rt": round(rt, 1),
+            "camt": round(cgst, 2),
+            "samt": round(sgst, 2),
+            "iamt": 0,
+            "csamt": 0,
+            "sply_ty": "INTRA",
+            "typ": "OE",
+            "pos": "33",
+        }
+        for rt, txval, cgst, sgst in zip(grouped.index, grouped["txval"], grouped["cgst"], grouped["sgst"])
+    ]
+
+def hsn_json_items(hsn_items: pd.DataFrame) -> list[dict]:
+    """hsn section : hsn & rate wise totals. The negative totals of a rate are netted into
+    the hsn with the largest txval of the rate (only positive totals are reported)"""
+    hsn_items = hsn_items.groupby(by=["hsn", "rt"], as_index=False).agg(
+        {"txval": "sum", "qty": "sum", "cgst": "sum", "sgst": "sum"}
+    )
+    rt_wise_negative = (
+        hsn_items[hsn_items.txval < 0]
+        .groupby("rt")
+        .agg({"txval": "sum", "cgst": "sum", "sgst": "sum"})
+    )
+    max_hsn_per_rt = (
+        hsn_items.sort_values("txval")
+        .drop_duplicates(subset=["rt"], keep="last")
+        .set_index("rt")["hsn"]
+    )
+    hsn_items = hsn_items[hsn_items.txval >= 0].copy()
+    netted = hsn_items["hsn"].eq(hsn_items["rt"].map(max_hsn_per_rt)) & hsn_items["rt"].isin(rt_wise_negative.index)
+    for col in ["txval", "cgst", "sgst"]:
+        hsn_items.loc[netted, col] = hsn_items.loc[netted, col] + hsn_items.loc[netted, "rt"].map(rt_wise_negative[col])
+    return [
+        {
+            "num": num,
+            "hsn_sc": hsn,
+            "txval": round(txval, 2),
+            "qty": round(abs(qty)),
+            "rt": round(rt, 1),
+            "camt": round(cgst, 2),
+            "samt": round(sgst, 2),
+            "uqc": ("NOS" if not hsn.startswith("99") else "NA"),
+            "iamt": 0,
+            "csamt": 0,
+        }
+        for num, hsn, txval, qty, rt, cgst, sgst in zip(
+            itertools.count(1), hsn_items["hsn"], hsn_items["txval"], hsn_items["qty"], hsn_items["rt"],
+            hsn_items["cgst"], hsn_items["sgst"],
+        )
+    ]
+
+def gstr1_sections(invs: pd.DataFrame, items: pd.DataFrame, to_file_registered_invs: pd.DataFrame,
+                   extra_einvs_items: pd.DataFrame) -> tuple[list, list, list, dict]:
+    """b2b , cdnr , b2cs & hsn sections of the GSTR-1 json"""
+    items_by_inum = invoice_items(items[items.inum.isin(to_file_registered_invs.inum)])
+    b2b = registered_json(to_file_registered_invs, items_by_inum, "b2b")
+    cdnr = registered_json(to_file_registered_invs, items_by_inum, "cdnr")
+    b2cs = b2cs_json(items[items.inum.isin(invs[invs["gst_type"] == "b2c"].inum)])
+
+    # TODO: include extra invoice hsn
+    hsn_splits = [("hsn_b2b", ["b2b", "cdnr"]), ("hsn_b2c", ["b2c"])]
+    hsn = {}
+    for hsn_name, gst_types in hsn_splits:
+        hsn_items = items[items.inum.isin(invs[invs["gst_type"].isin(gst_types)].inum)]
+        #Add hsn of extra einvoices also
+        if hsn_name == "hsn_b2b":
+            hsn_items = pd.concat([hsn_items , extra_einvs_items[["inum","hsn","rt","qty","txval","cgst","sgst"]]],ignore_index=True)
+        hsn[hsn_name] = hsn_json_items(hsn_items)
+    return b2b, cdnr, b2cs, hsn
+
 def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
     os.makedirs(f"static/{user.username}", exist_ok=True)
     gstin = gst.config["gstin"]
@@ -109,7 +209,13 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
         expr, 0, output_field=decimal_field(decimal_places=3)
     )
 
-    invs_qs = models.Sales.objects.filter(gst_period=period, company__user=user).annotate(
+    #Tax of the invoices is precomputed by the imports (see app/tax_summary.py)
+    sales_qs = models.Sales.objects.filter(gst_period=period, company__user=user)
+    refreshed = refresh_stale_tax_summary(sales_qs)
+    if refreshed:
+        print(f"Tax summary refreshed for {refreshed} invoices")
+
+    invs_qs = sales_qs.annotate(
         gst_type=Case(
             When(ctin__isnull=True, then=Value("b2c")),
             default=Case(
@@ -119,27 +225,9 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
             ),
             output_field=CharField(),
         ),
-        txval=coalesce_zero(Sum("inventory__txval")),
-        zero_rate_txval=coalesce_zero(
-            Sum(
-                Case(
-                    When(inventory__rt=0, then=F("inventory__txval")),
-                    default=Value(0),
-                    output_field=decimal_field(decimal_places=3),
-                )
-            )
-        ),
-        cgst=coalesce_zero(
-            Sum(
-                Round(
-                    ExpressionWrapper(
-                        F("inventory__txval") * F("inventory__rt") / 100,
-                        output_field=decimal_field(decimal_places=3),
-                    ),
-                    precision=3,
-                )
-            )
-        ),
+        txval=coalesce_zero(F("tax_summary__txval")),
+        zero_rate_txval=coalesce_zero(F("tax_summary__zero_rate_txval")),
+        cgst=coalesce_zero(F("tax_summary__cgst")),
         name=F("party__name"),
     )
     invs_qs = invs_qs.values(
@@ -160,18 +248,8 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
     invs = pd.DataFrame(invs_qs.iterator())
 
     items_qs = (
-        models.Inventory.objects.filter(company__user=user, sales__gst_period=period)
-        .exclude(txval=0)
-        .values("company_id", "bill_id", "txval")
-        .annotate(
-            qty=F("qty")
-            * Func(F("txval"), function="SIGN", output_field=IntegerField()),
-            hsn=models.Stock.objects.filter(
-                company_id=OuterRef("company_id"), name=OuterRef("stock_id")
-            ).values("hsn")[:1],
-            cgst=Round(F("rt") * F("txval") / 100, precision=3),
-            sgst=Round(F("rt") * F("txval") / 100, precision=3),
-        )
+        models.SalesTaxLine.objects.filter(company__user=user, sales__gst_period=period)
+        .annotate(sgst=F("cgst"))
         .values("company_id", "bill_id", "qty", "hsn", "rt", "cgst", "sgst", "txval")
     )
     items = pd.DataFrame(items_qs.iterator()).rename(columns={"bill_id": "inum"})
@@ -230,10 +308,11 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
 
     #Add extra einvoices to summary
     extra_einvs_items_data = []
-    for _,row in extra.iterrows() : 
-        inum = row["inum"]
-        doctype =  "INV" if row["txval"] > 0 else "CRN"
-        inv = gst.get_einv_data( gstin , row.date.strftime("%m%Y") ,  doctype , inum )
+    extra_docs = [ (row.date.strftime("%m%Y") , "INV" if row.txval > 0 else "CRN" , row.inum) for row in extra.itertuples() ]
+    extra_einvs = get_einvoices(gst, gstin, extra_docs) #Stored or fetched concurrently
+    for doc in extra_docs : 
+        _ , doctype , inum = doc
+        inv = extra_einvs[doc]
         if inv is None :
             #TODO: Raise excpetion
             print(f"""WARNING : EINVOICE DATA NOT FOUND FOR {inum} , SKIPPING WHICH IS POPULATED IN THE PORTAL
@@ -301,7 +380,7 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
         ["company_id", "inum", "date", "name", "ctin", "amt", "txval", "cgst"]
     ]
 
-    writer = pd.ExcelWriter(f"static/{user.username}/workings_{period}.xlsx", engine="xlsxwriter")
+    writer = StreamingExcelWriter(f"static/{user.username}/workings_{period}.xlsx")
     addtable(
         writer=writer,
         sheet="Summary",
@@ -329,140 +408,9 @@ def generate(user:models.User,period:str,gst:Gst) -> dict[str,pd.DataFrame]:
     addtable(writer=writer, sheet="Detailed", name=["Detailed"], data=[detailed])
     writer.close()
 
-    items_inum_rt_grouped = items.groupby(by=["inum", "rt"], as_index=False).agg(
-        {"txval": "sum", "cgst": "sum", "sgst": "sum"}
-    )
-    items_inum_rt_grouped = items_inum_rt_grouped.set_index("inum")
     to_file_registered_inums = list(mismatch["inum"]) + list(missing["inum"])
     to_file_registered_invs = invs[invs.inum.isin(to_file_registered_inums)]
-
-    def get_items(inum):
-        items = []
-        item_row_count = 0
-        for _, item_row in items_inum_rt_grouped.loc[[inum]].iterrows():
-            item_row_count += 1
-            items.append(
-                {
-                    "num": item_row_count,
-                    "itm_det": {
-                        "txval": round(abs(item_row.txval), 2),
-                        "csamt": 0,
-                        "iamt": 0,
-                        "rt": round(item_row.rt, 1),
-                        "camt": round(abs(item_row.cgst), 2),
-                        "samt": round(abs(item_row.sgst), 2),
-                    },
-                }
-            )
-        return items
-
-    b2b_json = []
-    for ctin, invs_df in to_file_registered_invs[
-        to_file_registered_invs.gst_type == "b2b"
-    ].groupby("ctin"):
-        invs_list = []
-        for _, row in invs_df.iterrows():
-            invs_list.append(
-                {
-                    "inum": row.inum,
-                    "val": round(abs(row.amt), 2),
-                    "idt": row.date.strftime("%d-%m-%Y"),
-                    "pos": "33",
-                    "rchrg": "N",
-                    "inv_typ": "R",
-                    "itms": get_items(row.inum),
-                }
-            )
-        b2b_json.append({"ctin": ctin, "inv": invs_list})
-
-    cdnr_json = []
-    for ctin, invs_df in to_file_registered_invs[
-        to_file_registered_invs.gst_type == "cdnr"
-    ].groupby("ctin"):
-        invs_list = []
-        for _, row in invs_df.iterrows():
-            invs_list.append(
-                {
-                    "nt_num": row.inum,
-                    "val": round(abs(row.amt), 2),
-                    "nt_dt": row.date.strftime("%d-%m-%Y"),
-                    "pos": "33",
-                    "rchrg": "N",
-                    "inv_typ": "R",
-                    "ntty": "C",
-                    "itms": get_items(row.inum),
-                }
-            )
-        cdnr_json.append({"ctin": ctin, "nt": invs_list})
-
-    b2cs_json = []
-    b2c_items = items[items.inum.isin(invs[invs["gst_type"] == "b2c"].inum)]
-    b2c_items_rt_grouped = b2c_items.groupby("rt").agg(
-        {"txval": "sum", "cgst": "sum", "sgst": "sum"}
-    )
-    for rt, item_row in b2c_items_rt_grouped.iterrows():
-        b2cs_json.append(
-            {
-                "txval": round(item_row.txval, 2),
-                "rt": round(rt, 1),
-                "camt": round(item_row.cgst, 2),
-                "samt": round(item_row.sgst, 2),
-                "iamt": 0,
-                "csamt": 0,
-                "sply_ty": "INTRA",
-                "typ": "OE",
-                "pos": "33",
-            }
-        )
-
-    # TODO: include extra invoice hsn
-    hsn_splits = [("hsn_b2b", ["b2b", "cdnr"]), ("hsn_b2c", ["b2c"])]
-    hsn_json = {}
-    for hsn_name, gst_types in hsn_splits:
-        hsn_json_items = []
-        hsn_items = items[items.inum.isin(invs[invs["gst_type"].isin(gst_types)].inum)]
-        
-        #Add hsn of extra einvoices also
-        if hsn_name == "hsn_b2b":
-            hsn_items = pd.concat([hsn_items , extra_einvs_items[["inum","hsn","rt","qty","txval","cgst","sgst"]]],ignore_index=True)
-
-        hsn_items = hsn_items.groupby(by=["hsn", "rt"], as_index=False).agg(
-            {"txval": "sum", "qty": "sum", "cgst": "sum", "sgst": "sum"}
-        )
-        rt_wise_negative = (
-            hsn_items[hsn_items.txval < 0]
-            .groupby("rt")
-            .agg({"txval": "sum", "cgst": "sum", "sgst": "sum"})
-        )
-        max_hsn_per_rt = (
-            hsn_items.sort_values("txval")
-            .drop_duplicates(subset=["rt"], keep="last")
-            .set_index("rt")["hsn"]
-        )
-        row_count = 0
-        for _, row in hsn_items[hsn_items.txval >= 0].iterrows():
-            row_count += 1
-            if (row.hsn == max_hsn_per_rt.loc[row.rt]) and (
-                row.rt in rt_wise_negative.index
-            ):
-                row.txval += rt_wise_negative.loc[row.rt].txval
-                row.cgst += rt_wise_negative.loc[row.rt].cgst
-                row.sgst += rt_wise_negative.loc[row.rt].sgst
-            hsn_json_items.append(
-                {
-                    "num": row_count,
-                    "hsn_sc": row.hsn,
-                    "txval": round(row.txval, 2),
-                    "qty": round(abs(row.qty)),
-                    "rt": round(row.rt, 1),
-                    "camt": round(row.cgst, 2),
-                    "samt": round(row.sgst, 2),
-                    "uqc": ("NOS" if not row.hsn.startswith("99") else "NA"),
-                    "iamt": 0,
-                    "csamt": 0,
-                }
-            )
-        hsn_json[hsn_name] = hsn_json_items
+    b2b_json, cdnr_json, b2cs_json, hsn_json = gstr1_sections(invs, items, to_file_registered_invs, extra_einvs_items)
 
     invs["inum_prefix"] = invs.inum.str[:2]
     docs_df = invs.groupby(by=["type", "inum_prefix"], as_index=False).agg(
@@ -0,0 +1,29 @@
+from django.db import models
+from app.company_models import Company
+
+#Instrumented import runs (see app/instrumentation.py)
+
+class ImportRun(models.Model):
+    company = models.ForeignKey(Company, on_delete=models.CASCADE, related_name="import_runs")
+    started_at = models.DateTimeField()
+    duration = models.FloatField()
+    status = models.CharField(max_length=10) #ok / failed
+    error = models.TextField(null=True, blank=True)
+    peak_memory = models.BigIntegerField(null=True, blank=True) #Traced python memory (bytes)
+
+    class Meta:
+        ordering = ["-started_at"]
+
+class ImportStage(models.Model):
+    run = models.ForeignKey(ImportRun, on_delete=models.CASCADE, related_name="stages")
+    name = models.CharField(max_length=100) #Report or import class
+    kind = models.CharField(max_length=20) #fetch / preprocess / load / staging / import / replay / summary
+    start = models.FloatField() #Seconds since the start of the run
+    duration = models.FloatField()
+    rows = models.IntegerField(null=True, blank=True)
+    bytes = models.BigIntegerField(null=True, blank=True) #Downloaded
+    peak_memory = models.BigIntegerField(null=True, blank=True)
+    error = models.TextField(null=True, blank=True)
+
+    class Meta:
+        ordering = ["start"]
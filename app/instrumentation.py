@@ -0,0 +1,135 @@
+import contextvars
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+from dataclasses import dataclass
+from typing import Iterator
+from django.utils import timezone
+
+# Stage level instrumentation of an import run : wall time , rows , bytes downloaded and peak python memory
+# of every report fetch , preprocessing , db load , import and SalesChanges replay.
+# A run is recorded while an ImportRecorder is active in the current context (a context variable , so runs of other
+# companies in the same process are recorded on their own , threads started with the context copied record to it
+# , see app/scheduler.py) and saved as ImportRun / ImportStage rows (see `manage.py import_runs`).
+# Without a recorder , stage() does nothing.
+
+@dataclass
+class StageRecord:
+    name: str
+    kind: str
+    start: float = 0.0
+    end: float = 0.0
+    rows: int | None = None
+    bytes: int | None = None
+    peak_memory: int | None = None
+    error: str | None = None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+class ImportRecorder:
+    """Peak memory is tracemalloc's peak while the stage ran. The peak is only reset when no other stage (of any run
+    in the process) is running , so for stages running at the same time it is the peak of all of them (an upper bound)"""
+
+    def __init__(self, trace_memory: bool = True):
+        self.trace_memory = trace_memory
+        self.stages: list[StageRecord] = []
+        self.started_at = timezone.now()
+        self.start = time.perf_counter()
+        self.end = self.start
+        self.peak_memory: int | None = None
+        self._token: contextvars.Token | None = None
+        self._tracing = False
+
+    def __enter__(self) -> "ImportRecorder":
+        global _tracers
+        if self._token is not None:
+            raise RuntimeError("The recorder is already active")
+        if self.trace_memory:
+            with _lock:
+                #Tracing is started by the first run that traces and stopped by the last one
+                #(tracing started outside the runs is left alone)
+                if _tracers > 0 or not tracemalloc.is_tracing():
+                    if _tracers == 0:
+                        tracemalloc.start()
+                    _tracers += 1
+                    self._tracing = True
+        self.start = time.perf_counter()
+        self._token = _active.set(self)
+        return self
+
+    def __exit__(self, *exc):
+        global _tracers
+        _active.reset(self._token)
+        self._token = None
+        self.end = time.perf_counter()
+        if tracemalloc.is_tracing():
+            self.peak_memory = max((stage.peak_memory or 0 for stage in self.stages), default=0)
+        if self._tracing:
+            with _lock:
+                _tracers -= 1
+                if _tracers == 0:
+                    tracemalloc.stop()
+            self._tracing = False
+        return False
+
+    @contextmanager
+    def stage(self, name: str, kind: str) -> Iterator[StageRecord]:
+        global _running
+        record = StageRecord(name, kind)
+        with _lock:
+            if _running == 0 and tracemalloc.is_tracing():
+                tracemalloc.reset_peak()
+            _running += 1
+        record.start = time.perf_counter() - self.start
+        try:
+            yield record
+        except BaseException as e:
+            record.error = f"{type(e).__name__}: {e}"
+            raise
+        finally:
+            record.end = time.perf_counter() - self.start
+            with _lock:
+                if tracemalloc.is_tracing():
+                    record.peak_memory = tracemalloc.get_traced_memory()[1]
+                _running -= 1
+                self.stages.append(record)
+
+    def save(self, company, error: BaseException | None = None):
+        from app.import_models import ImportRun, ImportStage
+        run = ImportRun.objects.create(
+            company=company,
+            started_at=self.started_at,
+            duration=self.end - self.start,
+            status="failed" if error else "ok",
+            error=f"{type(error).__name__}: {error}" if error else None,
+            peak_memory=self.peak_memory,
+        )
+        ImportStage.objects.bulk_create(
+            ImportStage(run=run, name=stage.name, kind=stage.kind, start=stage.start, duration=stage.duration,
+                        rows=stage.rows, bytes=stage.bytes, peak_memory=stage.peak_memory, error=stage.error)
+            for stage in sorted(self.stages, key=lambda stage: stage.start)
+        )
+        return run
+
+_active: contextvars.ContextVar[ImportRecorder | None] = contextvars.ContextVar("import_recorder", default=None)
+#Stages running & runs tracing memory in the process (tracemalloc is process wide)
+_lock = threading.Lock()
+_running = 0
+_tracers = 0
+
+@contextmanager
+def stage(name: str, kind: str) -> Iterator[StageRecord]:
+    """Record a stage of the active import run (set .rows / .bytes on the yielded record)"""
+    recorder = _active.get()
+    if recorder is None:
+        yield StageRecord(name, kind)
+        return
+    with recorder.stage(name, kind) as record:
+        yield record
+
+def downloaded_bytes(fetcher: object) -> int | None:
+    """Bytes received so far by the fetcher's session (None if it does not count them)"""
+    return getattr(fetcher, "bytes_downloaded", None)
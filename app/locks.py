@@ -0,0 +1,78 @@
+import datetime
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Iterable, Iterator
+from django.db import connection
+
+# Postgres advisory locks per company and gst period (MMYYYY) , so imports , irn loads and einvoice filing of the
+# same company & period run one at a time , across threads , processes and hosts sharing the db.
+# A period lock also takes the company lock in shared mode , so a whole company lock (periods=None) waits for
+# every period of the company. The locks are session locks of the current thread's connection (re-entrant on it),
+# released on exit or when the connection closes.
+
+#Seconds between the tries while waiting with a timeout
+POLL_INTERVAL = 0.5
+
+class CompanyLocked(Exception):
+    def __init__(self, company: str, period: str | None = None):
+        self.company = company
+        self.period = period
+        super().__init__(f"Company {company} is busy" + (f" for the period {period}" if period else "") + " , try again later")
+
+def periods_between(fromd: datetime.date, tod: datetime.date) -> list[str]:
+    """Gst periods (MMYYYY) of the months from fromd to tod"""
+    periods = []
+    month = fromd.replace(day=1)
+    while month <= tod:
+        periods.append(month.strftime("%m%Y"))
+        month = (month + datetime.timedelta(days=32)).replace(day=1)
+    return periods
+
+def _acquire(company: str, period: str, shared: bool, wait: bool, timeout: float | None):
+    suffix = "_shared" if shared else ""
+    cur = connection.cursor()
+    if wait and timeout is None:
+        cur.execute(f"SELECT pg_advisory_lock{suffix}(hashtext(%s), hashtext(%s))", [company, period])
+        return
+    deadline = time.monotonic() + (timeout or 0)
+    while True:
+        cur.execute(f"SELECT pg_try_advisory_lock{suffix}(hashtext(%s), hashtext(%s))", [company, period])
+        if cur.fetchone()[0]:
+            return
+        if not wait or time.monotonic() >= deadline:
+            raise CompanyLocked(company, period or None)
+        time.sleep(POLL_INTERVAL)
+
+def _release(company: str, period: str, shared: bool):
+    suffix = "_shared" if shared else ""
+    with connection.cursor() as cur:
+        cur.execute(f"SELECT pg_advisory_unlock{suffix}(hashtext(%s), hashtext(%s))", [company, period])
+
+@contextmanager
+def _lock(company: str, period: str, shared: bool, wait: bool, timeout: float | None) -> Iterator[None]:
+    _acquire(company, period, shared, wait, timeout)
+    try:
+        yield
+    finally:
+        _release(company, period, shared)
+
+@contextmanager
+def lock_companies(companies: Iterable[str], periods: Iterable[str] | None = None,
+                   wait: bool = True, timeout: float | None = None) -> Iterator[None]:
+    """Lock the periods of the companies (or the whole companies if periods is None).
+    wait=False fails at once and wait=True with a timeout fails after timeout seconds , raising CompanyLocked.
+    Locks are always taken in the same order (company , then period) so two callers can not deadlock"""
+    periods = None if periods is None else sorted(set(periods), key=lambda period: (period[2:], period[:2]))
+    with ExitStack() as stack:
+        for company in sorted(set(companies)):
+            if periods is None:
+                stack.enter_context(_lock(company, "", False, wait, timeout))
+                continue
+            stack.enter_context(_lock(company, "", True, wait, timeout))
+            for period in periods:
+                stack.enter_context(_lock(company, period, False, wait, timeout))
+        yield
+
+def lock_company(company: str, periods: Iterable[str] | None = None,
+                 wait: bool = True, timeout: float | None = None):
+    return lock_companies([company], periods, wait, timeout)
@@ -0,0 +1,201 @@
+import datetime
+import json
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+import pandas as pd
+from app.einvoice import DecimalEncoder
+from app.gst import gstr1_sections
+
+def synthetic_return(invoices: int, seed: int = 0) -> tuple[pd.DataFrame, pd.DataFrame, pd.DataFrame, pd.DataFrame]:
+    """Invoices & items (like gst.generate reads them) , the registered invoices to file and a few extra einvoice items"""
+    rnd = random.Random(seed)
+    money = lambda low, high: Decimal(str(round(rnd.uniform(low, high), 3)))
+    hsns = [f"3401{i:04d}" for i in range(150)] + [f"9954{i:02d}" for i in range(5)] + [None]
+    parties = [f"33AAAA{i:04d}A1Z5" for i in range(invoices // 20 + 1)]
+    invs, items = [], []
+    for i in range(invoices):
+        inum = f"{rnd.choice(['AB', 'CN', 'CS'])}{i:07d}"
+        type = {"AB": "sales", "CN": "salesreturn", "CS": "claimservice"}[inum[:2]]
+        ctin = rnd.choice(parties) if rnd.random() < 0.6 else None
+        gst_type = "b2c" if ctin is None else ("b2b" if type != "salesreturn" else "cdnr")
+        sign = -1 if type == "salesreturn" else 1
+        amt = Decimal(0)
+        for _ in range(rnd.randrange(1, 6)):
+            rt = Decimal(rnd.choice(["0", "2.5", "6", "9", "14"]))
+            txval = sign * money(1, 5000) * (-1 if rnd.random() < 0.03 else 1)
+            cgst = round(txval * rt / 100, 3)
+            items.append(dict(company_id="bench", inum=inum, qty=sign * rnd.randrange(1, 50), hsn=rnd.choice(hsns),
+                              rt=rt * 2, cgst=cgst, sgst=cgst, txval=txval))
+            amt += txval + 2 * cgst
+        invs.append(dict(company_id="bench", inum=inum, date=datetime.date(2025, 4, 1) + datetime.timedelta(days=rnd.randrange(30)),
+                         ctin=ctin, type=type, amt=-amt, gst_type=gst_type))
+    invs, items = pd.DataFrame(invs), pd.DataFrame(items)
+    registered = invs[invs.gst_type.isin(["b2b", "cdnr"])]
+    to_file_registered_invs = invs[invs.inum.isin(registered.inum.sample(frac=0.5, random_state=seed))]
+    extra_einvs_items = pd.DataFrame([
+        dict(inum=f"EX{i}", qty=rnd.randrange(1, 10), hsn=rnd.choice(hsns[:-1]), rt=rnd.choice([5, 12, 18.0, 28]),
+             txval=money(1, 1000), cgst=money(0, 50), sgst=money(0, 50))
+        for i in range(20)
+    ])
+    return invs, items, to_file_registered_invs, extra_einvs_items
+
+def rowwise_sections(invs: pd.DataFrame, items: pd.DataFrame, to_file_registered_invs: pd.DataFrame,
+                     extra_einvs_items: pd.DataFrame) -> tuple[list, list, list, dict]:
+    """The sections as gst.generate built them before gstr1_sections (iterrows , a .loc lookup per invoice)"""
+    items_inum_rt_grouped = items.groupby(by=["inum", "rt"], as_index=False).agg(
+        {"txval": "sum", "cgst": "sum", "sgst": "sum"}
+    )
+    items_inum_rt_grouped = items_inum_rt_grouped.set_index("inum")
+
+    def get_items(inum):
+        items = []
+        item_row_count = 0
+        for _, item_row in items_inum_rt_grouped.loc[[inum]].iterrows():
+            item_row_count += 1
+            items.append(
+                {
+                    "num": item_row_count,
+                    "itm_det": {
+                        "txval": round(abs(item_row.txval), 2),
+                        "csamt": 0,
+                        "iamt": 0,
+                        "rt": round(item_row.rt, 1),
+                        "camt": round(abs(item_row.cgst), 2),
+                        "samt": round(abs(item_row.sgst), 2),
+                    },
+                }
+            )
+        return items
+
+    b2b_json = []
+    for ctin, invs_df in to_file_registered_invs[
+        to_file_registered_invs.gst_type == "b2b"
+    ].groupby("ctin"):
+        invs_list = []
+        for _, row in invs_df.iterrows():
+            invs_list.append(
+                {
+                    "inum": row.inum,
+                    "val": round(abs(row.amt), 2),
+                    "idt": row.date.strftime("%d-%m-%Y"),
+                    "pos": "33",
+                    "rchrg": "N",
+                    "inv_typ": "R",
+                    "itms": get_items(row.inum),
+                }
+            )
+        b2b_json.append({"ctin": ctin, "inv": invs_list})
+
+    cdnr_json = []
+    for ctin, invs_df in to_file_registered_invs[
+        to_file_registered_invs.gst_type == "cdnr"
+    ].groupby("ctin"):
+        invs_list = []
+        for _, row in invs_df.iterrows():
+            invs_list.append(
+                {
+                    "nt_num": row.inum,
+                    "val": round(abs(row.amt), 2),
+                    "nt_dt": row.date.strftime("%d-%m-%Y"),
+                    "pos": "33",
+                    "rchrg": "N",
+                    "inv_typ": "R",
+                    "ntty": "C",
+                    "itms": get_items(row.inum),
+                }
+            )
+        cdnr_json.append({"ctin": ctin, "nt": invs_list})
+
+    b2cs_json = []
+    b2c_items = items[items.inum.isin(invs[invs["gst_type"] == "b2c"].inum)]
+    b2c_items_rt_grouped = b2c_items.groupby("rt").agg(
+        {"txval": "sum", "cgst": "sum", "sgst": "sum"}
+    )
+    for rt, item_row in b2c_items_rt_grouped.iterrows():
+        b2cs_json.append(
+            {
+                "txval": round(item_row.txval, 2),
+                "rt": round(rt, 1),
+                "camt": round(item_row.cgst, 2),
+                "samt": round(item_row.sgst, 2),
+                "iamt": 0,
+                "csamt": 0,
+                "sply_ty": "INTRA",
+                "typ": "OE",
+                "pos": "33",
+            }
+        )
+
+    # TODO: include extra invoice hsn
+    hsn_splits = [("hsn_b2b", ["b2b", "cdnr"]), ("hsn_b2c", ["b2c"])]
+    hsn_json = {}
+    for hsn_name, gst_types in hsn_splits:
+        hsn_json_items = []
+        hsn_items = items[items.inum.isin(invs[invs["gst_type"].isin(gst_types)].inum)]
+
+        #Add hsn of extra einvoices also
+        if hsn_name == "hsn_b2b":
+            hsn_items = pd.concat([hsn_items , extra_einvs_items[["inum","hsn","rt","qty","txval","cgst","sgst"]]],ignore_index=True)
+
+        hsn_items = hsn_items.groupby(by=["hsn", "rt"], as_index=False).agg(
+            {"txval": "sum", "qty": "sum", "cgst": "sum", "sgst": "sum"}
+        )
+        rt_wise_negative = (
+            hsn_items[hsn_items.txval < 0]
+            .groupby("rt")
+            .agg({"txval": "sum", "cgst": "sum", "sgst": "sum"})
+        )
+        max_hsn_per_rt = (
+            hsn_items.sort_values("txval")
+            .drop_duplicates(subset=["rt"], keep="last")
+            .set_index("rt")["hsn"]
+        )
+        row_count = 0
+        for _, row in hsn_items[hsn_items.txval >= 0].iterrows():
+            row_count += 1
+            if (row.hsn == max_hsn_per_rt.loc[row.rt]) and (
+                row.rt in rt_wise_negative.index
+            ):
+                row.txval += rt_wise_negative.loc[row.rt].txval
+                row.cgst += rt_wise_negative.loc[row.rt].cgst
+                row.sgst += rt_wise_negative.loc[row.rt].sgst
+            hsn_json_items.append(
+                {
+                    "num": row_count,
+                    "hsn_sc": row.hsn,
+                    "txval": round(row.txval, 2),
+                    "qty": round(abs(row.qty)),
+                    "rt": round(row.rt, 1),
+                    "camt": round(row.cgst, 2),
+                    "samt": round(row.sgst, 2),
+                    "uqc": ("NOS" if not row.hsn.startswith("99") else "NA"),
+                    "iamt": 0,
+                    "csamt": 0,
+                }
+            )
+        hsn_json[hsn_name] = hsn_json_items
+    return b2b_json, cdnr_json, b2cs_json, hsn_json
+
+class Command(BaseCommand):
+    help = ("Check gst.gstr1_sections against the row wise builder (same json) on synthetic invoices and time them. "
+            "Usage: manage.py bench_gstr1_json --invoices 100000")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--invoices", type=int, default=100000)
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        data = synthetic_return(options["invoices"], options["seed"])
+        invs, items, to_file_registered_invs, _ = data
+        self.stdout.write(f"{len(invs)} invoices , {len(items)} items , {len(to_file_registered_invs)} registered invoices to file")
+        outputs = {}
+        for name, builder in [("columnar", gstr1_sections), ("rowwise", rowwise_sections)]:
+            start = time.perf_counter()
+            sections = builder(*data)
+            self.stdout.write(f"{name:>10} : {time.perf_counter() - start:.2f}s")
+            outputs[name] = json.dumps(dict(zip(["b2b", "cdnr", "b2cs", "hsn"], sections)), indent=4, cls=DecimalEncoder)
+        if outputs["columnar"] != outputs["rowwise"]:
+            raise CommandError("The json of the builders differ")
+        self.stdout.write(f"Both builders produce the same json ({len(outputs['columnar'])} bytes)")
@@ -0,0 +1,127 @@
+import random
+import time
+from django.core.management.base import BaseCommand, CommandError
+import numpy as np
+import pandas as pd
+from app.report_models import BaseReport, DmgShtReport, IkeaGSTR1Report, PartyReport, SalesRegisterReport
+from app.report_specs import apply_specs
+
+# The row wise preprocessing the reports had before column_specs (kept here as the baseline)
+
+def legacy_salesregister(df: pd.DataFrame) -> pd.DataFrame:
+    df["tax"] = df["Tax Amt"] - df["SRT Tax"]
+    df["amt"] = df["BillValue"] + df["CR Adj"]
+    df["other_discount"] = df["DisFin Adj"] + df["Reversed Payouts"]
+    df["type"] = df["amt"].apply(lambda x: "salesreturn" if x < 0 else "sales")
+    return df
+
+def legacy_ikeagstr1(df: pd.DataFrame) -> pd.DataFrame:
+    df["type"] = df["Transactions"].replace({ "SECONDARY BILLING" : "sales" ,
+                                              "SALES RETURN" : "salesreturn",
+                                              "CLAIMS SERVICE" : "claimservice" },inplace=False)
+    df["party_id"] = df["party_id"].fillna("HUL")
+    df["hsn"] = df["hsn"].astype(str).str.replace(".","")
+    return df
+
+def legacy_dmgsht(df: pd.DataFrame) -> pd.DataFrame:
+    df["return_from"] = df["TRANSACTION TYPE"].apply(lambda x : "rs" if x.startswith("RS") else "market")
+    df["type"] = df["TRANSACTION TYPE"].apply(lambda x : "damage" if x.endswith("DMG") else "shortage")
+    df["party_id"] = df["party_id"].fillna("HUL")
+    return df
+
+def legacy_party(df: pd.DataFrame) -> pd.DataFrame:
+    strips = lambda df,val : df.str.split(val).str[0].str.strip(" \t,")
+    df["phone"] = df["addr"].str.split("PH :").str[1].str.strip()
+    df["addr"] = strips( strips( strips( df["addr"] , "TRICHY" )  , "PH :" ) , "N.A" )
+    return df
+
+# Synthetic raw downloads (raw column names , before column_map)
+
+def raw_salesregister(rnd: random.Random, rows: int) -> pd.DataFrame:
+    money = lambda: [round(rnd.uniform(-500, 5000), 2) for _ in range(rows)]
+    df = pd.DataFrame({
+        "BillRefNo": [f"A{i:07d}" for i in range(rows)],
+        "BillDate/Sales Return Date": ["01/04/2025"] * rows,
+        "Party Code": [f"P{rnd.randrange(2000)}" for _ in range(rows)],
+        "Party Name": [f"PARTY {rnd.randrange(2000)}" for _ in range(rows)],
+        "GSTIN Number": [rnd.choice([None, "33AAAAA0000A1Z5"]) for _ in range(rows)],
+    })
+    for col in ["SchDisc", "CashDisc", "BTPR SchDisc", "OutPyt Adj", "Ushop Redemption", "Adjustments", "RoundOff",
+                "TCS Amt", "TDS-194R Per", "Tax Amt", "SRT Tax", "BillValue", "CR Adj", "DisFin Adj", "Reversed Payouts"]:
+        df[col] = money()
+    return pd.concat([df, df.iloc[:1]], ignore_index=True)  # Footer row
+
+PARTY_CODES = [None] + [f"P{i}" for i in range(2000)]
+
+def raw_ikeagstr1(rnd: random.Random, rows: int) -> pd.DataFrame:
+    transactions = ["SECONDARY BILLING"] * 8 + ["SALES RETURN", "CLAIMS SERVICE"]
+    return pd.DataFrame({
+        "Invoice No": [f"A{rnd.randrange(rows // 5 + 1):07d}" for _ in range(rows)],
+        "Invoice Date": ["01/04/2025"] * rows,
+        "Outlet Code": [rnd.choice(PARTY_CODES) for _ in range(rows)],
+        "Transactions": [rnd.choice(transactions) for _ in range(rows)],
+        "HSN": [rnd.choice([np.nan, 3401.0, 3305.9, 2106.9]) for _ in range(rows)],
+        "Taxable": [round(rnd.uniform(1, 5000), 3) for _ in range(rows)],
+    })
+
+def raw_dmgsht(rnd: random.Random, rows: int) -> pd.DataFrame:
+    types = ["RS DMG", "RS SHORTAGE", "MARKET DMG", "MARKET SHORTAGE"]
+    return pd.DataFrame({
+        "TRANS REF NO": [f"D{i:07d}" for i in range(rows)],
+        "TRANS DATE": ["2025-04-01"] * rows,
+        "RETAILER CODE": [rnd.choice(PARTY_CODES) for _ in range(rows)],
+        "TRANSACTION TYPE": [rnd.choice(types) for _ in range(rows)],
+        "QTY/FREE QTY": [rnd.randrange(1, 50) for _ in range(rows)],
+    })
+
+def raw_party(rnd: random.Random, rows: int) -> pd.DataFrame:
+    streets = [f"{i} MAIN ROAD" for i in range(300)]
+    return pd.DataFrame({
+        "PARTY NAME": [f"PARTY {i}" for i in range(rows)],
+        "PARTY CODE": [f"P{i}" for i in range(rows)],
+        "ADDRESS": [f"{rnd.choice(streets)}, {rnd.choice(['TRICHY', 'N.A', 'KARUR'])} PH : 9{rnd.randrange(10**9)}"
+                    for _ in range(rows)],
+    })
+
+BENCHMARKS = {
+    "SalesRegisterReport": (SalesRegisterReport.Report, raw_salesregister, legacy_salesregister),
+    "IkeaGSTR1Report": (IkeaGSTR1Report.Report, raw_ikeagstr1, legacy_ikeagstr1),
+    "DmgShtReport": (DmgShtReport.Report, raw_dmgsht, legacy_dmgsht),
+    "PartyReport": (PartyReport.Report, raw_party, legacy_party),
+}
+
+def best_of(repeat: int, func) -> tuple[float, pd.DataFrame]:
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        df = func()
+        timings.append(time.perf_counter() - start)
+    return min(timings), df
+
+class Command(BaseCommand):
+    help = "Benchmark the column_specs preprocessing against the old row wise code. Usage: manage.py bench_preprocessing --rows 200000"
+
+    def add_arguments(self, parser):
+        parser.add_argument("reports", nargs="*", type=str, help="Report model names (default: all)")
+        parser.add_argument("--rows", type=int, default=200000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        names = options["reports"] or list(BENCHMARKS)
+        unknown = [name for name in names if name not in BENCHMARKS]
+        if unknown:
+            raise CommandError(f"No benchmark for {', '.join(unknown)} (available: {', '.join(BENCHMARKS)})")
+
+        for name in names:
+            report, raw, legacy = BENCHMARKS[name]
+            raw_df = raw(random.Random(0), options["rows"])
+            # Only the custom step is timed , basic_preprocessing is shared by both
+            base_df = report.basic_preprocessing(raw_df.copy())
+            old_time, old_df = best_of(options["repeat"], lambda: legacy(base_df.copy()))
+            new_time, new_df = best_of(options["repeat"], lambda: BaseReport.custom_preprocessing(
+                                                                  apply_specs(base_df.copy(), report.column_specs)))
+            new_df = new_df.astype({col: object for col in new_df.columns if new_df[col].dtype == "category"})
+            pd.testing.assert_frame_equal(old_df, new_df, check_dtype=False)
+            self.stdout.write(
+                f"{name:>20} : {len(base_df)} rows , legacy {old_time:.3f}s , specs {new_time:.3f}s ({old_time / new_time:.1f}x)"
+            )
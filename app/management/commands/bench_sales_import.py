@@ -0,0 +1,168 @@
+import datetime
+import random
+import time
+from decimal import Decimal
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+import pandas as pd
+import app.models as models
+from app.company_models import Company, User
+from app.erp_import import SalesImport, match_sales_returns
+from app.report_models import DateRangeArgs
+
+BENCH_NAME = "__bench_sales_import__"
+
+def synthetic_reports(company: Company, bills: int, fromd: datetime.date, days: int = 28, seed: int = 0):
+    """Sales register & ikea gstr1 rows for bills invoices (with sales returns and claimservice bills)"""
+    rnd = random.Random(seed)
+    money = lambda low, high, places=2: Decimal(str(round(rnd.uniform(low, high), places)))
+    stocks = [(f"S{i:05d}", f"3401{i % 90:02d}", Decimal(rnd.choice(["2.5", "6.0", "9.0", "14.0"]))) for i in range(500)]
+    register, gstr1 = [], []
+    for i in range(bills):
+        inum, date = f"A{i:06d}", fromd + datetime.timedelta(days=rnd.randrange(days))
+        party = f"P{rnd.randrange(300)}"
+        ctin = rnd.choice([None, f"33AAAA{rnd.randrange(9999):04d}A1Z5"])
+        lines = [(rnd.choice(stocks), rnd.randrange(1, 20), money(10, 2000, 3)) for _ in range(rnd.randrange(1, 5))]
+        amt = sum(txval for _, _, txval in lines)
+        discounts = {key: rnd.choice([Decimal(0), money(0, 50)]) for key in ["btpr", "outpyt", "ushop", "pecom", "other_discount"]}
+        register.append(dict(inum=inum, date=date, party_id=party, party_name=None, type="sales", amt=amt, ctin=ctin,
+                             tcs=Decimal(0), tds=Decimal(0), tax=amt / 10, schdisc=0, cashdisc=0, roundoff=money(-0.5, 0.5),
+                             **discounts))
+        for (stock_id, hsn, rt), qty, txval in lines:
+            gstr1.append(dict(inum=inum, date=date, txval=txval, stock_id=stock_id, qty=qty, rt=rt, type="sales", hsn=hsn,
+                              desc=f"DESC {stock_id}", credit_note_no=None, original_invoice_no=None, party_id=party,
+                              party_name=None, ctin=ctin, cgst=0, sgst=0, inv_amt=amt))
+        # Sales returns (a bill can be returned more than once on the same day).
+        # A few have no credit note in gstr1 (or no return in the sales register) and are reported as exceptions
+        for n in range(rnd.choice([0] * 8 + [1, 2])):
+            cn, return_date = f"CN{i:06d}{n}", date + datetime.timedelta(days=1)
+            (stock_id, hsn, rt), qty, txval = rnd.choice(lines)
+            missing = rnd.choice([None] * 30 + ["credit_note", "return"])
+            if missing != "return":
+                register.append(dict(inum=inum, date=return_date, party_id=party, party_name=None, type="salesreturn",
+                                     amt=-txval, ctin=ctin, tcs=0, tds=0, tax=0, schdisc=0, cashdisc=0, btpr=0, outpyt=0,
+                                     ushop=rnd.choice([Decimal(0), money(-10, 0)]), pecom=0, other_discount=0,
+                                     roundoff=money(-0.5, 0.5)))
+            if missing == "credit_note":
+                continue
+            gstr1.append(dict(inum=inum, date=return_date, txval=txval, stock_id=stock_id, qty=qty, rt=rt, type="salesreturn",
+                              hsn=hsn, desc=f"DESC {stock_id}", credit_note_no=cn, original_invoice_no=inum, party_id=party,
+                              party_name=None, ctin=ctin, cgst=0, sgst=0, inv_amt=txval))
+    for i in range(max(bills // 100, 1)):
+        date = fromd + datetime.timedelta(days=rnd.randrange(days))
+        for _ in range(rnd.randrange(1, 4)):
+            (stock_id, hsn, rt) = rnd.choice(stocks)
+            gstr1.append(dict(inum=f"CS{i:05d}", date=date, txval=money(1, 5000, 3), stock_id=stock_id, qty=1, rt=rt,
+                              type="claimservice", hsn=hsn, desc=f"DESC {stock_id}", credit_note_no=None,
+                              original_invoice_no=None, party_id="HUL", party_name=None, ctin="33HULXX0000A1Z5",
+                              cgst=0, sgst=0, inv_amt=0))
+    for model, rows in [(models.SalesRegisterReport, register), (models.IkeaGSTR1Report, gstr1)]:
+        df = pd.DataFrame(rows)
+        df["company_id"] = company.pk
+        model.save_to_db(df)
+
+def snapshot(company: Company, args: DateRangeArgs) -> dict[str, pd.DataFrame]:
+    """Rows written by the sales import (ids excluded) , sorted so two runs can be compared"""
+    sales = models.Sales.objects.filter(company=company, date__gte=args.fromd, date__lte=args.tod,
+                                        type__in=["sales", "salesreturn", "claimservice"])
+    frames = {
+        "sales": pd.DataFrame(sales.values("inum", "type", "date", "party_id", "amt", "ctin", "discount", "roundoff", "tcs", "tds")),
+        "discount": pd.DataFrame(models.Discount.objects.filter(company=company).values("bill_id", "sub_type", "amt")),
+        "inventory": pd.DataFrame(models.Inventory.objects.filter(company=company).values("bill_id", "stock_id", "qty", "rt", "txval")),
+        "stock": pd.DataFrame(models.Stock.objects.filter(company=company).values("name", "hsn", "rt", "desc")),
+    }
+    # Bills are matched in pandas (the just loaded tables have no planner statistics , so a join is a nested loop)
+    bills = set(frames["sales"]["inum"]) if len(frames["sales"]) else set()
+    for name in ["discount", "inventory"]:
+        if len(frames[name]):
+            frames[name] = frames[name][frames[name]["bill_id"].isin(bills)]
+    return {name: df.sort_values(list(df.columns)).reset_index(drop=True) if len(df) else df for name, df in frames.items()}
+
+def run_engine(engine: str, company: Company, args: DateRangeArgs, reruns: int = 0) -> tuple[float, dict[str, pd.DataFrame]]:
+    """Run the import with the engine ("diff" is the diff mode) and roll it back.
+    reruns : the import is run again that many times on the same reports and only the last run is timed"""
+    original = SalesImport.engine, SalesImport.mode
+    SalesImport.engine, SalesImport.mode = ("sql", "diff") if engine == "diff" else (engine, "replace")
+    try:
+        with transaction.atomic():
+            for _ in range(reruns + 1):
+                start = time.perf_counter()
+                exceptions = SalesImport.run_atomic(company, args)
+                time_taken = time.perf_counter() - start
+            rows = snapshot(company, args) | {"exceptions": exceptions}
+            transaction.set_rollback(True)
+    finally:
+        SalesImport.engine, SalesImport.mode = original
+    return time_taken, rows
+
+def bench_matcher(returns: int, seed: int = 0) -> tuple[float, int]:
+    """Time match_sales_returns on synthetic returns (and their credit notes) spread over a year"""
+    rnd = random.Random(seed)
+    dates = [datetime.date(2025, 4, 1) + datetime.timedelta(days=d) for d in range(365)]
+    keys = [(rnd.choice(dates), f"A{rnd.randrange(returns):07d}") for _ in range(returns)]
+    amts = [Decimal(rnd.randrange(1, 10**6)) / 100 for _ in range(returns)]
+    returns_df = pd.DataFrame({"id": range(returns), "date": [d for d, _ in keys], "inum": [i for _, i in keys], "amt": amts})
+    credit_notes = pd.DataFrame({"date": [d for d, _ in keys], "original_invoice_no": [i for _, i in keys],
+                                 "credit_note_no": [f"CN{n:07d}" for n in range(returns)], "inv_amt": [-amt for amt in amts]})
+    credit_notes = pd.concat([credit_notes, credit_notes.sample(frac=0.5, random_state=seed)])  # Several lines per credit note
+    start = time.perf_counter()
+    _, exceptions = match_sales_returns(returns_df, credit_notes)
+    return time.perf_counter() - start, len(exceptions)
+
+class Command(BaseCommand):
+    help = ("Check the sql engine & diff mode of SalesImport against the orm engine (same rows) and time them. "
+            "Usage: manage.py bench_sales_import --bills 20000 | manage.py bench_sales_import --company X --fromd 2025-09-01 --tod 2025-09-30")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--bills", type=int, default=5000, help="Synthetic invoices (used when --company is not given)")
+        parser.add_argument("--company", type=str, help="Existing company (its loaded report rows are used , nothing is changed)")
+        parser.add_argument("--fromd", type=datetime.date.fromisoformat, default=datetime.date(2025, 4, 1))
+        parser.add_argument("--tod", type=datetime.date.fromisoformat, default=datetime.date(2025, 4, 30))
+        parser.add_argument("--repeat", type=int, default=1)
+        parser.add_argument("--returns", type=int, default=100000, help="Synthetic sales returns for timing match_sales_returns")
+
+    def handle(self, *args, **options):
+        time_taken, exceptions = bench_matcher(options["returns"])
+        self.stdout.write(f"match_sales_returns : {options['returns']} returns in {time_taken:.3f}s ({exceptions} exceptions)")
+
+        import_args = DateRangeArgs(fromd=options["fromd"], tod=options["tod"])
+        synthetic = options["company"] is None
+        if synthetic:
+            user, _ = User.objects.get_or_create(username=BENCH_NAME)
+            company, _ = Company.objects.get_or_create(name=BENCH_NAME, user=user)
+            synthetic_reports(company, options["bills"], import_args.fromd, days=(import_args.tod - import_args.fromd).days)
+        else:
+            try:
+                company = Company.objects.get(name=options["company"])
+            except Company.DoesNotExist:
+                raise CommandError(f"Company '{options['company']}' not found")
+
+        try:
+            results = {}
+            #"diff rerun" is a second diff mode import of the same reports (every bill is unchanged)
+            for engine, reruns in [("orm", 0), ("sql", 0), ("diff", 0), ("diff rerun", 1)]:
+                timings = []
+                for _ in range(options["repeat"]):
+                    time_taken, rows = run_engine(engine.split()[0], company, import_args, reruns)
+                    timings.append(time_taken)
+                results[engine] = rows
+                counts = " , ".join(f"{len(df)} {name}" for name, df in rows.items())
+                self.stdout.write(f"{engine:>10} : best {min(timings):.3f}s ({counts})")
+
+            mismatches = []
+            for engine in ["sql", "diff", "diff rerun"]:
+                for name in results["orm"]:
+                    try:
+                        pd.testing.assert_frame_equal(results["orm"][name], results[engine][name], check_dtype=False)
+                    except AssertionError as e:
+                        mismatches.append(f"{engine} , {name} : {e}")
+            if mismatches:
+                raise CommandError("Imports differ from the orm engine\n" + "\n".join(mismatches))
+            self.stdout.write("sql engine and diff mode match the orm engine")
+        finally:
+            if synthetic:
+                for model in [models.SalesRegisterReport, models.IkeaGSTR1Report]:
+                    model.objects.filter(company=company)._raw_delete(model.objects.db)
+                models.Stock.objects.filter(company=company).delete()
+                company.delete()
+                user.delete()
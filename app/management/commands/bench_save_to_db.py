@@ -0,0 +1,72 @@
+import datetime
+import random
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from django.db import models
+import pandas as pd
+from app.company_models import Company, User
+from app.report_models import CompanyReportModel
+
+BENCH_NAME = "__bench_save_to_db__"
+
+def synthetic_dataframe(model: type[CompanyReportModel], rows: int, company: Company) -> pd.DataFrame:
+    """Random rows for every concrete field of the report model (good enough for load timings)"""
+    rnd = random.Random(0)
+    data = {}
+    for f in model._meta.concrete_fields:
+        if f.auto_created:
+            continue
+        if isinstance(f, models.ForeignKey):
+            data[f.attname] = [company.pk] * rows
+        elif isinstance(f, models.DateField):
+            start = datetime.date(2025, 1, 1)
+            data[f.attname] = [start + datetime.timedelta(days=rnd.randrange(28)) for _ in range(rows)]
+        elif isinstance(f, models.DecimalField):
+            data[f.attname] = [round(rnd.uniform(-9999, 9999), f.decimal_places) for _ in range(rows)]
+        elif isinstance(f, models.IntegerField):
+            data[f.attname] = [rnd.randrange(1, 500) for _ in range(rows)]
+        else:
+            max_length = min(f.max_length or 10, 10)
+            data[f.attname] = [f"X{rnd.randrange(10**(max_length-1))}" for _ in range(rows)]
+    return pd.DataFrame(data)
+
+class Command(BaseCommand):
+    help = "Benchmark BaseReportModel.save_to_db (COPY vs to_sql). Usage: manage.py bench_save_to_db IkeaGSTR1Report --rows 50000"
+
+    def add_arguments(self, parser):
+        parser.add_argument("report", type=str, help="Report model name (eg: SalesRegisterReport)")
+        parser.add_argument("--rows", type=int, default=50000)
+        parser.add_argument("--repeat", type=int, default=3)
+
+    def handle(self, *args, **options):
+        try:
+            model = apps.get_model("app", options["report"])
+        except LookupError:
+            raise CommandError(f"Report model '{options['report']}' not found")
+        if not issubclass(model, CompanyReportModel):
+            raise CommandError("Only company report models can be benchmarked")
+
+        user, _ = User.objects.get_or_create(username=BENCH_NAME)
+        company, _ = Company.objects.get_or_create(name=BENCH_NAME, user=user)
+        df = synthetic_dataframe(model, options["rows"], company)
+        original_method = model.load_method
+        try:
+            for method in ["to_sql", "copy"]:
+                model.load_method = method
+                timings = []
+                for _ in range(options["repeat"]):
+                    model.objects.filter(company=company)._raw_delete(model.objects.db)
+                    start = time.perf_counter()
+                    inserted = model.save_to_db(df.copy())
+                    timings.append(time.perf_counter() - start)
+                    assert model.objects.filter(company=company).count() == inserted
+                best = min(timings)
+                self.stdout.write(
+                    f"{method:>7} : {inserted} rows , best {best:.3f}s ({inserted / best:,.0f} rows/s)"
+                )
+        finally:
+            model.load_method = original_method
+            model.objects.filter(company=company)._raw_delete(model.objects.db)
+            company.delete()
+            user.delete()
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from app.import_models import ImportRun
+
+MB = 1024 * 1024
+
+def mb(value: int | None) -> str:
+    return "" if value is None else f"{value / MB:.1f}"
+
+class Command(BaseCommand):
+    help = ("List the recorded import runs , or the stages of a run compared with the previous run of the company. "
+            "Usage: manage.py import_runs [--company X] [--limit 10] | manage.py import_runs --run <id>")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--company", type=str)
+        parser.add_argument("--limit", type=int, default=10)
+        parser.add_argument("--run", type=int, help="Show the stages of this run")
+
+    def handle(self, *args, **options):
+        if options["run"] is not None:
+            return self.show_run(options["run"])
+
+        runs = ImportRun.objects.all()
+        if options["company"]:
+            runs = runs.filter(company_id=options["company"])
+        self.stdout.write(f"{'Run':>6}  {'Company':<25}{'Started':<22}{'Status':<8}{'Time(s)':>9}{'Peak MB':>9}")
+        for run in runs[: options["limit"]]:
+            self.stdout.write(f"{run.pk:>6}  {run.company_id:<25}{run.started_at:%Y-%m-%d %H:%M:%S}   {run.status:<8}"
+                              f"{run.duration:>9.1f}{mb(run.peak_memory):>9}")
+
+    def show_run(self, run_id: int):
+        try:
+            run = ImportRun.objects.get(pk=run_id)
+        except ImportRun.DoesNotExist:
+            raise CommandError(f"Import run {run_id} not found")
+        previous = (ImportRun.objects.filter(company_id=run.company_id, status="ok", started_at__lt=run.started_at)
+                    .order_by("-started_at").first())
+        previous_durations = {(stage.name, stage.kind): stage.duration for stage in previous.stages.all()} if previous else {}
+
+        self.stdout.write(f"Run {run.pk} of {run.company_id} at {run.started_at:%Y-%m-%d %H:%M:%S} : {run.status} in {run.duration:.1f}s"
+                          + (f" (previous run {previous.pk} : {previous.duration:.1f}s)" if previous else ""))
+        if run.error:
+            self.stdout.write(f"Error : {run.error}")
+        self.stdout.write(f"{'Stage':<26}{'Kind':<12}{'Start':>8}{'Time(s)':>9}{'Change':>9}{'Rows':>9}{'MB':>8}{'Peak MB':>9}")
+        for stage in run.stages.all():
+            before = previous_durations.get((stage.name, stage.kind))
+            change = "" if before is None else f"{stage.duration - before:+.2f}"
+            rows = "" if stage.rows is None else str(stage.rows)
+            self.stdout.write(f"{stage.name:<26}{stage.kind:<12}{stage.start:>8.2f}{stage.duration:>9.2f}{change:>9}"
+                              f"{rows:>9}{mb(stage.bytes):>8}{mb(stage.peak_memory):>9}")
+            if stage.error:
+                self.stdout.write(f"    error : {stage.error}")
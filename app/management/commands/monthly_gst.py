@@ -1,41 +1,42 @@
-
-import datetime
-from app import models
-from app.models import User
-from app.company_models import Company
-from app.erp_import import GstFilingImport, MarketReturnImport
-from app.report_models import DateRangeArgs, EmptyArgs
-from custom.classes import IkeaDownloader
 import datetime
 from dateutil.relativedelta import relativedelta
-import sys
+from django.core.management.base import BaseCommand, CommandError
 from django.db.models import Q
+from app.company_models import Company
+from app.orchestrator import file_gst, run_companies
+
+class Command(BaseCommand):
+    help = ("Import the previous month's reports and set the gst period for the companies (of the users) , "
+            "several companies at a time in worker processes. Usage: manage.py monthly_gst <username|company> ... [--workers 2]")
+
+    def add_arguments(self, parser):
+        parser.add_argument("users_or_companies", nargs="+", type=str, help="Usernames or company names")
+        parser.add_argument("--workers", type=int, default=1, help="Companies processed at the same time")
 
-GST_PERIOD_FILTER = {
-    "devaki_urban" : lambda qs : qs.exclude(type = "damage", party_id  = "P150") #NAIDU HALL DAMAGE EXCLUDE
-}
+    def handle(self, *args, **options):
+        names = options["users_or_companies"]
+        companies = list(Company.objects.filter(Q(user_id__in = names) | Q(name__in = names)).distinct().values_list("name",flat=True))
+        self.stdout.write(f"Companies : {companies}")
+        if not companies:
+            raise CommandError(f"No companies found for {names}")
+        if options["workers"] < 1:
+            raise CommandError("--workers must be at least 1")
 
-usernames_or_companies = sys.argv[2:]
-companies = Company.objects.filter(Q(user_id__in = usernames_or_companies) | Q(name__in = usernames_or_companies)).distinct()
-print("Companies :",list(companies.values_list("name",flat=True)))
-today = datetime.date.today()
-prev_month = today - relativedelta(months=1)
-fromd = prev_month.replace(day=1)
-tod = fromd + relativedelta(day=31)
-period = fromd.strftime("%m%Y")
+        today = datetime.date.today()
+        fromd = (today - relativedelta(months=1)).replace(day=1)
+        tod = fromd + relativedelta(day=31)
 
-args_dict = {
-    DateRangeArgs: DateRangeArgs(fromd=fromd,tod=tod),
-    EmptyArgs: EmptyArgs(),
-}
+        results = []
+        for result in run_companies(file_gst, companies, fromd, tod, workers=options["workers"]):
+            results.append(result)
+            if result.ok:
+                self.stdout.write(f"{result.company} : done in {result.duration:.1f}s")
+            else:
+                self.stderr.write(f"{result.company} : failed after {result.duration:.1f}s\n{result.traceback}")
 
-for company in companies :
-    print(f"Processing GST for Company: {company.name} for Period: {period}")
-    i = IkeaDownloader(company.pk)
-    GstFilingImport.run(company=company,args_dict=args_dict)
-    qs = models.Sales.objects.filter(type__in = company.gst_types,date__gte = fromd,date__lte = tod)
-    if company.name in GST_PERIOD_FILTER :
-        qs = GST_PERIOD_FILTER[company.name](qs)
-    qs.update(gst_period = period)
-    
-exit(0)
+        self.stdout.write("Company".ljust(30) + "Status".ljust(10) + "Time(s)")
+        for result in sorted(results, key=lambda result: result.company):
+            self.stdout.write(result.company.ljust(30) + ("ok" if result.ok else "failed").ljust(10) + f"{result.duration:.1f}")
+        failed = [result.company for result in results if not result.ok]
+        if failed:
+            raise CommandError(f"GST import failed for : {', '.join(failed)}")
@@ -0,0 +1,31 @@
+import time
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError
+from app.partitions import partition_table
+from app.report_models import BaseReportModel
+
+class Command(BaseCommand):
+    help = "Convert report tables into partitioned tables (by company/user and month), moving the existing rows. Usage: manage.py partition_reports [SalesRegisterReport ...]"
+
+    def add_arguments(self, parser):
+        parser.add_argument("reports", nargs="*", type=str, help="Report model names (default: all partitioned report models)")
+
+    def handle(self, *args, **options):
+        models = [
+            model for model in apps.get_app_config("app").get_models()
+            if issubclass(model, BaseReportModel) and model.partitioning is not None
+        ]
+        if options["reports"]:
+            by_name = {model.__name__: model for model in models}
+            unknown = [name for name in options["reports"] if name not in by_name]
+            if unknown:
+                raise CommandError(f"Not a partitioned report model: {', '.join(unknown)}")
+            models = [by_name[name] for name in options["reports"]]
+
+        for model in models:
+            start = time.perf_counter()
+            moved_rows = partition_table(model)
+            if moved_rows is None:
+                self.stdout.write(f"{model._meta.db_table} : already partitioned")
+            else:
+                self.stdout.write(f"{model._meta.db_table} : partitioned , {moved_rows} rows moved in {time.perf_counter() - start:.1f}s")
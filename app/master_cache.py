@@ -0,0 +1,158 @@
+import threading
+from functools import partial
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Any, Callable, Iterable, Type
+from django.db import connection, models as django_models, transaction
+import app.models as models
+from app.company_models import Company
+
+# In-process cache of the Party and Stock masters of the companies , so the imports upsert only the rows which
+# are new or changed instead of the whole master on every run.
+# Every master has its own version column in Company , bumped when rows of that master are written , once the write
+# commits (in its own short statement , so the row lock of the company is not held by the import's transaction and
+# the imports of the company still run in parallel). A cached master is reloaded when its version differs from the
+# db one (written by another process / connection , or a rolled back transaction).
+# Company.hsn_version is bumped only when the hsn of a stock changes (the tax summaries are built with it ,
+# see app/tax_summary.py).
+
+#model -> (key field , cached fields , Company version field)
+MASTERS: dict[Type[django_models.Model], tuple[str, list[str], str]] = {
+    models.Party: ("code", ["master_code", "name", "addr", "ctin", "phone"], "party_version"),
+    models.Stock: ("name", ["hsn", "rt", "desc"], "stock_version"),
+}
+#model -> (fields the tax of the sales depends on , Company version field)
+TAX_FIELDS: dict[Type[django_models.Model], tuple[list[str], str]] = {
+    models.Stock: (["hsn"], "hsn_version"),
+}
+
+def _normalize(field: django_models.Field, value: Any) -> Any:
+    """Value as it is stored in the db (decimals rounded to the column scale)"""
+    value = field.to_python(value)
+    if isinstance(value, Decimal):
+        value = value.quantize(Decimal(1).scaleb(-field.decimal_places), rounding=ROUND_HALF_UP)
+    return value
+
+def company_version(company_id: str, field: str) -> int:
+    return Company.objects.filter(pk=company_id).values_list(field, flat=True).get()
+
+def bump_company_version(company_id: str, field: str) -> int:
+    """Returns the new version"""
+    column = connection.ops.quote_name(Company._meta.get_field(field).column)
+    with connection.cursor() as cur:
+        cur.execute(
+            f"UPDATE {Company._meta.db_table} SET {column} = {column} + 1 WHERE name = %s RETURNING {column}",
+            [company_id],
+        )
+        return cur.fetchone()[0]
+
+class _Bump:
+    """on_commit callback of bump_version_on_commit. It stays in connection.run_on_commit until the transaction
+    commits (and is dropped on a rollback) , so the pending bumps of the transaction can be counted"""
+    def __init__(self, company_id: str, field: str, then: Callable[[int], None] | None):
+        self.company_id = company_id
+        self.field = field
+        self.then = then
+
+    def __call__(self):
+        version = bump_company_version(self.company_id, self.field)
+        if self.then is not None:
+            self.then(version)
+
+def bump_version_on_commit(company_id: str, field: str, then: Callable[[int], None] | None = None):
+    """bump_company_version once the current transaction commits (at once outside a transaction) ,
+    then calls then(new version)"""
+    transaction.on_commit(_Bump(company_id, field, then))
+
+def version_on_commit(company_id: str, field: str) -> int:
+    """The version the current transaction commits with : the db version and the bumps of the transaction.
+    If other transactions bump it meanwhile , the final version is higher (rows stamped with it look outdated)"""
+    pending = sum(
+        1 for _, func, _ in connection.run_on_commit
+        if isinstance(func, _Bump) and func.company_id == company_id and func.field == field
+    )
+    return company_version(company_id, field) + pending
+
+def master_version(model: Type[django_models.Model], company_id: str) -> int:
+    return company_version(company_id, MASTERS[model][2])
+
+def bump_master_version_on_commit(model: Type[django_models.Model], company_id: str,
+                                  then: Callable[[int], None] | None = None):
+    """Mark the master of the company as changed once the current transaction commits.
+    Call after writing to Party / Stock outside MasterCache (and bump_version_on_commit the TAX_FIELDS version
+    if those fields changed)"""
+    bump_version_on_commit(company_id, MASTERS[model][2], then)
+
+class MasterCache:
+    def __init__(self):
+        self._rows: dict[tuple[Type[django_models.Model], str], tuple[int, dict[str, dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    def rows(self, model: Type[django_models.Model], company_id: str) -> dict[str, dict[str, Any]]:
+        """Current rows of the master (key -> {field: value}) , do not modify"""
+        return self._load(model, company_id)[1]
+
+    def _load(self, model: Type[django_models.Model], company_id: str) -> tuple[int, dict[str, dict[str, Any]]]:
+        version = master_version(model, company_id)
+        with self._lock:
+            cached = self._rows.get((model, company_id))
+        if cached is not None and cached[0] == version:
+            return cached
+
+        key, fields, _ = MASTERS[model]
+        rows = {
+            values[0]: dict(zip(fields, values[1:]))
+            for values in model.objects.filter(company_id=company_id).values_list(key, *fields).iterator()
+        }
+        #Cached once the transaction commits (it may have written to the master and be rolled back)
+        transaction.on_commit(partial(self._set, model, company_id, version, rows))
+        return version, rows
+
+    def upsert(self, model: Type[django_models.Model], company: Company, objs: Iterable[django_models.Model],
+               update_fields: list[str], batch_size: int = 1000) -> int:
+        """bulk_create(update_conflicts=True) of only the objs which are not in the master
+        or differ from it in the update_fields. Returns the number of rows written"""
+        key, fields, _ = MASTERS[model]
+        meta = model._meta
+        loaded_version, current = self._load(model, company.pk)
+        changed = {}
+        for obj in objs:
+            row = current.get(getattr(obj, key))
+            if row is None or any(row[field] != _normalize(meta.get_field(field), getattr(obj, field)) for field in update_fields):
+                changed[getattr(obj, key)] = obj  # Last one wins (like the upsert of a duplicate key)
+        if not changed:
+            return 0
+
+        model.objects.bulk_create(
+            changed.values(),
+            batch_size=batch_size,
+            update_conflicts=True,
+            update_fields=update_fields,
+            unique_fields=["company_id", key],
+        )
+        #New rows are inserted with all the fields of the obj , existing rows only get the update_fields
+        rows = dict(current)
+        for name, obj in changed.items():
+            row_fields = fields if name not in current else update_fields
+            row = dict(current.get(name, {}))
+            row.update((field, _normalize(meta.get_field(field), getattr(obj, field))) for field in row_fields)
+            rows[name] = row
+
+        tax_fields, tax_version = TAX_FIELDS.get(model, ([], ""))
+        if any(rows[name].get(field) != current.get(name, {}).get(field) for name in changed for field in tax_fields):
+            bump_version_on_commit(company.pk, tax_version)
+
+        def cache(version: int):
+            if version == loaded_version + 1:  # Else the master was also written by someone else , reload next time
+                self._set(model, company.pk, version, rows)
+        bump_master_version_on_commit(model, company.pk, cache)
+        return len(changed)
+
+    def _set(self, model: Type[django_models.Model], company_id: str, version: int, rows: dict[str, dict[str, Any]]):
+        with self._lock:
+            self._rows[(model, company_id)] = (version, rows)
+
+    def clear(self):
+        with self._lock:
+            self._rows.clear()
+
+master_cache = MasterCache()
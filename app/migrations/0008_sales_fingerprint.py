@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:55
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0007_alter_saleschanges_sales"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="sales",
+            name="fingerprint",
+            field=models.CharField(blank=True, max_length=32, null=True),
+        ),
+    ]
@@ -0,0 +1,77 @@
+# Generated by Django 5.2.7 on 2026-10-18 00:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0008_sales_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportRun",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("started_at", models.DateTimeField()),
+                ("duration", models.FloatField()),
+                ("status", models.CharField(max_length=10)),
+                ("error", models.TextField(blank=True, null=True)),
+                ("peak_memory", models.BigIntegerField(blank=True, null=True)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="import_runs",
+                        to="app.company",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["-started_at"],
+            },
+        ),
+        migrations.CreateModel(
+            name="ImportStage",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("name", models.CharField(max_length=100)),
+                ("kind", models.CharField(max_length=20)),
+                ("start", models.FloatField()),
+                ("duration", models.FloatField()),
+                ("rows", models.IntegerField(blank=True, null=True)),
+                ("bytes", models.BigIntegerField(blank=True, null=True)),
+                ("peak_memory", models.BigIntegerField(blank=True, null=True)),
+                ("error", models.TextField(blank=True, null=True)),
+                (
+                    "run",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="stages",
+                        to="app.importrun",
+                    ),
+                ),
+            ],
+            options={
+                "ordering": ["start"],
+            },
+        ),
+    ]
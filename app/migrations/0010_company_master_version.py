@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0009_import_runs"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="master_version",
+            field=models.IntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,99 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:07
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0010_company_master_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SalesTaxLine",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("bill_id", models.CharField(db_index=True, max_length=20)),
+                ("hsn", models.CharField(max_length=20, null=True)),
+                ("rt", models.DecimalField(decimal_places=1, max_digits=12)),
+                ("qty", models.IntegerField()),
+                ("txval", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("cgst", models.DecimalField(decimal_places=3, max_digits=12)),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="app.company"
+                    ),
+                ),
+                (
+                    "sales",
+                    models.ForeignObject(
+                        from_fields=("company", "bill_id"),
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="tax_lines",
+                        to="app.sales",
+                        to_fields=("company", "inum"),
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+        migrations.CreateModel(
+            name="SalesTaxSummary",
+            fields=[
+                ("inum", models.CharField(max_length=20)),
+                ("date", models.DateField()),
+                ("txval", models.DecimalField(decimal_places=3, max_digits=12)),
+                (
+                    "zero_rate_txval",
+                    models.DecimalField(decimal_places=3, max_digits=12),
+                ),
+                ("cgst", models.DecimalField(decimal_places=3, max_digits=12)),
+                ("master_version", models.IntegerField()),
+                (
+                    "pk",
+                    models.CompositePrimaryKey(
+                        "company",
+                        "inum",
+                        blank=True,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "company",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE, to="app.company"
+                    ),
+                ),
+                (
+                    "sales",
+                    models.ForeignObject(
+                        from_fields=("company", "inum"),
+                        null=True,
+                        on_delete=django.db.models.deletion.DO_NOTHING,
+                        related_name="tax_summary",
+                        to="app.sales",
+                        to_fields=("company", "inum"),
+                    ),
+                ),
+            ],
+            options={
+                "abstract": False,
+            },
+        ),
+    ]
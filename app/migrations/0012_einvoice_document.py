@@ -0,0 +1,37 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0011_sales_tax_summary"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="EinvoiceDocument",
+            fields=[
+                ("seller_gstin", models.CharField(max_length=15)),
+                ("fy", models.CharField(max_length=7)),
+                ("doctype", models.CharField(max_length=3)),
+                ("inum", models.CharField(max_length=30)),
+                ("data", models.JSONField()),
+                ("fetched_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "pk",
+                    models.CompositePrimaryKey(
+                        "seller_gstin",
+                        "fy",
+                        "doctype",
+                        "inum",
+                        blank=True,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+            ],
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:14
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0012_einvoice_document"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="einvoicedocument",
+            name="irn",
+            field=models.CharField(max_length=64, null=True, unique=True),
+        ),
+        migrations.AddField(
+            model_name="einvoicedocument",
+            name="qrcode",
+            field=models.TextField(default=""),
+        ),
+        #Split the irn and qrcode out of the stored invoices
+        migrations.RunSQL(
+            """UPDATE app_einvoicedocument
+               SET irn = data->>'Irn', qrcode = coalesce(data->>'qrcode', ''), data = data - 'qrcode'""",
+            migrations.RunSQL.noop,
+        ),
+    ]
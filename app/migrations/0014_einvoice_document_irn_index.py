@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-18 01:37
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0013_einvoice_document_irn"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="einvoicedocument",
+            name="irn",
+            field=models.CharField(db_index=True, max_length=64, null=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0014_einvoice_document_irn_index"),
+    ]
+
+    operations = [
+        migrations.RenameField(
+            model_name="company",
+            old_name="master_version",
+            new_name="stock_version",
+        ),
+        migrations.AddField(
+            model_name="company",
+            name="party_version",
+            field=models.IntegerField(default=0),
+        ),
+    ]
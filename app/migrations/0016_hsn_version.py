@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-18 02:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("app", "0015_company_party_stock_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="company",
+            name="hsn_version",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.RenameField(
+            model_name="salestaxsummary",
+            old_name="master_version",
+            new_name="hsn_version",
+        ),
+    ]
@@ -2,3 +2,4 @@
 from app.company_models import *
 from app.report_models import *
 from app.erp_models import *
+from app.import_models import *
@@ -0,0 +1,88 @@
+import datetime
+import multiprocessing
+import os
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Callable, Iterator
+
+# Runs a job per company in a pool of worker processes (spawned , so each worker sets up django and opens
+# its own db connection & IKEA session). A failed company is reported and does not stop the others.
+# Django models are imported inside the functions : this module is imported by the workers before django.setup
+
+@dataclass
+class CompanyResult:
+    company: str
+    pid: int
+    start: float
+    end: float
+    error: str | None = None
+    traceback: str | None = None
+
+    @property
+    def ok(self) -> bool:
+        return self.error is None
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+def _init_worker():
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "myerpv2.settings")
+    import django
+    django.setup()
+
+def _run_job(job: Callable[..., None], company_name: str, *args) -> CompanyResult:
+    from django.db import connection
+    result = CompanyResult(company_name, os.getpid(), time.time(), 0.0)
+    try:
+        job(company_name, *args)
+    except Exception as e:
+        result.error = f"{type(e).__name__}: {e}"
+        result.traceback = traceback.format_exc()
+    finally:
+        connection.close()
+        result.end = time.time()
+    return result
+
+def run_companies(job: Callable[..., None], company_names: list[str], *args, workers: int = 2) -> Iterator[CompanyResult]:
+    """Run job(company_name, *args) for every company , at most workers at a time.
+    job must be a module level function (it is pickled). Yields the results as the companies finish"""
+    context = multiprocessing.get_context("spawn")
+    with ProcessPoolExecutor(max_workers=workers, mp_context=context, initializer=_init_worker) as executor:
+        futures = {executor.submit(_run_job, job, name, *args): name for name in company_names}
+        for future in as_completed(futures):
+            try:
+                yield future.result()
+            except Exception as e:  # The worker process died (eg: killed by the OOM killer)
+                now = time.time()
+                yield CompanyResult(futures[future], 0, now, now, f"{type(e).__name__}: {e}", traceback.format_exc())
+
+GST_PERIOD_FILTER = {
+    "devaki_urban" : lambda qs : qs.exclude(type = "damage", party_id  = "P150") #NAIDU HALL DAMAGE EXCLUDE
+}
+
+def file_gst(company_name: str, fromd: datetime.date, tod: datetime.date):
+    """Import the reports of the company for the period and mark its gst sales with the period"""
+    from app import models
+    from app.company_models import Company
+    from app.erp_import import GstFilingImport
+    from app.locks import lock_company
+    from app.report_models import DateRangeArgs, EmptyArgs
+    from custom.classes import IkeaDownloader
+
+    company = Company.objects.get(name=company_name)
+    period = fromd.strftime("%m%Y")
+    print(f"Processing GST for Company: {company.name} for Period: {period}")
+    IkeaDownloader(company.pk)
+    args_dict = {
+        DateRangeArgs: DateRangeArgs(fromd=fromd,tod=tod),
+        EmptyArgs: EmptyArgs(),
+    }
+    with lock_company(company.pk, [period]):
+        GstFilingImport.run(company=company,args_dict=args_dict)
+        qs = models.Sales.objects.filter(company=company,type__in = company.gst_types,date__gte = fromd,date__lte = tod)
+        if company.name in GST_PERIOD_FILTER :
+            qs = GST_PERIOD_FILTER[company.name](qs)
+        qs.update(gst_period = period)
@@ -0,0 +1,215 @@
+import datetime
+import hashlib
+from dataclasses import dataclass
+from typing import Any
+from django.db import connection, transaction
+import pandas as pd
+
+# Declarative partitioning of the report tables (postgres) :
+#   <table>                       LIST (key_column)      key = company / user
+#   <table>_<key hash>            RANGE / LIST by month
+#   <table>_<key hash>_<yyyymm>   rows of one key for one month
+# A reload of whole months swaps the month partitions (load a fresh table , detach & drop the old one , attach the new one)
+# instead of a large DELETE. Tables are converted with `manage.py partition_reports`.
+
+def quote(name: str) -> str:
+    return connection.ops.quote_name(name)
+
+@dataclass
+class Partitioning:
+    key_column: str
+    month_column: str
+    sub_partition_by = ""
+
+    def row_months(self, values: pd.Series) -> pd.Series:
+        """Month key of every row"""
+        raise NotImplementedError("row_months method not implemented.")
+
+    def month_sql(self) -> str:
+        """SQL expression of the month key (same values as row_months)"""
+        raise NotImplementedError("month_sql method not implemented.")
+
+    def month_suffix(self, month: Any) -> str:
+        raise NotImplementedError("month_suffix method not implemented.")
+
+    def bounds(self, month: Any) -> tuple[str, list]:
+        raise NotImplementedError("bounds method not implemented.")
+
+    def check(self, key: str, month: Any) -> tuple[str, list]:
+        raise NotImplementedError("check method not implemented.")
+
+    def key_partition(self, table: str, key: str) -> str:
+        return f"{table}_{hashlib.md5(key.encode()).hexdigest()[:8]}"
+
+    def month_partition(self, table: str, key: str, month: Any) -> str:
+        return f"{self.key_partition(table, key)}_{self.month_suffix(month)}"
+
+class DateMonthPartitioning(Partitioning):
+    """Months are the first day of the month (datetime.date) of a date column"""
+    sub_partition_by = "RANGE"
+
+    def row_months(self, values: pd.Series) -> pd.Series:
+        return pd.to_datetime(values).dt.to_period("M").dt.start_time.dt.date
+
+    def month_sql(self) -> str:
+        return f"date_trunc('month', {quote(self.month_column)})::date"
+
+    def month_suffix(self, month: datetime.date) -> str:
+        return month.strftime("%Y%m")
+
+    def bounds(self, month: datetime.date) -> tuple[str, list]:
+        return "FOR VALUES FROM (%s) TO (%s)", [month, next_month(month)]
+
+    def check(self, key: str, month: datetime.date) -> tuple[str, list]:
+        col = quote(self.month_column)
+        return f"{quote(self.key_column)} = %s AND {col} >= %s AND {col} < %s", [key, month, next_month(month)]
+
+class PeriodPartitioning(Partitioning):
+    """Months are MMYYYY period strings (eg: gstr1 portal)"""
+    sub_partition_by = "LIST"
+
+    def row_months(self, values: pd.Series) -> pd.Series:
+        return values
+
+    def month_sql(self) -> str:
+        return quote(self.month_column)
+
+    def month_suffix(self, month: str) -> str:
+        return month[2:] + month[:2]
+
+    def bounds(self, month: str) -> tuple[str, list]:
+        return "FOR VALUES IN (%s)", [month]
+
+    def check(self, key: str, month: str) -> tuple[str, list]:
+        return f"{quote(self.key_column)} = %s AND {quote(self.month_column)} = %s", [key, month]
+
+def next_month(month: datetime.date) -> datetime.date:
+    return (month.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+
+def whole_months(fromd: datetime.date, tod: datetime.date) -> list[datetime.date] | None:
+    """The months in [fromd,tod] , if the range is made of whole months (else None)"""
+    if fromd.day != 1 or next_month(tod) != tod + datetime.timedelta(days=1):
+        return None
+    months = []
+    month = fromd
+    while month <= tod:
+        months.append(month)
+        month = next_month(month)
+    return months
+
+def is_partitioned(table: str) -> bool:
+    if connection.vendor != "postgresql":
+        return False
+    with connection.cursor() as cur:
+        cur.execute("SELECT relkind = 'p' FROM pg_class WHERE oid = to_regclass(%s)", [table])
+        row = cur.fetchone()
+    return bool(row and row[0])
+
+def _create_key_partition(cur, parent: str, table: str, p: Partitioning, key: str):
+    cur.execute(
+        f"""CREATE TABLE IF NOT EXISTS {quote(p.key_partition(table, key))} PARTITION OF {quote(parent)}
+                FOR VALUES IN (%s) PARTITION BY {p.sub_partition_by} ({quote(p.month_column)})""",
+        [key],
+    )
+
+def _create_month_partition(cur, table: str, p: Partitioning, key: str, month: Any):
+    bounds, params = p.bounds(month)
+    cur.execute(
+        f"""CREATE TABLE IF NOT EXISTS {quote(p.month_partition(table, key, month))}
+                PARTITION OF {quote(p.key_partition(table, key))} {bounds}""",
+        params,
+    )
+
+def _partition_exists(cur, name: str) -> bool:
+    cur.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+    return cur.fetchone()[0]
+
+def ensure_partitions(model, df: pd.DataFrame):
+    """Create the key & month partitions needed for the rows of df (no-op if the table is not partitioned)"""
+    table, p = model._meta.db_table, model.partitioning
+    if df.empty or not is_partitioned(table):
+        return
+    pairs = pd.DataFrame({"key": df[p.key_column].to_numpy(), "month": p.row_months(df[p.month_column]).to_numpy()})
+    pairs = pairs.drop_duplicates()
+    with connection.cursor() as cur:
+        for key in pairs["key"].unique():
+            _create_key_partition(cur, table, table, p, key)
+        for key, month in pairs.itertuples(index=False):
+            _create_month_partition(cur, table, p, key, month)
+
+def swap_reload(model, key: str, months: list, df: pd.DataFrame) -> int:
+    """Replace the rows of key for the months with df , one partition swap per month.
+    Rows of df outside the months are appended (like a plain insert)"""
+    table, p = model._meta.db_table, model.partitioning
+    row_months = p.row_months(df[p.month_column])
+    inserted_rows = 0
+    with transaction.atomic(), connection.cursor() as cur:
+        _create_key_partition(cur, table, table, p, key)
+        key_partition = p.key_partition(table, key)
+        for month in months:
+            partition = p.month_partition(table, key, month)
+            staging = partition + "_new"
+            cur.execute(f"DROP TABLE IF EXISTS {quote(staging)}")
+            cur.execute(f"CREATE TABLE {quote(staging)} (LIKE {quote(table)} INCLUDING DEFAULTS)")
+            inserted_rows += model.save_to_db(df[(row_months == month).to_numpy()], db_table=staging) or 0
+            # The constraint lets ATTACH skip validating the rows
+            check, params = p.check(key, month)
+            cur.execute(f"ALTER TABLE {quote(staging)} ADD CONSTRAINT {quote(staging + '_check')} CHECK ({check})", params)
+            if _partition_exists(cur, partition):
+                cur.execute(f"ALTER TABLE {quote(key_partition)} DETACH PARTITION {quote(partition)}")
+                cur.execute(f"DROP TABLE {quote(partition)}")
+            cur.execute(f"ALTER TABLE {quote(staging)} RENAME TO {quote(partition)}")
+            bounds, params = p.bounds(month)
+            cur.execute(f"ALTER TABLE {quote(key_partition)} ATTACH PARTITION {quote(partition)} {bounds}", params)
+            cur.execute(f"ALTER TABLE {quote(partition)} DROP CONSTRAINT {quote(staging + '_check')}")
+
+        others = df[(~row_months.isin(months)).to_numpy()]
+        if len(others):
+            inserted_rows += model.save_to_db(others) or 0
+    return inserted_rows
+
+def partition_table(model) -> int | None:
+    """Convert the (plain) table of the model into a partitioned table , moving the existing rows.
+    Indexes , foreign keys and the id sequence are recreated. Returns the rows moved (None if already partitioned)"""
+    table, p = model._meta.db_table, model.partitioning
+    if is_partitioned(table):
+        return None
+    new_table = table + "__partitioned"
+    key_col, month_col = quote(p.key_column), quote(p.month_column)
+    with transaction.atomic(), connection.cursor() as cur:
+        cur.execute(
+            """SELECT pg_get_indexdef(indexrelid) FROM pg_index
+                      WHERE indrelid = %s::regclass AND NOT indisprimary""",
+            [table],
+        )
+        index_defs = [row[0] for row in cur.fetchall()]
+        cur.execute("SELECT conname, pg_get_constraintdef(oid) FROM pg_constraint WHERE conrelid = %s::regclass AND contype = 'f'", [table])
+        foreign_keys = cur.fetchall()
+
+        cur.execute(f"CREATE TABLE {quote(new_table)} (LIKE {quote(table)} INCLUDING DEFAULTS) PARTITION BY LIST ({key_col})")
+        cur.execute(f"SELECT DISTINCT {key_col}, {p.month_sql()} FROM {quote(table)}")
+        pairs = cur.fetchall()
+        for key in sorted({key for key, _ in pairs}):
+            _create_key_partition(cur, new_table, table, p, key)
+        for key, month in pairs:
+            _create_month_partition(cur, table, p, key, month)
+
+        cur.execute(f"INSERT INTO {quote(new_table)} SELECT * FROM {quote(table)}")
+        moved_rows = cur.rowcount
+        cur.execute(f"SELECT coalesce(max(id), 0) FROM {quote(table)}")
+        max_id = cur.fetchone()[0]
+        cur.execute(f"DROP TABLE {quote(table)}")
+        cur.execute(f"ALTER TABLE {quote(new_table)} RENAME TO {quote(table)}")
+
+        # Primary key of a partitioned table must contain the partition columns
+        cur.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(table + '_pkey')} PRIMARY KEY (id, {key_col}, {month_col})")
+        # Identity columns are not supported on partitioned tables (before pg 17) , so id comes from a sequence
+        sequence = table + "_id_seq"
+        cur.execute(f"CREATE SEQUENCE {quote(sequence)} OWNED BY {quote(table)}.id")
+        cur.execute("SELECT setval(%s, %s, false)", [sequence, max_id + 1])
+        cur.execute(f"ALTER TABLE {quote(table)} ALTER COLUMN id SET DEFAULT nextval(%s)", [sequence])
+        for index_def in index_defs:
+            cur.execute(index_def)
+        for name, definition in foreign_keys:
+            cur.execute(f"ALTER TABLE {quote(table)} ADD CONSTRAINT {quote(name)} {definition}")
+    return moved_rows
@@ -0,0 +1,115 @@
+import datetime
+import os
+import pickle
+import re
+import threading
+import time
+from typing import Callable
+import pandas as pd
+
+DEFAULT_MAX_BYTES = 2 * 1024**3  # 2 GB
+DEFAULT_TTL = 7 * 24 * 3600  # 7 days
+
+# Slices a cached (superset) raw dataframe down to the requested date range
+Slicer = Callable[[pd.DataFrame, datetime.date, datetime.date], pd.DataFrame]
+
+class ReportCache:
+    """On-disk cache of raw report dataframes keyed by (report, company, fetcher version, date range).
+    Layout : <root>/<report>/<company>/v<version>/<fromd>_<tod>.parquet
+    Files are written as parquet (pickle when arrow can't represent the raw frame).
+    The mtime of a file is its creation time (used for TTL) and the atime is its last use (used for LRU eviction)."""
+
+    FILE_PATTERN = re.compile(r"^(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})\.(parquet|pkl)$")
+
+    def __init__(self, root: str, max_bytes: int = DEFAULT_MAX_BYTES, ttl: int = DEFAULT_TTL):
+        self.root = os.path.abspath(root)
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self._lock = threading.Lock()
+
+    def _dir(self, report: str, company: str, version: int) -> str:
+        safe_company = re.sub(r"[^\w.-]", "_", company)
+        return os.path.join(self.root, report, safe_company, f"v{version}")
+
+    def _is_expired(self, path: str) -> bool:
+        return (time.time() - os.stat(path).st_mtime) > self.ttl
+
+    def _entries(self, dir: str) -> list[tuple[datetime.date, datetime.date, str]]:
+        if not os.path.isdir(dir):
+            return []
+        entries = []
+        for fname in os.listdir(dir):
+            match = self.FILE_PATTERN.match(fname)
+            if match:
+                fromd = datetime.date.fromisoformat(match.group(1))
+                tod = datetime.date.fromisoformat(match.group(2))
+                entries.append((fromd, tod, os.path.join(dir, fname)))
+        return entries
+
+    def get(self, report: str, company: str, version: int, fromd: datetime.date, tod: datetime.date,
+            slicer: Slicer | None = None) -> pd.DataFrame | None:
+        """Return the cached dataframe for the range. If only a larger range is cached
+        and a slicer is given , the smallest cached superset is sliced to [fromd,tod]"""
+        with self._lock:
+            candidates = []
+            for entry_fromd, entry_tod, path in self._entries(self._dir(report, company, version)):
+                if self._is_expired(path):
+                    os.remove(path)
+                    continue
+                exact = (entry_fromd, entry_tod) == (fromd, tod)
+                if exact or (slicer is not None and entry_fromd <= fromd and entry_tod >= tod):
+                    candidates.append(((not exact, entry_tod - entry_fromd), entry_fromd, entry_tod, path))
+            if not candidates:
+                return None
+            _, entry_fromd, entry_tod, path = min(candidates)
+            stat = os.stat(path)
+            os.utime(path, (time.time(), stat.st_mtime))  # Mark as recently used
+
+        try:
+            df = pd.read_parquet(path) if path.endswith(".parquet") else pd.read_pickle(path)
+        except FileNotFoundError:  # Evicted by another thread in between
+            return None
+        if (entry_fromd, entry_tod) != (fromd, tod):
+            df = slicer(df, fromd, tod)  # type: ignore
+        return df
+
+    def put(self, report: str, company: str, version: int, fromd: datetime.date, tod: datetime.date, df: pd.DataFrame):
+        dir = self._dir(report, company, version)
+        os.makedirs(dir, exist_ok=True)
+        base = os.path.join(dir, f"{fromd}_{tod}")
+        tmp_path = f"{base}.{threading.get_ident()}.tmp"
+        try:
+            df.to_parquet(tmp_path, index=False)
+            path = base + ".parquet"
+        except Exception:
+            # Raw reports can have mixed type object columns , which arrow refuses
+            with open(tmp_path, "wb+") as f:
+                pickle.dump(df, f)
+            path = base + ".pkl"
+        with self._lock:
+            for stale in (base + ".parquet", base + ".pkl"):
+                if stale != path and os.path.exists(stale):
+                    os.remove(stale)
+            os.replace(tmp_path, path)
+        self.evict()
+
+    def evict(self):
+        """Drop expired files , then least recently used files until the cache fits in max_bytes"""
+        with self._lock:
+            files = []
+            for dirpath, _, fnames in os.walk(self.root):
+                for fname in fnames:
+                    if not self.FILE_PATTERN.match(fname):
+                        continue
+                    path = os.path.join(dirpath, fname)
+                    if self._is_expired(path):
+                        os.remove(path)
+                        continue
+                    stat = os.stat(path)
+                    files.append((stat.st_atime, stat.st_size, path))
+            total_size = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total_size <= self.max_bytes:
+                    break
+                os.remove(path)
+                total_size -= size
@@ -3,21 +3,29 @@ from dataclasses import dataclass
 import datetime
 from decimal import Decimal
 import enum
+import itertools
 import os
-import pickle
-from typing import Callable, Type, final
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterator, Type, final
 from django.db import models
 import pandas as pd
 from sqlalchemy import create_engine
-from django.db import connection
+from django.db import connection, transaction
 from custom.classes import IkeaDownloader
 from django.core.checks import register, Error
 from django.apps import apps
 from myerpv2 import settings
-from app.sql import engine
+from app.sql import copy_dataframe, engine
 from typing import TypeVar, Generic
 from app.company_models import Company, User
 from app.fields import decimal_field
+from app.report_cache import ReportCache
+from app.instrumentation import downloaded_bytes, stage
+from app import partitions
+from app.partitions import DateMonthPartitioning, Partitioning, PeriodPartitioning
+from app.report_specs import ColumnSpec, Classify, Coerce, Derive, FillNa, Map, Replace, SplitPart, apply_specs
+
+report_cache = ReportCache(os.path.join(".cache", "reports"))
 
 @dataclass
 class ReportArgs(abc.ABC):
@@ -35,6 +43,16 @@ class DateRangeArgs(ReportArgs):
     fromd: datetime.date
     tod: datetime.date
 
+    def shards(self, days: int) -> list["DateRangeArgs"]:
+        """Split the range into consecutive ranges of atmost days each"""
+        shards = []
+        fromd = self.fromd
+        while fromd <= self.tod:
+            tod = min(fromd + datetime.timedelta(days=days - 1), self.tod)
+            shards.append(DateRangeArgs(fromd=fromd, tod=tod))
+            fromd = tod + datetime.timedelta(days=1)
+        return shards
+
 @dataclass
 class MonthArgs(ReportArgs):
     month: int
@@ -42,6 +60,33 @@ class MonthArgs(ReportArgs):
     def __str__(self) -> str:
         return f"{self.month:02d}{self.year}"
 
+def drop_last_rows(chunks: Iterator[pd.DataFrame], n: int) -> Iterator[pd.DataFrame]:
+    """Yield the chunks without the last n rows of the whole stream (footer rows)"""
+    if n == 0:
+        yield from chunks
+        return
+    pending = None
+    for df in chunks:
+        pending = df if pending is None else pd.concat([pending, df], ignore_index=True)
+        if len(pending) > n:
+            yield pending.iloc[: len(pending) - n]
+            pending = pending.iloc[len(pending) - n :]
+
+def pin_dtypes(chunks: Iterator[pd.DataFrame]) -> Iterator[pd.DataFrame]:
+    """Cast every chunk to the dtypes of the first one (each chunk infers its own , an int column with blanks is float).
+    Int columns are made nullable so the blanks of later chunks fit , columns that do not cast are left as objects"""
+    dtypes = None
+    for df in chunks:
+        if dtypes is None:
+            dtypes = {col: "Int64" if dtype.kind in "iu" else dtype for col, dtype in df.dtypes.items()}
+        for col, dtype in dtypes.items():
+            if df[col].dtype != dtype:
+                try:
+                    df[col] = df[col].astype(dtype)
+                except (TypeError, ValueError):
+                    df[col] = df[col].astype(object)
+        yield df
+
 class BaseReport(Generic[ArgsT]):    
     fetcher = None  # type: ignore
     max_retry = 1
@@ -49,26 +94,44 @@ class BaseReport(Generic[ArgsT]):
     column_map: dict = {}
     ignore_last_nrows = 0
     dropna_columns: list[str] = []
+    unique_columns: list[str] = [] #Keep only the first row for these columns
     date_format:str|None = "" #None means detect the format automatically
+    column_specs: list[ColumnSpec] = [] #Declarative column transforms , applied before custom_preprocessing
+    #Streaming : when set (and the fetcher accepts chunksize) , the report is fetched , preprocessed and saved chunk by chunk
+    chunksize: int|None = None
 
     #caching
     enable_cache = False
     use_cache = False
-    _cache_folders = {}
+    fetcher_version = 1 #Bump when the fetcher output changes , so older cache entries are not used
+    cache_date_column: str|None = None #Raw date column , allows slicing a cached superset range (and trimming shards)
+
+    @classmethod
+    def report_name(cls) -> str:
+        return cls.__qualname__.split(".")[0] #Class Qualname is like SalesRegisterReport.Report
+
+    @classmethod
+    def raw_columns(cls) -> list[str]:
+        """Raw columns the report is expected to have (column_map keys & the columns the specs read) , for empty downloads"""
+        columns = dict.fromkeys(cls.column_map)
+        produced = set(cls.column_map.values())
+        for spec in cls.column_specs:
+            columns.update(dict.fromkeys(col for col in spec.inputs() if col not in produced))
+            produced.add(spec.column) # type: ignore
+        return list(columns)
 
     @classmethod
-    def get_cache_dir(cls):
-        """Return (and create if needed) a cache dir specific to this subclass."""
-        report_cls = cls.__qualname__.split(".")[0] #Class Qualname is like SalesRegisterReport.Report
-        if report_cls not in cls._cache_folders:
-            path = os.path.join(".cache", report_cls)
-            os.makedirs(path, exist_ok=True)
-            cls._cache_folders[report_cls] = os.path.abspath(path)
-        return cls._cache_folders[report_cls]
+    def filter_raw_dates(cls, df: pd.DataFrame, fromd: datetime.date, tod: datetime.date) -> pd.DataFrame:
+        """Keep the raw rows within [fromd,tod] (the last ignore_last_nrows footer rows are kept as is)"""
+        n = cls.ignore_last_nrows
+        body, footer = (df.iloc[:-n], df.iloc[-n:]) if n > 0 else (df, df.iloc[:0])
+        date_format = cls.date_format or None
+        dates = pd.to_datetime(body[cls.cache_date_column], format=date_format).dt.date
+        return pd.concat([body[(dates >= fromd) & (dates <= tod)], footer], ignore_index=True)
     
     @classmethod
-    def basic_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
-        if cls.ignore_last_nrows > 0:
+    def basic_preprocessing(cls, df: pd.DataFrame, trim_footer: bool = True) -> pd.DataFrame:
+        if trim_footer and cls.ignore_last_nrows > 0:
             df = df.iloc[: -cls.ignore_last_nrows]
         if cls.column_map:
             df = df.rename(columns=cls.column_map)
@@ -77,42 +140,92 @@ class BaseReport(Generic[ArgsT]):
         
         if cls.dropna_columns:
             df = df.dropna(subset=cls.dropna_columns, how="any")
+        if cls.unique_columns:
+            df = df.drop_duplicates(subset=cls.unique_columns)
         return df
 
     @classmethod
     def custom_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
         return df
 
+    @classmethod
+    def fetch_with_retry(cls, fetch: Callable[..., pd.DataFrame], *args) -> pd.DataFrame:
+        for retry in range(0,cls.max_retry-1) : 
+            try : 
+                return fetch(*args)
+            except Exception as e :
+                print("Retrying fetching data due to error :",e)
+        return fetch(*args)
+
     @classmethod
     def fetch_raw_dataframe(cls, fetcher_cls_instance: object, args: ArgsT) -> pd.DataFrame:
         raise NotImplementedError("fetch_raw_dataframe method not implemented.")
+
+    @classmethod
+    def fetch_raw_chunks(cls, fetcher_cls_instance: object, args: ArgsT) -> Iterator[pd.DataFrame]:
+        raise NotImplementedError("fetch_raw_chunks method not implemented.")
+
+    @classmethod
+    def iter_dataframes(cls, fetcher_cls_instance: object, args: ArgsT) -> Iterator[pd.DataFrame]:
+        """Chunked get_dataframe : each raw chunk is preprocessed as soon as it is parsed"""
+        seen_keys: set = set()
+        chunks = pin_dtypes(cls.fetch_raw_chunks(fetcher_cls_instance, args))
+        for df in drop_last_rows(chunks, cls.ignore_last_nrows):
+            df = cls.basic_preprocessing(df, trim_footer=False)
+            if cls.unique_columns:
+                # Duplicates across chunks
+                keys = pd.Series(list(zip(*(df[col] for col in cls.unique_columns))), index=df.index)
+                df = df[~keys.isin(seen_keys)]
+                seen_keys.update(keys[df.index])
+            df = apply_specs(df, cls.column_specs)
+            df = cls.custom_preprocessing(df)
+            yield df
     
     @classmethod
     def get_dataframe(
         cls, fetcher_cls_instance: object, args: ArgsT
     ) -> pd.DataFrame:
-        
-        for retry in range(0,cls.max_retry-1) : 
-            try : 
-                df = cls.fetch_raw_dataframe(fetcher_cls_instance, args)
-                break
-            except Exception as e :
-                print("Retrying fetching data due to error :",e)
-
-        df = cls.fetch_raw_dataframe(fetcher_cls_instance, args)
-        df = cls.basic_preprocessing(df)
-        df = cls.custom_preprocessing(df)
+        #Retries are done in fetch_raw_dataframe (per request , see fetch_with_retry)
+        with stage(cls.report_name(), "fetch") as record:
+            bytes_before = downloaded_bytes(fetcher_cls_instance)
+            df = cls.fetch_raw_dataframe(fetcher_cls_instance, args)
+            record.rows = len(df)
+            if bytes_before is not None:
+                record.bytes = downloaded_bytes(fetcher_cls_instance) - bytes_before # type: ignore
+        with stage(cls.report_name(), "preprocess") as record:
+            df = cls.basic_preprocessing(df)
+            df = apply_specs(df, cls.column_specs)
+            df = cls.custom_preprocessing(df)
+            record.rows = len(df)
         return df
 
 class BaseReportModel(models.Model,Generic[ArgsT]):
     arg_type:Type[ArgsT]
     Report: Type[BaseReport[ArgsT]] = BaseReport[ArgsT]
+    #Bulk loading : "copy" streams the dataframe through COPY FROM STDIN , "to_sql" uses pandas multi-row inserts
+    load_method = "copy"
+    #Partitioned table (see app/partitions.py) , reloads of whole months are done by swapping partitions
+    partitioning: Partitioning | None = None
     
     class Meta:
         abstract = True
     
     @classmethod
-    def save_to_db(cls,df: pd.DataFrame) -> int | None:
+    def partition_months(cls, args: ArgsT) -> list | None:
+        """Months fully replaced by a reload of args (None if the reload is not of whole months)"""
+        return None
+
+    @classmethod
+    def reload(cls, owner: Company | User, args: ArgsT, df: pd.DataFrame) -> int | None:
+        """Replace the rows of the owner (company / user) for args with df"""
+        months = cls.partition_months(args) if cls.partitioning else None
+        if months is not None and partitions.is_partitioned(cls._meta.db_table):
+            return partitions.swap_reload(cls, owner.pk, months, df)
+        cls.delete_before_insert(owner, args) # type: ignore
+        return cls.save_to_db(df)
+
+    @classmethod
+    def save_to_db(cls,df: pd.DataFrame, db_table: str | None = None) -> int | None:
         # Collect concrete, non-auto fields (exclude auto PK and m2m)
         fields = []
         for f in cls._meta.get_fields():
@@ -135,11 +248,20 @@ class BaseReportModel(models.Model,Generic[ArgsT]):
         missing_cols = [col for col in cols if col not in df.columns]
         if missing_cols:
             raise ValueError(f"Missing columns in dataframe: {', '.join(missing_cols)}")
-        inserted_row_count: int | None = df[cols].to_sql(
-            cls._meta.db_table, engine, if_exists="append", index=False 
-        )
-        inserted_row_count = len(df)
-        return inserted_row_count
+        if db_table is None:
+            db_table = cls._meta.db_table
+            if cls.partitioning is not None:
+                partitions.ensure_partitions(cls, df)
+        if cls.load_method == "to_sql":
+            df[cols].to_sql(db_table, engine, if_exists="append", index=False)
+            return len(df)
+
+        df = df[cols]
+        #COPY does not cast 1.0 to integer (like INSERT does) , so float columns of integer fields are made nullable ints
+        for f in cls._meta.concrete_fields:
+            if isinstance(f, models.IntegerField) and f.attname in cols and df[f.attname].dtype.kind == "f":
+                df = df.assign(**{f.attname: df[f.attname].round().astype("Int64")})
+        return copy_dataframe(df, db_table, cols)
 
 
 class CompanyReportModel(BaseReportModel[ArgsT]):
@@ -156,42 +278,95 @@ class CompanyReportModel(BaseReportModel[ArgsT]):
     def update_db(
         cls, fetcher_obj: object, company: Company, args: ArgsT
     ) -> int | None:
+        if cls.Report.chunksize:
+            return cls.update_db_chunked(fetcher_obj, company, args)
         df = cls.Report.get_dataframe(fetcher_obj, args)
         df["company_id"] = company.pk
+        with stage(cls.__name__, "load") as record:
+            inserted_rows = cls.reload(company, args, df)
+            record.rows = inserted_rows
+        return inserted_rows
+
+    @classmethod
+    @transaction.atomic
+    def update_db_chunked(cls, fetcher_obj: object, company: Company, args: ArgsT) -> int:
+        # Atomic , so a download failing midway keeps the old rows
         cls.delete_before_insert(company,args)
-        inserted_rows = cls.save_to_db(df)
+        inserted_rows = 0
+        #Fetch , preprocessing & load are interleaved chunk by chunk , so they are recorded as one stage
+        with stage(cls.__name__, "stream") as record:
+            bytes_before = downloaded_bytes(fetcher_obj)
+            for df in cls.Report.iter_dataframes(fetcher_obj, args):
+                df["company_id"] = company.pk
+                inserted_rows += cls.save_to_db(df) or 0
+            record.rows = inserted_rows
+            if bytes_before is not None:
+                record.bytes = downloaded_bytes(fetcher_obj) - bytes_before # type: ignore
         return inserted_rows
 
 class DateReportModel(CompanyReportModel[DateRangeArgs]):
     arg_type = DateRangeArgs
+    #Incremental refresh re-fetches these many days before the last loaded date (late edits on IKEA)
+    incremental_overlap_days = 1
+    partitioning = DateMonthPartitioning("company_id", "date")
     #Note: All Models Should have a date field
     class Report(BaseReport[DateRangeArgs]) :
+        #Sharding : fetch the range as concurrent requests of shard_days each (a month in one request can time out on IKEA)
+        shard_days: int|None = None
+        shard_workers = 4
+
+        @classmethod
+        def fetch_sharded(cls, fetcher_cls_instance: object, args: DateRangeArgs) -> pd.DataFrame:
+            """Fetch each shard (retried on its own) over the same session and concat them in date order"""
+            shards = args.shards(cls.shard_days) # type: ignore
+            fetch_shard = lambda shard : cls.fetch_with_retry(cls.fetcher, fetcher_cls_instance, shard.fromd, shard.tod) # type: ignore
+            with ThreadPoolExecutor(max_workers=cls.shard_workers) as executor:
+                dfs = list(executor.map(fetch_shard, shards))
+
+            n = cls.ignore_last_nrows
+            #A shard without rows (eg: a week without bills) may come back as None , it is skipped
+            fetched = [(shard, df) for shard, df in zip(shards, dfs) if df is not None and len(df) > n]
+            if not fetched:
+                columns = next((df.columns for df in dfs if df is not None), cls.raw_columns())
+                return pd.DataFrame(columns=columns)
+            bodies = []
+            for shard, df in fetched:
+                if cls.cache_date_column:
+                    #Rows outside the shard would be duplicated by the neighbouring shard
+                    df = cls.filter_raw_dates(df, shard.fromd, shard.tod)
+                bodies.append(df.iloc[: len(df) - n])
+            #Every shard has its own footer rows , only one set is kept (so the raw frame looks like a single download)
+            last = fetched[-1][1]
+            footer = last.iloc[len(last) - n :]
+            return pd.concat(bodies + [footer], ignore_index=True)
+
         @classmethod
         def fetch_raw_dataframe(
             cls, fetcher_cls_instance: object, args: DateRangeArgs
         ) -> pd.DataFrame:
             fromd = args.fromd
             tod = args.tod
+            #Cache is per company (the ikea session user) 
+            company = str(getattr(getattr(fetcher_cls_instance, "user", None), "user", "default"))
+            cache_key = (cls.report_name(), company, cls.fetcher_version, fromd, tod)
             #Load from cache if enabaled & exists
-            is_loaded_from_cache = False
-            df:pd.DataFrame = None #type: ignore
+            df:pd.DataFrame|None = None
             if cls.use_cache and cls.enable_cache:
-                cache_dir = cls.get_cache_dir()
-                cache_path = os.path.join(cache_dir,f"{fromd}_{tod}.pkl")
-                if os.path.exists(cache_path) :
-                        with open(cache_path,"rb") as f :
-                            df = pickle.load(f)
-                            is_loaded_from_cache = True
-            if not is_loaded_from_cache :
-                df: pd.DataFrame = cls.fetcher(fetcher_cls_instance, fromd, tod)  # type: ignore
-
-            if cls.enable_cache and (not is_loaded_from_cache) : 
-                cache_dir = cls.get_cache_dir()
-                cache_path = os.path.join(cache_dir,f"{fromd}_{tod}.pkl")
-                with open(cache_path,"wb+") as f :
-                    pickle.dump(df,f)
-            
-            return df 
+                slicer = cls.filter_raw_dates if cls.cache_date_column else None
+                df = report_cache.get(*cache_key, slicer=slicer)
+                if df is not None :
+                    return df
+
+            if cls.shard_days and (tod - fromd).days >= cls.shard_days:
+                df = cls.fetch_sharded(fetcher_cls_instance, args)
+            else:
+                df = cls.fetch_with_retry(cls.fetcher, fetcher_cls_instance, fromd, tod)  # type: ignore
+            if df is None:
+                #No rows in the range (the fetcher returns None for an empty report)
+                df = pd.DataFrame(columns=cls.raw_columns())
+            if cls.enable_cache : 
+                report_cache.put(*cache_key, df) # type: ignore
+            return df # type: ignore
     
     class Meta: # type: ignore
         abstract = True
@@ -202,12 +377,37 @@ class DateReportModel(CompanyReportModel[DateRangeArgs]):
         cls.objects.filter(company = company,date__gte=args.fromd, date__lte=args.tod).delete()
         
     @classmethod
-    def last_update_date(cls, company: Company) -> datetime.date | None:
-        last_rec = cls.objects.filter(company = company).order_by("-date").first()
+    def partition_months(cls, args: DateRangeArgs) -> list | None:
+        return partitions.whole_months(args.fromd, args.tod)
+
+    @classmethod
+    def last_update_date(cls, company: Company, tod: datetime.date | None = None) -> datetime.date | None:
+        qs = cls.objects.filter(company = company)
+        if tod is not None:
+            qs = qs.filter(date__lte = tod)
+        last_rec = qs.order_by("-date").first()
         if last_rec:
             return last_rec.date # type: ignore
         return None
 
+    @classmethod
+    def incremental_args(cls, company: Company, args: DateRangeArgs) -> DateRangeArgs:
+        """Shrink the range to start from the last loaded date (minus the overlap) , if it is inside the range"""
+        last_date = cls.last_update_date(company, args.tod)
+        if last_date is None or last_date < args.fromd:
+            return args
+        fromd = last_date - datetime.timedelta(days=cls.incremental_overlap_days)
+        return DateRangeArgs(fromd=max(args.fromd, fromd), tod=args.tod)
+
+    @classmethod
+    def update_db(
+        cls, fetcher_obj: object, company: Company, args: DateRangeArgs, incremental: bool = False
+    ) -> int | None:
+        # Incremental : only the days from the last loaded date are deleted & reloaded , older rows are left alone
+        if incremental:
+            args = cls.incremental_args(company, args)
+        return super().update_db(fetcher_obj, company, args)
+
 class EmptyReportModel(CompanyReportModel[EmptyArgs]):
     arg_type = EmptyArgs
     #No caching
@@ -216,8 +416,19 @@ class EmptyReportModel(CompanyReportModel[EmptyArgs]):
         def fetch_raw_dataframe(
             cls, fetcher_cls_instance: object, args: EmptyArgs
         ) -> pd.DataFrame:  # type: ignore
-            df: pd.DataFrame = cls.fetcher(fetcher_cls_instance)  # type: ignore
+            df: pd.DataFrame = cls.fetch_with_retry(cls.fetcher, fetcher_cls_instance)  # type: ignore
             return df
+
+        @classmethod
+        def fetch_raw_chunks(
+            cls, fetcher_cls_instance: object, args: EmptyArgs
+        ) -> Iterator[pd.DataFrame]:
+            #The download & the first chunk (opening the workbook) are retried , the rest is parsed from the downloaded buffer
+            def fetch_first_chunk():
+                chunks = cls.fetcher(fetcher_cls_instance, chunksize=cls.chunksize)  # type: ignore
+                return next(chunks, None), chunks
+            first, chunks = cls.fetch_with_retry(fetch_first_chunk)  # type: ignore
+            return chunks if first is None else itertools.chain([first], chunks)
     
     class Meta: # type: ignore
         abstract = True
@@ -274,14 +485,14 @@ class SalesRegisterReport(DateReportModel):
         }
         ignore_last_nrows = 1
         max_retry = 2
-
-        @classmethod
-        def custom_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
-            df["tax"] = df["Tax Amt"] - df["SRT Tax"]
-            df["amt"] = df["BillValue"] + df["CR Adj"]
-            df["other_discount"] = df["DisFin Adj"] + df["Reversed Payouts"]
-            df["type"] = df["amt"].apply(lambda x: "salesreturn" if x < 0 else "sales")
-            return df
+        cache_date_column = "BillDate/Sales Return Date"
+        shard_days = 7
+        column_specs = [
+            Derive("tax", plus=["Tax Amt"], minus=["SRT Tax"]),
+            Derive("amt", plus=["BillValue", "CR Adj"]),
+            Derive("other_discount", plus=["DisFin Adj", "Reversed Payouts"]),
+            Classify("type", "amt", below=0, then="salesreturn", otherwise="sales"),
+        ]
 
 class IkeaGSTR1Report(DateReportModel):
     inum = models.CharField(max_length=30, verbose_name="Invoice No")
@@ -308,6 +519,8 @@ class IkeaGSTR1Report(DateReportModel):
     class Report(DateReportModel.Report):
         fetcher = IkeaDownloader.gstr_report
         date_format = "%d/%m/%Y"
+        cache_date_column = "Invoice Date"
+        shard_days = 7
         column_map = {
             "Invoice No": "inum",
             "Invoice Date": "date",
@@ -326,15 +539,14 @@ class IkeaGSTR1Report(DateReportModel):
             "Debit/Credit No": "credit_note_no" ,
             "Original Invoice No": "original_invoice_no"
         }
-
-        @classmethod
-        def custom_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
-            df["type"] = df["Transactions"].replace({ "SECONDARY BILLING" : "sales" , 
-                                                      "SALES RETURN" : "salesreturn", 
-                                                      "CLAIMS SERVICE" : "claimservice" },inplace=False)
-            df["party_id"] = df["party_id"].fillna("HUL") #For claimservice entries
-            df["hsn"] = df["hsn"].astype(str).str.replace(".","")
-            return df
+        column_specs = [
+            Map("type", "Transactions", { "SECONDARY BILLING" : "sales" ,
+                                          "SALES RETURN" : "salesreturn",
+                                          "CLAIMS SERVICE" : "claimservice" }),
+            Coerce("type", "category"),
+            FillNa("party_id", "HUL"), #For claimservice entries
+            Replace("hsn", "."),
+        ]
 
 class DmgShtReport(DateReportModel):
     inum = models.CharField(max_length=100, verbose_name="Damage Invoice No")
@@ -357,15 +569,15 @@ class DmgShtReport(DateReportModel):
 
     class Report(DateReportModel.Report):
         fetcher = lambda ikea,fromd,tod : IkeaDownloader.damage_proposals(ikea,fromd,tod,"sales")
+        cache_date_column = "TRANS DATE"
         column_map = { "TRANS REF NO":"inum" , "TRANS DATE":"date" ,  "RETAILER CODE" : "party_id" , "RETAILER NAME" : "party_name",
                        "PRODUCT CODE":"stock_id","PRODUCT NAME" : "desc" ,"QTY/FREE QTY":"qty" ,"TOTAL TUR VALUE":"amt",
                         "TSO PLG": "plg" , "CREDIT NOTE NO" : "credit_note_no" , "Original Bill No" : "original_invoice_no"  }
-        @classmethod
-        def custom_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
-            df["return_from"] = df["TRANSACTION TYPE"].apply(lambda x : "rs" if x.startswith("RS") else "market")
-            df["type"] = df["TRANSACTION TYPE"].apply(lambda x : "damage" if x.endswith("DMG") else "shortage")
-            df["party_id"] = df["party_id"].fillna("HUL") #For RS entries
-            return df
+        column_specs = [
+            Classify("return_from", "TRANSACTION TYPE", startswith="RS", then="rs", otherwise="market"),
+            Classify("type", "TRANSACTION TYPE", endswith="DMG", then="damage", otherwise="shortage"),
+            FillNa("party_id", "HUL"), #For RS entries
+        ]
 
 class StockHsnRateReport(EmptyReportModel):
     stock_id = models.CharField(max_length=8, verbose_name="Product Code")
@@ -406,14 +618,14 @@ class PartyReport(EmptyReportModel):
             "Party Master Code": "master_code"
         }
         dropna_columns = ["code"]
-        @classmethod
-        def custom_preprocessing(cls, df: pd.DataFrame) -> pd.DataFrame:
-            df.drop_duplicates(subset="code",inplace=True)
-            df["phone"] = 1
-            strips = lambda df,val : df.str.split(val).str[0].str.strip(" \t,")
-            df["phone"] = df["addr"].str.split("PH :").str[1].str.strip()
-            df["addr"] = strips( strips( strips( df["addr"] , "TRICHY" )  , "PH :" ) , "N.A" )
-            return df
+        unique_columns = ["code"]
+        chunksize = 5000
+        column_specs = [
+            SplitPart("phone", "addr", "PH :", index=1),
+            SplitPart("addr", "addr", "TRICHY", strip=" \t,"),
+            SplitPart("addr", "addr", "PH :", strip=" \t,"),
+            SplitPart("addr", "addr", "N.A", strip=" \t,"),
+        ]
 
     class Meta: # type: ignore
         db_table = "party_report"
@@ -435,12 +647,12 @@ class UserReportModel(BaseReportModel[ArgsT]):
     ) -> int | None:
         df = cls.Report.get_dataframe(fetcher_obj, args)
         df["user_id"] = user.pk
-        cls.delete_before_insert(user,args)
-        inserted_rows = cls.save_to_db(df)
+        inserted_rows = cls.reload(user, args, df)
         return inserted_rows
 
 class GSTR1Portal(UserReportModel[MonthArgs]):
     arg_type = MonthArgs
+    partitioning = PeriodPartitioning("user_id", "period")
     period = models.CharField(max_length=6, verbose_name="Period (MMYYYY)")
     date = models.DateField(verbose_name="Invoice Date")
     inum = models.CharField(max_length=30, verbose_name="Invoice No")
@@ -479,6 +691,10 @@ class GSTR1Portal(UserReportModel[MonthArgs]):
     class Meta: # type: ignore
         db_table = "gstr1_portal"
 
+    @classmethod
+    def partition_months(cls, args: MonthArgs) -> list | None:
+        return [str(args)]
+
     @classmethod
     def delete_before_insert(cls, user: User,args: MonthArgs):
         cls.objects.filter(user = user,period = str(args)).delete()
@@ -0,0 +1,145 @@
+from dataclasses import dataclass, field
+from typing import Any, Callable
+import numpy as np
+import pandas as pd
+
+# Declarative column specs for BaseReport.column_specs.
+# Each spec is applied in order on the whole column (no row wise .apply).
+# String transforms run once per distinct value (pd.factorize) and are scattered back with the codes ,
+# as report columns like transaction types , hsn or party codes repeat a lot.
+
+def map_distinct(series: pd.Series, func: Callable[[Any], Any], na_value: Any = np.nan) -> np.ndarray:
+    """func applied on the distinct non null values of the series (nulls become na_value)"""
+    codes, uniques = pd.factorize(series, use_na_sentinel=True)
+    results = np.empty(len(uniques) + 1, dtype=object)
+    results[:-1] = [func(value) for value in uniques]
+    results[-1] = na_value  # code -1 (null) picks the last slot
+    return results[codes]
+
+class ColumnSpec:
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        raise NotImplementedError("apply method not implemented.")
+
+    def inputs(self) -> list[str]:
+        """Columns the spec reads"""
+        return [self.column] # type: ignore
+
+@dataclass
+class Derive(ColumnSpec):
+    """column = sum(plus) - sum(minus)"""
+    column: str
+    plus: list[str]
+    minus: list[str] = field(default_factory=list)
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        value = df[self.plus[0]].to_numpy()
+        for col in self.plus[1:]:
+            value = value + df[col].to_numpy()
+        for col in self.minus:
+            value = value - df[col].to_numpy()
+        df[self.column] = value
+        return df
+
+    def inputs(self) -> list[str]:
+        return self.plus + self.minus
+
+@dataclass
+class Classify(ColumnSpec):
+    """column = then if the source matches (startswith / endswith / below) else otherwise (as a category)"""
+    column: str
+    source: str
+    then: Any
+    otherwise: Any
+    startswith: str | None = None
+    endswith: str | None = None
+    below: float | None = None
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        source = df[self.source]
+        if self.below is not None:
+            matches = (source.to_numpy() < self.below)
+        elif self.startswith is not None:
+            matches = map_distinct(source, lambda x: x.startswith(self.startswith), False).astype(bool)
+        elif self.endswith is not None:
+            matches = map_distinct(source, lambda x: x.endswith(self.endswith), False).astype(bool)
+        else:
+            raise ValueError(f"Classify({self.column}) needs one of startswith , endswith or below")
+        df[self.column] = pd.Categorical.from_codes(matches.astype(np.int8), categories=[self.otherwise, self.then])
+        return df
+
+    def inputs(self) -> list[str]:
+        return [self.source]
+
+@dataclass
+class Map(ColumnSpec):
+    """column = mapping[source] (values not in the mapping are kept)"""
+    column: str
+    source: str
+    mapping: dict
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df[self.column] = map_distinct(df[self.source], lambda x: self.mapping.get(x, x))
+        return df
+
+    def inputs(self) -> list[str]:
+        return [self.source]
+
+@dataclass
+class FillNa(ColumnSpec):
+    column: str
+    value: Any
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df[self.column] = df[self.column].fillna(self.value)
+        return df
+
+@dataclass
+class Replace(ColumnSpec):
+    """Substring replace on the column as str (like .astype(str).str.replace)"""
+    column: str
+    old: str
+    new: str = ""
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df[self.column] = map_distinct(df[self.column], lambda x: str(x).replace(self.old, self.new),
+                                       str(np.nan).replace(self.old, self.new))
+        return df
+
+@dataclass
+class SplitPart(ColumnSpec):
+    """column = source.split(sep)[index].strip(strip) , null if the part does not exist"""
+    column: str
+    source: str
+    sep: str
+    index: int = 0
+    strip: str | None = None
+
+    def _part(self, value: Any) -> Any:
+        if not isinstance(value, str):
+            return np.nan
+        parts = value.split(self.sep)
+        if self.index >= len(parts):
+            return np.nan
+        return parts[self.index].strip(self.strip)
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df[self.column] = map_distinct(df[self.source], self._part)
+        return df
+
+    def inputs(self) -> list[str]:
+        return [self.source]
+
+@dataclass
+class Coerce(ColumnSpec):
+    """Compact dtype for the column (eg: category for labels , Int32 for quantities)"""
+    column: str
+    dtype: str
+
+    def apply(self, df: pd.DataFrame) -> pd.DataFrame:
+        df[self.column] = df[self.column].astype(self.dtype)
+        return df
+
+def apply_specs(df: pd.DataFrame, specs: list[ColumnSpec]) -> pd.DataFrame:
+    for spec in specs:
+        df = spec.apply(df)
+    return df
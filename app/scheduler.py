@@ -0,0 +1,92 @@
+import contextvars
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+import time
+from typing import Any, Callable
+
+@dataclass
+class Task:
+    name: str
+    func: Callable[[], Any]
+    depends_on: list[str] = field(default_factory=list)
+
+@dataclass
+class TaskResult:
+    name: str
+    start: float = 0.0
+    end: float = 0.0
+    result: Any = None
+    error: BaseException | None = None
+    skipped: bool = False  # A dependency failed
+
+    @property
+    def duration(self) -> float:
+        return self.end - self.start
+
+def run_dag(tasks: list[Task], max_workers: int = 8) -> dict[str, TaskResult]:
+    """Run the tasks in threads , each as soon as all its dependencies are done.
+    If a task raises , the tasks depending on it (directly or not) are skipped"""
+    by_name = {task.name: task for task in tasks}
+    for task in tasks:
+        unknown = [dep for dep in task.depends_on if dep not in by_name]
+        if unknown:
+            raise ValueError(f"Task {task.name} depends on unknown tasks : {unknown}")
+
+    results = {task.name: TaskResult(task.name) for task in tasks}
+    pending = {task.name: set(task.depends_on) for task in tasks}
+    running: dict[Future, str] = {}
+
+    def run_task(task: Task) -> Any:
+        results[task.name].start = time.perf_counter()
+        try:
+            return task.func()
+        finally:
+            results[task.name].end = time.perf_counter()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        while pending or running:
+            #A skipped task can make its dependents ready (to be skipped too) , so look again until nothing is ready
+            ready = [name for name, deps in pending.items() if not deps]
+            while ready:
+                for name in ready:
+                    del pending[name]
+                    failed_deps = [dep for dep in by_name[name].depends_on if results[dep].error or results[dep].skipped]
+                    if failed_deps:
+                        results[name].skipped = True
+                        _finish(name, pending)
+                        continue
+                    #The task runs in a copy of the caller's context (eg: the active import recorder , see app/instrumentation.py)
+                    running[executor.submit(contextvars.copy_context().run, run_task, by_name[name])] = name
+                ready = [name for name, deps in pending.items() if not deps]
+            if not running:
+                if pending:  # Nothing can run and nothing will finish
+                    raise ValueError(f"Dependency cycle between tasks : {sorted(pending)}")
+                break
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name].result = future.result()
+                except Exception as e:
+                    results[name].error = e
+                _finish(name, pending)
+    return results
+
+def _finish(name: str, pending: dict[str, set[str]]):
+    for deps in pending.values():
+        deps.discard(name)
+
+def critical_path(tasks: list[Task], results: dict[str, TaskResult]) -> list[TaskResult]:
+    """The chain of tasks that decided the wall time : from the task that finished last ,
+    repeatedly step to the dependency that finished last"""
+    by_name = {task.name: task for task in tasks}
+    finished = [result for result in results.values() if not result.skipped]
+    if not finished:
+        return []
+    path = [max(finished, key=lambda result: result.end)]
+    while True:
+        deps = [results[dep] for dep in by_name[path[-1].name].depends_on if not results[dep].skipped]
+        if not deps:
+            break
+        path.append(max(deps, key=lambda result: result.end))
+    return path[::-1]
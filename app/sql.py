@@ -1,4 +1,7 @@
+import io
 from sqlalchemy import create_engine
+from django.db import connection
+import pandas as pd
 from myerpv2 import settings
 
 engine = create_engine(
@@ -6,3 +9,41 @@ engine = create_engine(
     f"{settings.DATABASES['default']['HOST']}:{settings.DATABASES['default']['PORT']}/"
     f"{settings.DATABASES['default']['NAME']}"
 , echo = False)
+
+COPY_NULL = r"\N"
+
+class DataFrameCSVStream(io.TextIOBase):
+    """Read-only file object which renders a dataframe as CSV lazily , chunk_rows rows at a time.
+    Used as the STDIN of COPY so the whole CSV is never held in memory."""
+
+    def __init__(self, df: pd.DataFrame, chunk_rows: int = 10000):
+        self._chunks = (
+            df.iloc[i : i + chunk_rows].to_csv(index=False, header=False, na_rep=COPY_NULL)
+            for i in range(0, len(df), chunk_rows)
+        )
+        self._current = io.StringIO()
+
+    def readable(self) -> bool:
+        return True
+
+    def read(self, size: int | None = -1) -> str:
+        while True:
+            data = self._current.read(size)
+            if data:
+                return data
+            next_chunk = next(self._chunks, None)
+            if next_chunk is None:
+                return ""
+            self._current = io.StringIO(next_chunk)
+
+def copy_dataframe(df: pd.DataFrame, db_table: str, columns: list[str], chunk_rows: int = 10000) -> int:
+    """Bulk load the dataframe columns into db_table using COPY FROM STDIN over the django connection.
+    Empty strings are kept as empty strings and NaN/None are loaded as NULL (same as to_sql)"""
+    quote = connection.ops.quote_name
+    sql = (
+        f"COPY {quote(db_table)} ({', '.join(quote(col) for col in columns)}) "
+        f"FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    )
+    with connection.cursor() as cur:
+        cur.copy_expert(sql, DataFrameCSVStream(df[columns], chunk_rows))
+    return len(df)
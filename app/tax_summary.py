@@ -0,0 +1,94 @@
+import datetime
+from django.db import connection, transaction
+from django.db.models import F, OuterRef, Q, Subquery
+import app.models as models
+from app.company_models import Company
+from app.master_cache import version_on_commit
+
+# Per invoice gst tax of the sales (SalesTaxSummary) and its lines summed by hsn & rate (SalesTaxLine),
+# built with set based INSERT .. SELECT from the inventory (and the hsn of the stock master).
+# The imports refresh the invoices of their date range in their own transaction (so a failed import keeps the
+# summaries of the sales it leaves) , gst.generate reads the rows of the period (and refreshes the invoices of the
+# period which are missing or were built with an older stock master).
+
+def _refresh(company_id: str, bills: list[str]) -> int:
+    quote = connection.ops.quote_name
+    summary = quote(models.SalesTaxSummary._meta.db_table)
+    lines = quote(models.SalesTaxLine._meta.db_table)
+    sales = quote(models.Sales._meta.db_table)
+    inventory = quote(models.Inventory._meta.db_table)
+    stock = quote(models.Stock._meta.db_table)
+    #Stamped with the version this transaction commits with (the hsn written by the import itself is used here)
+    params = {"company": company_id, "bills": bills, "hsn_version": version_on_commit(company_id, "hsn_version")}
+    cur = connection.cursor()
+    cur.execute(f"DELETE FROM {summary} WHERE company_id = %(company)s AND inum = ANY(%(bills)s)", params)
+    cur.execute(f"DELETE FROM {lines} WHERE company_id = %(company)s AND bill_id = ANY(%(bills)s)", params)
+    cur.execute(f"""
+        INSERT INTO {summary} (company_id, inum, date, txval, zero_rate_txval, cgst, hsn_version)
+        SELECT s.company_id, s.inum, s.date, coalesce(sum(i.txval), 0),
+               coalesce(sum(CASE WHEN i.rt = 0 THEN i.txval ELSE 0 END), 0),
+               coalesce(sum(round(i.txval * i.rt / 100, 3)), 0),
+               %(hsn_version)s
+        FROM {sales} s LEFT JOIN {inventory} i ON i.company_id = s.company_id AND i.bill_id = s.inum
+        WHERE s.company_id = %(company)s AND s.inum = ANY(%(bills)s)
+        GROUP BY s.company_id, s.inum, s.date
+    """, params)
+    cur.execute(f"""
+        INSERT INTO {lines} (company_id, bill_id, hsn, rt, qty, txval, cgst)
+        SELECT i.company_id, i.bill_id, st.hsn, i.rt, sum(i.qty * sign(i.txval)), sum(i.txval),
+               sum(round(i.rt * i.txval / 100, 3))
+        FROM {inventory} i LEFT JOIN {stock} st ON st.company_id = i.company_id AND st.name = i.stock_id
+        WHERE i.company_id = %(company)s AND i.bill_id = ANY(%(bills)s) AND i.txval <> 0
+        GROUP BY i.company_id, i.bill_id, st.hsn, i.rt
+    """, params)
+    return len(bills)
+
+@transaction.atomic
+def refresh_tax_summary(company: Company, fromd: datetime.date, tod: datetime.date, types: list[str] | None = None) -> int:
+    """Rebuild the tax summary of the sales (of the types , default all) dated fromd to tod.
+    Summaries of the period whose bill is no longer in sales are removed. Returns the number of invoices"""
+    cur = connection.cursor()
+    cur.execute(
+        f"""DELETE FROM {connection.ops.quote_name(models.SalesTaxSummary._meta.db_table)} s
+            WHERE s.company_id = %(company)s AND s.date >= %(fromd)s AND s.date <= %(tod)s AND (
+                %(types)s::varchar[] IS NULL OR NOT EXISTS (
+                    SELECT 1 FROM {connection.ops.quote_name(models.Sales._meta.db_table)} b
+                    WHERE b.company_id = s.company_id AND b.inum = s.inum AND b.type <> ALL(%(types)s::varchar[])))
+            RETURNING s.inum""",
+        {"company": company.pk, "fromd": fromd, "tod": tod, "types": types},
+    )
+    removed = [row[0] for row in cur.fetchall()]
+    sales_qs = models.Sales.objects.filter(company=company)
+    if types is not None:
+        sales_qs = sales_qs.filter(type__in=types)
+    bills = set(sales_qs.filter(date__gte=fromd, date__lte=tod).values_list("inum", flat=True))
+    #Removed bills still in sales (dated outside the period now) are rebuilt , the lines of the others are removed
+    bills |= set(sales_qs.filter(inum__in=removed).values_list("inum", flat=True))
+    cur.execute(
+        f"DELETE FROM {connection.ops.quote_name(models.SalesTaxLine._meta.db_table)} WHERE company_id = %s AND bill_id = ANY(%s)",
+        [company.pk, [bill for bill in removed if bill not in bills]],
+    )
+    return _refresh(company.pk, sorted(bills))
+
+@transaction.atomic
+def refresh_bills_tax_summary(company: Company, bills: list[str]) -> int:
+    """Rebuild the tax summary of the bills (eg: after their date is changed). Returns the number of invoices"""
+    return _refresh(company.pk, bills)
+
+@transaction.atomic
+def refresh_stale_tax_summary(sales_qs) -> int:
+    """Rebuild the tax summary of the sales (queryset) which have none or were built with an older stock master.
+    Returns the number of invoices refreshed"""
+    version = models.SalesTaxSummary.objects.filter(company_id=OuterRef("company_id"), inum=OuterRef("inum")).values("hsn_version")
+    stale = (
+        sales_qs.annotate(summary_version=Subquery(version))
+        .filter(Q(summary_version__isnull=True) | ~Q(summary_version=F("company__hsn_version")))
+        .order_by()
+        .values_list("company_id", "inum")
+    )
+    bills_by_company: dict[str, list[str]] = {}
+    for company_id, inum in stale.iterator():
+        bills_by_company.setdefault(company_id, []).append(inum)
+    for company_id, bills in bills_by_company.items():
+        _refresh(company_id, bills)
+    return sum(len(bills) for bills in bills_by_company.values())
@@ -1,3 +1,144 @@
-from django.test import TestCase
+import datetime
+import pandas as pd
+import random
+from contextlib import contextmanager
+from types import SimpleNamespace
+from unittest.mock import patch
+from django.db import connection
+from django.test import SimpleTestCase, TestCase
 
-# Create your tests here.
+import app.models as models
+from app.company_models import Company, User
+from app.erp_import import GstFilingImport, SalesImport
+from app.management.commands.bench_preprocessing import raw_salesregister
+from app.management.commands.bench_sales_import import synthetic_reports
+from app.master_cache import company_version, master_cache, master_version
+from app.report_models import DateRangeArgs, EmptyArgs, IkeaGSTR1Report, PartyReport, SalesRegisterReport, pin_dtypes
+from app.tax_summary import refresh_stale_tax_summary
+
+from app.scheduler import Task, run_dag
+
+class RunDagTests(SimpleTestCase):
+    def test_failure_skips_a_chain_of_dependents(self):
+        def fail():
+            raise RuntimeError("sales failed")
+        tasks = [
+            Task("Sales", fail),
+            Task("Stock", lambda: "stock", ["Sales"]),
+            Task("Market", lambda: "market", ["Sales", "Stock"]),
+        ]
+        results = run_dag(tasks)
+        self.assertIsInstance(results["Sales"].error, RuntimeError)
+        self.assertTrue(results["Stock"].skipped)
+        self.assertTrue(results["Market"].skipped)
+
+    def test_cycle_is_reported(self):
+        with self.assertRaises(ValueError):
+            run_dag([Task("a", lambda: 1, ["b"]), Task("b", lambda: 2, ["a"])])
+
+class CommitTestCase(TestCase):
+    @contextmanager
+    def commit(self):
+        """Run the on_commit callbacks of the block and drop them , like a commit of the block would"""
+        start = len(connection.run_on_commit)
+        with self.captureOnCommitCallbacks(execute=True):
+            yield
+        del connection.run_on_commit[start:]
+
+class MasterVersionTests(CommitTestCase):
+    def setUp(self):
+        master_cache.clear()
+        self.company = Company.objects.create(name="test", user=User.objects.create(username="test"))
+
+    def upsert_party(self, name):
+        party = models.Party(company=self.company, code="P1", name=name, master_code="M1", addr="", phone="", ctin=None)
+        with self.commit():
+            return master_cache.upsert(models.Party, self.company, [party], ["name"])
+
+    def test_party_write_bumps_only_the_party_version(self):
+        self.assertEqual(self.upsert_party("A"), 1)
+        self.assertEqual(master_version(models.Party, self.company.pk), 1)
+        self.assertEqual(master_version(models.Stock, self.company.pk), 0)
+
+    def test_unchanged_rows_do_not_bump(self):
+        self.upsert_party("A")
+        self.assertEqual(self.upsert_party("A"), 0)
+        self.assertEqual(master_version(models.Party, self.company.pk), 1)
+
+class TaxSummaryVersionTests(CommitTestCase):
+    def setUp(self):
+        master_cache.clear()
+        self.company = Company.objects.create(name="test", user=User.objects.create(username="test"))
+        self.args = DateRangeArgs(fromd=datetime.date(2025, 4, 1), tod=datetime.date(2025, 4, 30))
+        synthetic_reports(self.company, 200, self.args.fromd, days=29)
+
+    def test_import_then_generate_does_not_rebuild(self):
+        with self.commit():
+            SalesImport.run_atomic(self.company, self.args)
+        # The import wrote the hsn of new stocks , its summaries are built with them
+        self.assertEqual(company_version(self.company.pk, "hsn_version"), 1)
+        self.assertEqual(refresh_stale_tax_summary(models.Sales.objects.filter(company=self.company)), 0)
+
+        # A party or stock description change does not outdate the summaries , an hsn change does
+        stock = models.Stock.objects.filter(company=self.company).first()
+        with self.commit():
+            master_cache.upsert(models.Stock, self.company, [models.Stock(company=self.company, name=stock.name, desc="new")], ["desc"])
+        self.assertEqual(refresh_stale_tax_summary(models.Sales.objects.filter(company=self.company)), 0)
+        with self.commit():
+            master_cache.upsert(models.Stock, self.company, [models.Stock(company=self.company, name=stock.name, hsn="999999")], ["hsn"])
+        sales = models.Sales.objects.filter(company=self.company)
+        self.assertEqual(refresh_stale_tax_summary(sales), sales.count())
+        self.assertEqual(refresh_stale_tax_summary(sales), 0)
+
+class ShardedFetchTests(TestCase):
+    #Two shards of 7 days
+    args = DateRangeArgs(fromd=datetime.date(2025, 4, 1), tod=datetime.date(2025, 4, 14))
+
+    def sales_reg_session(self, rows: int):
+        """IKEA session whose sales register has the rows on 1st April (the report is None for a range without bills)"""
+        raw = raw_salesregister(random.Random(1), rows)
+        report = lambda key, pat, replaces: raw.copy() if rows and replaces[0] == "01/04/2025" else None
+        return SimpleNamespace(report=report)
+
+    def test_empty_shard_is_skipped(self):
+        df = SalesRegisterReport.Report.get_dataframe(self.sales_reg_session(10), self.args)
+        self.assertEqual(len(df), 10)
+
+    def test_all_shards_empty(self):
+        company = Company.objects.create(name="test", user=User.objects.create(username="test"))
+        self.assertEqual(SalesRegisterReport.update_db(self.sales_reg_session(0), company, self.args), 0)
+        with patch.object(IkeaGSTR1Report.Report, "fetcher", lambda session, fromd, tod: None):
+            self.assertEqual(IkeaGSTR1Report.update_db(SimpleNamespace(), company, self.args), 0)
+
+class ReplaySalesChangesTests(TestCase):
+    def test_only_bills_deleted_from_the_period_are_missing(self):
+        company = Company.objects.create(name="test", user=User.objects.create(username="test"))
+        models.Sales.objects.create(company=company, inum="A1", party_id="P1", date=datetime.date(2025, 4, 2), amt=100, type="sales")
+        #A1 is in sales , A2 was in the period & deleted by the import , A3 is a bill of another period no longer in sales
+        for inum in ["A1", "A2", "A3"]:
+            models.SalesChanges.objects.create(company=company, bill_id=inum, field="ctin", new_value=f"CTIN{inum}")
+        args = DateRangeArgs(fromd=datetime.date(2025, 4, 1), tod=datetime.date(2025, 4, 30))
+        self.assertEqual(GstFilingImport.replay_sales_changes(company, args, ["A1", "A2"]), ["A2"])
+        self.assertEqual(models.Sales.objects.get(company=company, inum="A1").ctin, "CTINA1")
+
+class ChunkedFetchTests(SimpleTestCase):
+    def test_download_is_retried(self):
+        calls = []
+        def party_master(session, chunksize):
+            calls.append(chunksize)
+            if len(calls) == 1:
+                raise ConnectionError("reset")
+            return iter([pd.DataFrame({"PARTY CODE": ["P1"]}), pd.DataFrame({"PARTY CODE": ["P2"]})])
+        with patch.object(PartyReport.Report, "fetcher", party_master), patch.object(PartyReport.Report, "max_retry", 2):
+            chunks = list(PartyReport.Report.fetch_raw_chunks(SimpleNamespace(), EmptyArgs()))
+        self.assertEqual(len(calls), 2)
+        self.assertEqual([list(df["PARTY CODE"]) for df in chunks], [["P1"], ["P2"]])
+
+    def test_chunks_keep_the_dtypes_of_the_first(self):
+        chunks = [pd.DataFrame({"phone": [98765, 98766], "addr": [None, None]}),
+                  pd.DataFrame({"phone": [98767, None], "addr": ["TRICHY", None]})]
+        first, second = pin_dtypes(iter(chunks))
+        self.assertEqual(first["phone"].dtype, "Int64")
+        self.assertEqual(second["phone"].dtype, "Int64")
+        self.assertEqual(second["phone"].iloc[0], 98767)
+        self.assertEqual(second["addr"].dtype, object)
@@ -14,6 +14,7 @@ from uuid import uuid1
 import toml
 from bs4 import BeautifulSoup
 import shutil
+import threading
 from pymongo import MongoClient
 from .std import get_mongo
 import urllib3
@@ -201,6 +202,10 @@ class Session(requests.Session, ABC):
 
     def __init__(self,user:str):
         super().__init__()
+        #Response body bytes received by this session (import stage instrumentation)
+        self.bytes_downloaded = 0
+        #Shards of a report are fetched concurrently over the same session
+        self._bytes_lock = threading.Lock()
         self.headers.update(
             {
                 "User-Agent": "Mozilla/5.0 (X11; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/104.0.0.0 Safari/537.36"
@@ -250,6 +255,8 @@ class Session(requests.Session, ABC):
             if self.base_url not in request.url : 
                 request.url = self.base_url + request.url.split(".com")[1]
         response = super().send(request, *args, **(kwargs | {"verify":False,"timeout":1200}))
+        with self._bytes_lock:
+            self.bytes_downloaded += len(response.content)
         try : 
             self.logger.log_response(response)
         except Exception as e : 
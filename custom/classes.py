@@ -2,6 +2,7 @@ from collections import defaultdict
 import copy
 import datetime
 from io import BytesIO
+from typing import Iterator
 import warnings
 import dateutil.relativedelta as relativedelta
 import json
@@ -27,6 +28,7 @@ import os
 from io import StringIO
 from .secondarybills import main as secondarybills
 from .curl import get_curl , curl_replace 
+from .excel import iter_excel_chunks
 from .Session import Session,StatusCodeError
 from bs4 import BeautifulSoup
 from PyPDF2 import PdfMerger
@@ -82,9 +84,13 @@ class BaseIkea(Session) :
                 f.write(response_buffer.getbuffer())          
           return response_buffer 
       
-      def download_dataframe(self,key,skiprows=0,sheet=None) -> pd.DataFrame : 
+      def download_dataframe(self,key,skiprows=0,sheet=None,chunksize=None) -> pd.DataFrame | Iterator[pd.DataFrame] : 
+          """With chunksize , the sheet is streamed as an iterator of dataframes (constant memory).
+          Footer rows are kept (the reports drop them , see BaseReport.ignore_last_nrows)"""
           kwargs = {} if sheet is None else {"sheet_name":sheet}
           durl = get_curl(key).send(self).text
+          if chunksize is not None : 
+             return iter_excel_chunks( self.get_buffer(durl) , skiprows = skiprows , chunksize = chunksize , **kwargs )
           return pd.read_excel( self.get_buffer(durl) , skiprows = skiprows , **kwargs , engine="openpyxl")
        
       def is_logged_in(self) :
@@ -198,6 +204,7 @@ class IkeaDownloader(BaseIkea) :
       def sales_reg(self,fromd,tod) : 
           df = self.report("ikea/sales_reg",r'(":val1":").{10}(",":val2":").{10}' ,
                                                        (fromd.strftime("%d/%m/%Y"),tod.strftime("%d/%m/%Y")) )
+          if df is None : return None #No bills in the range
           date_column = "BillDate/Sales Return Date"
           try :
               date_series = pd.to_datetime(df[date_column],format="%Y-%m-%d")
@@ -264,11 +271,11 @@ class IkeaDownloader(BaseIkea) :
       def product_hsn(self) -> dict : 
           return get_curl("ikea/list_of_products").send(self).json() 
       
-      def party_master(self) -> pd.DataFrame : 
-          return self.download_dataframe("ikea/party_master",skiprows=9)
+      def party_master(self,chunksize=None) -> pd.DataFrame : 
+          return self.download_dataframe("ikea/party_master",skiprows=9,chunksize=chunksize)
       
-      def stock_master(self) -> pd.DataFrame : 
-          return self.download_dataframe("ikea/stock_master",skiprows=9)
+      def stock_master(self,chunksize=None) -> pd.DataFrame : 
+          return self.download_dataframe("ikea/stock_master",skiprows=9,chunksize=chunksize)
       
       def basepack(self,is_dataframe = False) : 
           return self.report("ikea/basepack","","",is_dataframe = is_dataframe) 
@@ -798,10 +805,14 @@ class Gst(Session) :
          all.to_excel(writer,sheet_name="Detailed",index=False)
          writer.close()   
      
-     def get_einv_data(self,seller_gstin,period,doctype,inum) : 
+     @staticmethod
+     def einv_fy(period) -> str : #Financial year of the period (MMYYYY) , eg: 2025-26
          p = datetime.datetime.strptime( "01" + period , "%d%m%Y" )
          year = (p.year - 1) if p.month < 4 else p.year 
-         fy = f"{year}-{(year+1)%100}"
+         return f"{year}-{(year+1)%100}"
+
+     def get_einv_data(self,seller_gstin,period,doctype,inum) : 
+         fy = self.einv_fy(period)
          params = {'stin': seller_gstin ,'fy': fy ,'doctype': doctype ,'docnum': str(inum) ,'usertype': 'seller'}
          data = self.get('https://einvoice.gst.gov.in/einvoice/auth/api/getIrnData',
              params=params, headers = { 'Referer': 'https://einvoice.gst.gov.in/einvoice/jsonDownload' }
@@ -0,0 +1,72 @@
+from typing import IO, Iterator
+import openpyxl
+import pandas as pd
+
+ERROR_VALUES = {"#N/A", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#NULL!"}
+
+def _convert_cell(value):
+    # Same cell conversions as pandas' openpyxl reader
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    if isinstance(value, str) and value in ERROR_VALUES:
+        return None
+    return value
+
+def _header_names(row: tuple) -> list[str]:
+    # Unnamed / duplicate headers are named like pandas does ("Unnamed: 3" , "Amount.1")
+    names: list[str] = []
+    counts: dict[str, int] = {}
+    for i, value in enumerate(row):
+        name = f"Unnamed: {i}" if value is None else str(value)
+        if name in counts:
+            counts[name] += 1
+            name = f"{name}.{counts[name]}"
+        else:
+            counts[name] = 0
+        names.append(name)
+    return names
+
+def iter_excel_chunks(
+    file: IO[bytes],
+    skiprows: int = 0,
+    sheet_name: str | int | None = None,
+    chunksize: int = 5000,
+) -> Iterator[pd.DataFrame]:
+    """Stream an xlsx sheet as dataframes of chunksize rows (openpyxl read only mode),
+    instead of materialising the whole sheet like pd.read_excel.
+    skiprows , sheet_name behave like pd.read_excel (blank rows are skipped)."""
+    file.seek(0)
+    workbook = openpyxl.load_workbook(file, read_only=True, data_only=True, keep_links=False)
+    try:
+        if sheet_name is None or isinstance(sheet_name, int):
+            sheet = workbook.worksheets[sheet_name or 0]
+        else:
+            sheet = workbook[sheet_name]
+
+        rows = sheet.iter_rows(values_only=True)
+        for _ in range(skiprows):
+            if next(rows, None) is None:
+                return
+
+        columns: list[str] | None = None
+        chunk: list[list] = []
+        is_yielded = False
+        for raw_row in rows:
+            row = [_convert_cell(value) for value in raw_row]
+            if all(value is None for value in row):
+                continue
+            if columns is None:
+                while row and row[-1] is None:
+                    row.pop()
+                columns = _header_names(tuple(row))
+                continue
+            row = (row + [None] * len(columns))[: len(columns)]
+            chunk.append(row)
+            if len(chunk) >= chunksize:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+                is_yielded = True
+        if chunk or not is_yielded:
+            yield pd.DataFrame(chunk, columns=columns)
+    finally:
+        workbook.close()